@@ -0,0 +1,90 @@
+""" Micro-benchmark - packets/sec of the single pass decode_packet() against the previous decode path, --min-speedup fails the run if the gain is lost """
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from weatherflow.core import decode_packet  # noqa: E402
+import baseline  # noqa: E402
+
+# Sample packets from the WeatherFlow Tempest UDP Reference - v170
+PACKETS = {
+    'obs_st': '{"serial_number": "ST-00000512", "type": "obs_st", "hub_sn": "HB-00013030", "obs": [[1588948614, 0.18, 0.22, 0.27, 144, 6, 1017.57, 22.37, 50.26, 328, 0.03, 3, 0.000000, 0, 0, 0, 2.410, 1]], "firmware_revision": 129}',
+    'rapid_wind': '{"serial_number": "SK-00008453", "type": "rapid_wind", "hub_sn": "HB-00000001", "ob": [1493322445, 2.3, 128]}',
+    'evt_strike': '{"serial_number": "AR-00004049", "type": "evt_strike", "hub_sn": "HB-00000001", "evt": [1493322445, 27, 3848]}',
+    'evt_precip': '{"serial_number": "SK-00008453", "type": "evt_precip", "hub_sn": "HB-00000001", "evt": [1493322445]}',
+    'device_status': '{"serial_number": "AR-00004049", "type": "device_status", "hub_sn": "HB-00000001", "timestamp": 1510855923, "uptime": 2189, "voltage": 3.50, "firmware_revision": 17, "rssi": -17, "hub_rssi": -87, "sensor_status": 0, "debug": 0}',
+    'hub_status': '{"serial_number": "HB-00000001", "type": "hub_status", "firmware_revision": "35", "uptime": 1670133, "rssi": -62, "timestamp": 1495724691, "reset_flags": "BOR,PIN,POR", "seq": 48, "fs": [1, 0, 15675411, 524288], "radio_stats": [2, 1, 0, 3, 2839], "mqtt_stats": [1, 0]}',
+    'invalid': 'not a json packet'
+}
+
+
+def legacy_decode(data, privacy = False):
+    """ Connect.get_event() decode path before decode_packet() - decode, validate, parse again, if/elif chain
+        into the original msg_* decoders (frozen in baseline.py, so later decoder changes don't move this column) """
+    wf_type = False
+    wf_serial = None
+    wf_json = {}
+    try:
+        if baseline.is_json(data.decode("utf-8")):
+            wf_pkt = json.loads(data.decode("utf-8"))
+            if 'type' in wf_pkt:
+                wf_type_pkt = str(wf_pkt['type'])
+                if 'serial_number' in wf_pkt:
+                    wf_serial = baseline.get_serial(wf_pkt)
+                if wf_type_pkt == 'obs_st':
+                    wf_type, wf_json = baseline.msg_obs_st(wf_pkt, privacy)
+                elif wf_type_pkt == 'device_status':
+                    wf_type, wf_json = baseline.msg_device_status(wf_pkt, privacy)
+                elif wf_type_pkt == 'rapid_wind':
+                    wf_type, wf_json = baseline.msg_rapid_wind(wf_pkt, privacy)
+                elif wf_type_pkt == 'evt_strike':
+                    wf_type, wf_json = baseline.msg_evt_strike(wf_pkt, privacy)
+                elif wf_type_pkt == 'evt_precip':
+                    wf_type, wf_json = baseline.msg_evt_precip(wf_pkt, privacy)
+                elif wf_type_pkt == 'hub_status':
+                    wf_type, wf_json = baseline.msg_hub_status(wf_pkt, privacy)
+    except ValueError as e:
+        wf_json = {"error": "Exception Value Error", "value": str(e)}
+    return wf_type, wf_serial, wf_json
+
+
+def packets_per_sec(decode, data, seconds):
+    """ Run decode(data) repeatedly for about the given number of seconds and return the rate """
+    count = 0
+    batch = 1000
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < seconds:
+        for _ in range(batch):
+            decode(data)
+        count += batch
+        elapsed = time.perf_counter() - start
+    return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=float, default=0.5, help="time spent on each measurement")
+    parser.add_argument('--rounds', type=int, default=3, help="alternating before/after measurements, the best of each is kept")
+    parser.add_argument('--min-speedup', type=float, help="exit 1 if a packet type decodes slower than this many times the previous path")
+    args = parser.parse_args()
+    print("{:<15} {:>14} {:>14} {:>8}".format("packet", "before pkt/s", "after pkt/s", "speedup"))
+    slower = []
+    for name, text in PACKETS.items():
+        data = text.encode("utf-8")
+        before = after = 0.0
+        for _ in range(args.rounds):  # Alternate, so a noisy spell doesn't land on only one side
+            before = max(before, packets_per_sec(legacy_decode, data, args.seconds))
+            after = max(after, packets_per_sec(decode_packet, data, args.seconds))
+        print("{:<15} {:>14,.0f} {:>14,.0f} {:>7.2f}x".format(name, before, after, after / before))
+        if args.min_speedup is not None and after / before < args.min_speedup:
+            slower.append(name)
+    if slower:
+        print("Speedup below " + str(args.min_speedup) + "x: " + ", ".join(slower))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
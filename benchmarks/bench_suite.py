@@ -0,0 +1,250 @@
+""" Benchmark Suite - ops/sec and allocations per op for every decoder, the status engine and notification()
+    Results can be saved as JSON (--output) and compared with an earlier run (--compare). Each msg_* decoder
+    is also compared with its frozen baseline (baseline.py) - --max-slowdown fails the run if one falls behind """
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+import weatherflow  # noqa: E402
+from weatherflow import notify  # noqa: E402
+from corpus import *  # noqa: E402
+import baseline  # noqa: E402
+
+# notification() payloads for each event type, as returned by the status routines
+NOTIFICATIONS = {
+    'new_ok': ('station', {'firmware': 129, 'uptime': 2189, 'station_sensors': 'OK', 'battvolts': 2.6, 'Battery Health (%)': 64}),
+    'firmware': ('station', {'old_firmware': 128, 'Station Firmware': 129}),
+    'reboot': ('hub', {'old_uptime': 1670133, 'Reset Reasons': 'Brownout reset|PIN reset'}),
+    'offline': ('station', {'uptime': 2189}),
+    'online': ('station', {'uptime': 2189}),
+    'batt_low': ('station', {'battvolts': 2.39, 'battmode': 2}),
+    'sensors_error': ('station', {'station_sensors': 'Wind Failed', 'old_station_sensors': 'OK', 'battvolts': 2.6, 'battmode': 0}),
+    'strike': ('station', {'strike_distance': 27, 'strike_energy': 3848}),
+    'precip': ('station', {})
+}
+
+
+def reset_status():
+    """ Start the status engine with no known devices """
+    weatherflow.Notifications().open(os.devnull)
+
+
+def fleet_status(count):
+    """ Start the status engine with count stations online """
+    reset_status()
+    for station in range(count):
+        notify.status(notify.msg_device_status(create_station_test(station = station))[1])
+
+
+def instrumented(corpus):
+    """ decode_packet() of every packet with instrumentation enabled - compare with decode_packet.corpus """
+    weatherflow.instrument.enable(log_seconds = None)
+    try:
+        return [weatherflow.decode_packet(data) for data in corpus]
+    finally:
+        weatherflow.instrument.disable()
+
+
+def cycle(values):
+    """ Function returning the next of values on every call """
+    state = {'next': 0}
+
+    def next_value():
+        value = values[state['next'] % len(values)]
+        state['next'] += 1
+        return value
+    return next_value
+
+
+def benchmarks():
+    """ (name, setup, function, ops per call) for every benchmark """
+    packets = create_packets()
+    corpus = create_corpus(2000)
+    decoded = {wf_type: getattr(weatherflow, 'msg_' + wf_type)(wf_pkt)[1] for wf_type, wf_pkt in packets.items()}
+    found = []
+    for wf_type, wf_pkt in packets.items():
+        decoder = getattr(weatherflow, 'msg_' + wf_type)
+        data = bytes(json.dumps(wf_pkt), encoding="utf8")
+        found.append(('msg_' + wf_type, None, lambda decoder=decoder, wf_pkt=wf_pkt: decoder(wf_pkt), 1))
+        legacy = getattr(baseline, 'msg_' + wf_type)
+        found.append(('baseline.msg_' + wf_type, None, lambda legacy=legacy, wf_pkt=wf_pkt: legacy(wf_pkt), 1))
+        found.append(('decode_packet.' + wf_type, None, lambda data=data: weatherflow.decode_packet(data), 1))
+        found.append(('decode_packet.records.' + wf_type, None, lambda data=data: weatherflow.decode_packet(data, records=True), 1))
+    found.append(('decode_packet.corpus', None, lambda: [weatherflow.decode_packet(data) for data in corpus], len(corpus)))
+    found.append(('decode_packet.corpus.instrumented', None, lambda: instrumented(corpus), len(corpus)))
+    status_types = frozenset([b'device_status', b'hub_status'])
+    found.append(('packet_wanted.corpus', None, lambda: [weatherflow.packet_wanted(data, status_types) for data in corpus], len(corpus)))
+
+    for wf_type, evt_json in decoded.items():
+        found.append(('status.' + wf_type, reset_status, lambda evt_json=evt_json: notify.status(dict(evt_json)), 1))
+        data = bytes(json.dumps(packets[wf_type]), encoding="utf8")
+        found.append(('decode_status.records.' + wf_type, reset_status,
+                      lambda data=data: notify.status(weatherflow.decode_packet(data, records=True)[2]), 1))
+    # Steady state - the device is known and nothing changes
+    station = decoded['device_status']
+    hub = decoded['hub_status']
+    found.append(('station_alerts.steady', reset_status, lambda: notify.station_alerts(dict(station)), 1))
+    found.append(('hub_alerts.steady', reset_status, lambda: notify.hub_alerts(dict(hub)), 1))
+    # Changing state - battery voltage moving between modes, hub rebooting
+    voltages = cycle([2.6, 2.4, 2.3, 2.5])
+    found.append(('station_alerts.battery_change', reset_status,
+                  lambda: notify.station_alerts(dict(station, **{'Battery Voltage': voltages()})), 1))
+    uptimes = cycle([5000, 100])
+    found.append(('hub_alerts.reboot', reset_status,
+                  lambda: notify.hub_alerts(dict(hub, **{'Uptime (seconds)': uptimes()})), 1))
+    # Offline check of a 500 device fleet with no device due to go offline
+    found.append(('check_offline_all.500_devices', lambda: fleet_status(500), lambda: notify.check_offline_all(360), 1))
+    for event, (device, payload) in NOTIFICATIONS.items():
+        found.append(('notification.' + event, None,
+                      lambda device=device, event=event, payload=payload: weatherflow.notification(device, 'ST-99999123', event, payload), 1))
+    return found
+
+
+def ops_per_sec(function, ops, seconds):
+    """ Best of several timed runs, after scaling the loop count to take about seconds / 5 each """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds / 5 or loops >= 10 ** 7:
+            break
+        loops *= 2 if elapsed > seconds / 50 else 10
+    best = elapsed
+    for _ in range(4):
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        best = min(best, time.perf_counter() - start)
+    return loops * ops / best
+
+
+def paired_ops_per_sec(function, other, seconds):
+    """ ops/sec of two functions timed in alternating short batches for about seconds, best batch of each -
+        drift in machine speed lands on both, so the ratio holds steady where separate runs wander """
+    batch = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(batch):
+            function()
+        if time.perf_counter() - start >= 0.001:
+            break
+        batch *= 2
+    best = best_other = float('inf')
+    gc.disable()  # As timeit does, so a collection can't land in one batch
+    try:
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            for _ in range(batch):
+                function()
+            middle = time.perf_counter()
+            for _ in range(batch):
+                other()
+            best = min(best, middle - start)
+            best_other = min(best_other, time.perf_counter() - middle)
+    finally:
+        gc.enable()
+    return batch / best, batch / best_other
+
+
+def allocations(function, ops, samples = 20):
+    """ Peak bytes allocated while an op runs, and memory blocks still held afterwards, per op """
+    function()  # Warm up caches so they aren't counted
+    peak_total = 0
+    for _ in range(samples):
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        function()
+        peak_total += tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.stop()
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    for _ in range(samples):
+        function()
+    gc.collect()
+    retained = sys.getallocatedblocks() - blocks
+    return peak_total / samples / ops, retained / samples / ops
+
+
+def git_commit():
+    """ Commit being benchmarked, if running from a git checkout """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=float, default=1.0, help="approximate time spent timing each benchmark")
+    parser.add_argument('--filter', default='', help="only run benchmarks whose name contains this text")
+    parser.add_argument('--output', help="save results to this JSON file")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--max-slowdown', type=float, help="exit 1 if a msg_* decoder is more than this %% slower than its baseline")
+    args = parser.parse_args()
+
+    previous = {}
+    if args.compare:
+        with open(args.compare, "r") as jsonfile:
+            previous = json.load(jsonfile)['results']
+    results = {}
+    print("{:<40} {:>14} {:>12} {:>10} {:>8}".format("benchmark", "ops/sec", "bytes/op", "blocks/op", "change"))
+    functions = {}
+    for name, setup, function, ops in benchmarks():
+        if args.filter not in name:
+            continue
+        functions[name] = function
+        if setup:
+            setup()
+        rate = ops_per_sec(function, ops, args.seconds)
+        if setup:
+            setup()
+        alloc_bytes, blocks = allocations(function, ops)
+        results[name] = {
+            'ops_per_sec': round(rate, 1),
+            'peak_alloc_bytes_per_op': round(alloc_bytes, 1),
+            'net_blocks_per_op': round(blocks, 2)
+        }
+        change = ""
+        if name in previous:
+            change = "{:+.1f}%".format((rate / previous[name]['ops_per_sec'] - 1) * 100)
+        print("{:<40} {:>14,.0f} {:>12,.0f} {:>10.2f} {:>8}".format(name, rate, alloc_bytes, blocks, change))
+
+    slower = []
+    for name in results:
+        if 'baseline.' + name not in results:
+            continue
+        rate, legacy_rate = paired_ops_per_sec(functions[name], functions['baseline.' + name], args.seconds)
+        slowdown = (legacy_rate / rate - 1) * 100
+        print("{:<40} {:>+7.1f}% time against baseline".format(name, slowdown))
+        if args.max_slowdown is not None and slowdown > args.max_slowdown:
+            slower.append(name)
+
+    if args.output:
+        with open(args.output, "w") as jsonfile:
+            json.dump({
+                'commit': git_commit(),
+                'time': int(time.time()),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'results': results
+            }, jsonfile, indent=4, sort_keys=True)
+        print("Results saved to " + args.output)
+    if slower:
+        print("Slower than baseline by more than " + str(args.max_slowdown) + "%: " + ", ".join(slower))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
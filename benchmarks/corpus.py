@@ -0,0 +1,98 @@
+""" Synthetic Tempest Packet Corpus for Benchmarks - built out from msg_tests/test-station.py """
+import json
+import random
+import time
+
+WEATHERFLOW_STN_SERIAL = 'ST-99999123'
+WEATHERFLOW_HUB_SERIAL = 'HB-99998234'
+TEST_DEVICE_STATUS = '{"hub_rssi": 0, "debug": 0, "type": "device_status", "sensor_status": 0, "uptime": 0, "rssi": -51, "hub_sn": "", "voltage":  2.58, "serial_number": "", "firmware_revision": 0, "timestamp": 0}'
+TEST_HUB_STATUS = '{"serial_number": "", "type": "hub_status", "firmware_revision": "171", "uptime": 0, "rssi": -62, "timestamp": 0, "reset_flags": "BOR,PIN,POR", "seq": 0, "fs": [1, 0, 15675411, 524288], "radio_stats": [25, 1, 0, 3, 2839], "mqtt_stats": [1, 0]}'
+TEST_OBS_ST = '{"serial_number": "", "type": "obs_st", "hub_sn": "", "obs": [[0, 0.18, 0.22, 0.27, 144, 6, 1017.57, 22.37, 50.26, 328, 0.03, 3, 0.000000, 0, 0, 0, 2.410, 1]], "firmware_revision": 129}'
+TEST_RAPID_WIND = '{"serial_number": "", "type": "rapid_wind", "hub_sn": "", "ob": [0, 2.3, 128]}'
+TEST_EVT_STRIKE = '{"serial_number": "", "type": "evt_strike", "hub_sn": "", "evt": [0, 27, 3848]}'
+TEST_EVT_PRECIP = '{"serial_number": "", "type": "evt_precip", "hub_sn": "", "evt": [0]}'
+
+
+def station_serial(station = 0):
+    """ Serial number for the nth synthetic station """
+    return WEATHERFLOW_STN_SERIAL[:-3] + str(123 + station).zfill(3)[-3:]
+
+
+def create_station_test(firmware = 100, uptime = 1000, battery = 2.666, sensors = 0, station = 0, timestamp = None):
+    """ device_status packet, as sent by msg_tests/test-station.py """
+    wf_pkt = json.loads(TEST_DEVICE_STATUS)
+    wf_pkt['timestamp'] = int(time.time()) if timestamp is None else timestamp
+    wf_pkt['hub_sn'] = WEATHERFLOW_HUB_SERIAL
+    wf_pkt['serial_number'] = station_serial(station)
+    wf_pkt['uptime'] = int(uptime)
+    wf_pkt['voltage'] = float(battery)
+    wf_pkt['firmware_revision'] = int(firmware)
+    wf_pkt['sensor_status'] = sensors
+    return wf_pkt
+
+
+def create_hub_test(firmware = 171, uptime = 1000, seq = 0, timestamp = None):
+    """ hub_status packet """
+    wf_pkt = json.loads(TEST_HUB_STATUS)
+    wf_pkt['timestamp'] = int(time.time()) if timestamp is None else timestamp
+    wf_pkt['serial_number'] = WEATHERFLOW_HUB_SERIAL
+    wf_pkt['firmware_revision'] = str(firmware)
+    wf_pkt['uptime'] = int(uptime)
+    wf_pkt['seq'] = seq
+    return wf_pkt
+
+
+def create_obs_test(wind = 0.22, direction = 144, battery = 2.410, station = 0, timestamp = None):
+    """ obs_st packet """
+    wf_pkt = json.loads(TEST_OBS_ST)
+    wf_pkt['serial_number'] = station_serial(station)
+    wf_pkt['hub_sn'] = WEATHERFLOW_HUB_SERIAL
+    wf_pkt['obs'][0][0] = int(time.time()) if timestamp is None else timestamp
+    wf_pkt['obs'][0][2] = wind
+    wf_pkt['obs'][0][4] = direction
+    wf_pkt['obs'][0][16] = battery
+    return wf_pkt
+
+
+def create_event_test(template, values, station = 0):
+    """ rapid_wind / evt_strike / evt_precip packet with the given ob or evt list """
+    wf_pkt = json.loads(template)
+    wf_pkt['serial_number'] = station_serial(station)
+    wf_pkt['hub_sn'] = WEATHERFLOW_HUB_SERIAL
+    wf_pkt['ob' if 'ob' in wf_pkt else 'evt'] = values
+    return wf_pkt
+
+
+def create_packets(timestamp = 1600000000):
+    """ One packet of each of the six types handled by get_event() """
+    return {
+        'obs_st': create_obs_test(timestamp = timestamp),
+        'rapid_wind': create_event_test(TEST_RAPID_WIND, [timestamp, 2.3, 128]),
+        'evt_strike': create_event_test(TEST_EVT_STRIKE, [timestamp, 27, 3848]),
+        'evt_precip': create_event_test(TEST_EVT_PRECIP, [timestamp]),
+        'device_status': create_station_test(timestamp = timestamp),
+        'hub_status': create_hub_test(timestamp = timestamp)
+    }
+
+
+def create_corpus(count = 10000, stations = 10, seed = 1, timestamp = 1600000000):
+    """ Mixed traffic as bytes, roughly as a hub sends it - rapid_wind every 3 seconds,
+        obs_st and device_status every minute, hub_status every 10 seconds and occasional events """
+    rng = random.Random(seed)
+    corpus = []
+    tick = 0
+    while len(corpus) < count:
+        epoch = timestamp + tick * 3
+        for station in range(stations):
+            corpus.append(create_event_test(TEST_RAPID_WIND, [epoch, round(rng.uniform(0, 12), 2), rng.randrange(360)], station))
+            if tick % 20 == 0:
+                corpus.append(create_obs_test(round(rng.uniform(0, 8), 2), rng.randrange(360), round(rng.uniform(2.3, 2.8), 3), station, epoch))
+                corpus.append(create_station_test(uptime = 1000 + tick * 3, battery = round(rng.uniform(2.3, 2.8), 3), station = station, timestamp = epoch))
+            if rng.random() < 0.01:
+                corpus.append(create_event_test(TEST_EVT_STRIKE, [epoch, rng.randrange(1, 40), rng.randrange(10000)], station))
+            if rng.random() < 0.005:
+                corpus.append(create_event_test(TEST_EVT_PRECIP, [epoch], station))
+        if tick % 3 == 0:
+            corpus.append(create_hub_test(uptime = 1000 + tick * 3, seq = tick // 3, timestamp = epoch))
+        tick += 1
+    return [bytes(json.dumps(wf_pkt), encoding="utf8") for wf_pkt in corpus[:count]]
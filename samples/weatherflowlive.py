@@ -13,7 +13,7 @@ def main():
     # Loop to Receive Packets from WeatherFlow Hub
     while True:
         try:
-            wf_conn =  weatherflow.Connect(privacy = False)
+            wf_conn =  weatherflow.Connect(privacy = False, rcvbuf = 1048576)
             while True:
                 # Wait for and Get Broadcast Packets from the WeatherFlow Hub
                 wf_type, wf_serial, wf_json = wf_conn.get_event()
@@ -33,6 +33,7 @@ def handler(signum, frame):
     """ Handle Closing Gracefully """
     global wf_conn
     print("\nExiting...")
+    print("Packets Lost: " + json.dumps(wf_conn.loss(), sort_keys=True))
     wf_conn.close()  # Close Network Socket
     exit(0)
 
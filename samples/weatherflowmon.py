@@ -1,15 +1,11 @@
 """ Process WeatherFlow Packets and notify on Major events like Low Batt, Offline, Online, Sensor Failure """
+import asyncio
 import json
 import sys
 import logging
 import weatherflow
 import signal
 import time
-try:
-    import slackmsg
-    slackenabled = True
-except ImportError:
-    slackenabled = False
 try:
     import treepoem  # Also Requires GhostScript
     barcodeenabled = True
@@ -18,55 +14,23 @@ except ImportError:
 
 FILE_STATUS = '/opt/weatherflow-tools/status.json'
 FILE_CONFIG = '/opt/weatherflow-tools/config.json'
-SAVE_STATUS_INTERVALSEC=600
 
 wf_conn =  None
 wf_notify = None
 wf_config = None
+wf_dispatch = None
+wf_coalesce = None
+wf_rules = None
+wf_metrics = None
 
 def main():
     """ Main Service Loop """
-    global wf_conn
-    global wf_notify
-    global wf_config
     # Setup Logging to Console
     logging.basicConfig(format='%(filename)s %(levelname)s: %(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p', stream=sys.stdout, level=logging.DEBUG)
     logging.info("Running...")
-    # Loop to Receive Packets from WeatherFlow Hub
-    wf_conn =  weatherflow.Connect(privacy = False)
-    wf_notify = weatherflow.Notifications()
-    wf_config = wf_notify.readconfig(FILE_CONFIG)
-    if 'slackhookurl' in wf_config:
-        logging.info("Messaging: Slack is Enabled")
-    save_status_time = int(time.time()) + SAVE_STATUS_INTERVALSEC
     while True:
         try:
-            print("Loaded " + str(wf_notify.open(FILE_STATUS)) + " devices from saved status information")
-            if not __debug__: send_msg("WeatherFlow","WeatherFlow Monitor Starting","ok")
-            while True:
-                # Wait for and Get Broadcast Packets from the WeatherFlow Hub
-                wf_type, wf_serial, wf_json = wf_conn.get_event()
-                if wf_type:
-                    if __debug__: logging.debug("Received: " + str(wf_type) + " from " + str(wf_serial))
-                else:
-                    if __debug__: logging.debug("\n##### ERROR #####\n" + json.dumps(wf_json, sort_keys=True, indent=4))
-                # Get Notifications for status changes from device status messages
-                st_type, st_device, st_event, st_json = wf_notify.get_status(wf_json)
-                if st_type:
-                    if __debug__: logging.debug("\n####### STATUS EVENT #######\nType: " + str(st_type) + "\nEvent: " + str(st_event) + "\nDevice: " + str(st_device) + "\nPayload: " + json.dumps(st_json, sort_keys=True, indent=4))
-                    msgtitle, msgtext, msgstatus = weatherflow.notification(st_type, st_device, st_event, st_json)
-                    send_msg(msgtitle, msgtext, msgstatus)
-                # Check all devices to see if any have gone offline
-                st_type, st_device, st_event, st_json = wf_notify.offline()
-                if st_type:
-                    if __debug__: logging.debug("\n####### OFFLINE EVENT #######\nType: " + str(st_type) + "\nEvent: " + str(st_event) + "\nDevice: " + str(st_device) + "\nPayload: " + json.dumps(st_json, sort_keys=True, indent=4))
-                    msgtitle, msgtext, msgstatus = weatherflow.notification(st_type, st_device, st_event, st_json)
-                    send_msg(msgtitle, msgtext, msgstatus)
-                if int(time.time()) > save_status_time:
-                    wf_notify.save_status()
-                    save_status_time = int(time.time()) + SAVE_STATUS_INTERVALSEC
-                    logging.info("Saving Status Information File")
-
+            asyncio.run(monitor())
         except ValueError as e:
             wait_time = 5 if __debug__ else 60
             logging.error("Failure Occured - Waiting " + str(wait_time) + " seconds then retrying.")
@@ -76,15 +40,113 @@ def main():
             logging.info("Stopping by Interrupt...")
             break
 
-def send_msg(msgtitle, msgtext, msgstatus):
+async def monitor():
+    """ Receive packets, check for offline devices and send notifications on one event loop """
+    global wf_conn
+    global wf_notify
     global wf_config
-    msgsent = False
-    if slackenabled and 'slackhookurl' in wf_config:
-        msg_slack(msgtitle, msgtext, msgstatus)
-        msgsent = True
-    # Insert other message options, email, etc.. here.
-    if not msgsent:
-        # Write to syslog if no other outputs are enabled
+    global wf_dispatch
+    global wf_coalesce
+    global wf_rules
+    global wf_metrics
+    wf_conn = weatherflow.AsyncConnect(privacy = False, records = True)
+    wf_notify = weatherflow.Notifications()
+    wf_config = wf_notify.readconfig(FILE_CONFIG)
+    wf_dispatch = open_dispatch(wf_config)
+    # Lightning and rain are summarised per station every eventwindow seconds
+    wf_coalesce = weatherflow.EventCoalescer(wf_config.get('eventwindow', 600))
+    # Site specific alerts, e.g. a weak hub WiFi signal
+    wf_rules = weatherflow.RuleEngine(wf_config.get('rules', []))
+    if wf_config.get('timings'):
+        # Log how long each stage of handling packets takes every 'timings' seconds
+        weatherflow.instrument.enable(wf_config['timings'])
+    if wf_config.get('metricsport') and wf_metrics is None:
+        # Only local scrapes unless 'metricsaddress' opens it up, e.g. "" for every interface
+        metrics_address = wf_config.get('metricsaddress', '127.0.0.1')
+        logging.info("Metrics: Serving Prometheus metrics on " + (metrics_address or "every interface") + " port " + str(wf_config['metricsport']))
+        wf_metrics = weatherflow.MetricsExporter(wf_config['metricsport'], metrics_address)
+    store = None
+    if wf_config.get('statusdb'):
+        logging.info("Status: Saving to SQLite database " + wf_config['statusdb'])
+        store = weatherflow.SQLiteStore(wf_config['statusdb'])
+    print("Loaded " + str(wf_notify.open(FILE_STATUS, journal = True, store = store)) + " devices from saved status information")
+    if not __debug__: notify_msg("WeatherFlow","WeatherFlow Monitor Starting","ok")
+    devices_changed = asyncio.Event()
+    events_held = asyncio.Event()
+    tasks = [
+        asyncio.ensure_future(offline_watch(devices_changed)),
+        asyncio.ensure_future(summary_watch(events_held))
+    ]
+    try:
+        # Wait for and Get Broadcast Packets from the WeatherFlow Hub
+        async for wf_type, wf_serial, wf_json in wf_conn:
+            if wf_type:
+                if __debug__: logging.debug("Received: " + str(wf_type) + " from " + str(wf_serial))
+            else:
+                if __debug__: logging.debug("\n##### ERROR #####\n" + json.dumps(wf_json, sort_keys=True, indent=4))
+            if wf_metrics is not None:
+                wf_metrics.update(wf_type, wf_serial, wf_json)
+                wf_metrics.set('events_dropped_total', wf_conn.dropped(), kind = 'counter')
+                wf_metrics.set('queue_depth', wf_conn.queue.qsize())
+            # Get Notifications for status changes from device status messages
+            st_result = wf_notify.get_status(wf_json)
+            if st_result[0]:
+                devices_changed.set()  # Device list or online state may have changed
+                events_held.set()
+            st_events = wf_coalesce.add(*st_result)
+            for st_rule in wf_rules.check(wf_json):
+                st_events += wf_coalesce.add(*st_rule)
+            for st_type, st_device, st_event, st_json in st_events:
+                if __debug__: logging.debug("\n####### STATUS EVENT #######\nType: " + str(st_type) + "\nEvent: " + str(st_event) + "\nDevice: " + str(st_device) + "\nPayload: " + json.dumps(st_json, sort_keys=True, indent=4))
+                msgtitle, msgtext, msgstatus = weatherflow.notification(st_type, st_device, st_event, st_json)
+                notify_msg(msgtitle, msgtext, msgstatus)
+    finally:
+        for task in tasks:
+            task.cancel()
+        wf_conn.close()
+        wf_notify.close()  # Save status and flush the journal or database
+        send_summaries(wf_coalesce.flush())
+        if wf_dispatch is not None:
+            wf_dispatch.close(10)  # Deliver queued messages
+
+async def offline_watch(devices_changed):
+    """ Sleep until the next device could go offline instead of polling on a receive timeout """
+    while True:
+        deadline = wf_notify.offline_deadline()
+        devices_changed.clear()
+        if deadline is None:
+            await devices_changed.wait()
+            continue
+        await asyncio.sleep(max(0, deadline - time.time()))
+        # Report every device that has gone offline
+        for st_type, st_device, st_event, st_json in wf_notify.offline_all():
+            if __debug__: logging.debug("\n####### OFFLINE EVENT #######\nType: " + str(st_type) + "\nEvent: " + str(st_event) + "\nDevice: " + str(st_device) + "\nPayload: " + json.dumps(st_json, sort_keys=True, indent=4))
+            msgtitle, msgtext, msgstatus = weatherflow.notification(st_type, st_device, st_event, st_json)
+            notify_msg(msgtitle, msgtext, msgstatus)
+
+async def summary_watch(events_held):
+    """ Send lightning and rain summaries as each station's window closes """
+    while True:
+        deadline = wf_coalesce.deadline()
+        events_held.clear()
+        if deadline is None:
+            await events_held.wait()
+            continue
+        await asyncio.sleep(max(0, deadline - time.time()))
+        send_summaries(wf_coalesce.expire())
+
+def send_summaries(summaries):
+    """ Send the notifications returned by the coalescer """
+    for st_type, st_device, st_event, st_json in summaries:
+        msgtitle, msgtext, msgstatus = weatherflow.notification(st_type, st_device, st_event, st_json)
+        notify_msg(msgtitle, msgtext, msgstatus)
+
+def notify_msg(msgtitle, msgtext, msgstatus):
+    """ Queue a message for the delivery thread - never blocks the event loop on the webhook """
+    if wf_metrics is not None:
+        wf_metrics.count('notifications_total', {'status': msgstatus})
+    if wf_dispatch is None or not wf_dispatch.send(msgtitle, msgtext, msgstatus):
+        # Write to syslog if no other outputs are enabled, or the delivery queue is full
         msg_log(msgtitle, msgtext, msgstatus)
     return False
 
@@ -92,15 +154,21 @@ def msg_log(msgtitle, msgtext, msgstatus):
         # TODO - Remove line breaks from msgtext
         logging.info(str(msgstatus) + ": " + str(msgtitle) + ":" + str(msgtext))
 
-def msg_slack(msgtitle, msgtext, msgstatus):
-    slack_hook_url = wf_config['slackhookurl']
-    slack = slackmsg.Connect(slack_hook_url, '#technical', 'WeatherFlow', ':mostly_sunny:')
-    response = slack.send(msgtitle, msgtext, msgstatus)
-    if response:
-        logging.error("Error Sending Message: " + str(response))
-        # Log to Syslog if slack fails
+def msg_failed(channel, messages, error):
+    """ Log to Syslog if slack fails """
+    for msgtitle, msgtext, msgstatus in messages:
         msg_log(msgtitle, msgtext, msgstatus)
-    return response
+
+def open_dispatch(wf_config):
+    """ Start the delivery thread for the configured webhooks, None if there are none """
+    channels = {}
+    if wf_config.get('slackhookurl'):
+        logging.info("Messaging: Slack is Enabled")
+        channels['slack'] = weatherflow.SlackChannel(wf_config['slackhookurl'], '#technical', 'WeatherFlow', ':mostly_sunny:')
+    # Insert other message options, email, etc.. here.
+    if not channels:
+        return None
+    return weatherflow.Dispatcher(channels, on_error = msg_failed)
 
 
 def handler(signum, frame):
@@ -109,7 +177,11 @@ def handler(signum, frame):
     print("\nTermination Handler")
     wf_conn.close()  # Close Network Socket
     wf_notify.close()  # Save Status Information
-    if not __debug__: send_msg("WeatherFlow","WeatherFlow Monitor Stopping","warning")
+    if wf_coalesce is not None:
+        send_summaries(wf_coalesce.flush())  # Storms still being summarised
+    if not __debug__: notify_msg("WeatherFlow","WeatherFlow Monitor Stopping","warning")
+    if wf_dispatch is not None:
+        wf_dispatch.close(10)
     exit(0)
 
 signal.signal(signal.SIGINT, handler)
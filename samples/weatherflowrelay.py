@@ -0,0 +1,24 @@
+""" Receive WeatherFlow Packets once and Relay them to Local Processes - each connects with weatherflow.RelayClient(path) """
+import argparse
+import weatherflow
+
+
+def main():
+    """ Main Relay Loop """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--socket', default='/tmp/weatherflow.sock', help="Unix socket the subscribers connect to")
+    parser.add_argument('--queue', type=int, default=1024, help="events held for a subscriber that is behind")
+    parser.add_argument('--policy', default='oldest', choices=weatherflow.RELAY_POLICIES, help="drop the oldest event, or disconnect, once a subscriber's queue is full")
+    args = parser.parse_args()
+
+    relay = weatherflow.Relay(args.socket, connection = weatherflow.Connect(privacy = False, rcvbuf = 1048576), queue = args.queue, policy = args.policy)
+    print("Relaying WeatherFlow packets on " + args.socket)
+    try:
+        relay.run()
+    except KeyboardInterrupt:
+        print("Stopping by Interrupt...")
+    finally:
+        relay.close()
+
+
+main()
@@ -0,0 +1,45 @@
+""" Replay a Capture through the Status and Notification Routines and report Alerts and Throughput """
+import argparse
+import json
+import time
+import weatherflow
+
+
+def report(wf_conn, events, alerts):
+    """ Print and count the notifications """
+    for st_type, st_device, st_event, st_json in events:
+        msgtitle, msgtext, msgstatus = weatherflow.notification(st_type, st_device, st_event, st_json)
+        print(weatherflow.epoch_text(wf_conn.clock()) + " " + msgstatus + ": " + msgtitle)
+        alerts[st_event] = alerts.get(st_event, 0) + 1
+
+
+def main():
+    """ Main Replay Loop """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('source', help="JSONL capture file or packet archive directory")
+    parser.add_argument('--speed', type=float, default=0, help="1 = original timing, N = N times faster, 0 = as fast as possible")
+    parser.add_argument('--timeout', type=int, default=360, help="seconds without a status packet before a device is offline")
+    parser.add_argument('--window', type=int, default=600, help="seconds of lightning and rain events summarised together")
+    parser.add_argument('--status', default='/tmp/weatherflow-replay-status.json', help="status file used for the replay")
+    args = parser.parse_args()
+
+    wf_conn = weatherflow.ReplayConnect(args.source, speed = args.speed, records = True)
+    wf_notify = weatherflow.Notifications()
+    wf_notify.open(args.status, clock = wf_conn.clock)
+    wf_coalesce = weatherflow.EventCoalescer(args.window)
+    alerts = {}
+    start = time.perf_counter()
+    for wf_type, wf_serial, wf_json in wf_conn:
+        # Report every device that had gone offline before this packet arrived
+        events = wf_notify.offline_all(args.timeout)
+        events += wf_coalesce.add(*wf_notify.get_status(wf_json))
+        report(wf_conn, events, alerts)
+    report(wf_conn, wf_coalesce.flush(), alerts)
+    elapsed = time.perf_counter() - start
+    wf_conn.close()
+    print("Replayed " + str(wf_conn.count) + " packets in " + str(round(elapsed, 2)) + " seconds (" +
+          str(int(wf_conn.count / elapsed if elapsed else 0)) + " packets/sec)")
+    print("Alerts: " + json.dumps(alerts, sort_keys=True))
+
+
+main()
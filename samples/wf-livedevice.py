@@ -13,14 +13,11 @@ def main():
     # Loop to Receive Packets from WeatherFlow Hub
     while True:
         try:
-            wf_conn =  weatherflow.Connect(privacy = False)
-            while True:
-                # Wait for and Get Broadcast Packets from the WeatherFlow Hub
-                wf_type, wf_serial, wf_json = wf_conn.get_event()
-                if wf_type:
-                    if 'device' in wf_type: print(str(wf_type) + " from " + str(wf_serial) + "\n" + json.dumps(wf_json, sort_keys=True, indent=4))
-                else:
-                    print("### ERROR ###\n" + json.dumps(wf_json, sort_keys=True, indent=4))
+            wf_conn =  weatherflow.EventBus(privacy = False)
+            # Other packet types are dropped before they are decoded
+            wf_conn.subscribe(types = ['device_status'], callback = show_device)
+            # Wait for and Get Broadcast Packets from the WeatherFlow Hub
+            wf_conn.run()
         except ValueError as e:
             print("Failure Occured - Waiting " + str(wait_time) + " seconds then retrying.")
             print(e)
@@ -29,6 +26,13 @@ def main():
             print("Stopping by Interrupt...")
             break
 
+def show_device(wf_type, wf_serial, wf_json):
+    """ Print a device status event, or the error dict of a device_status packet that failed to decode """
+    if wf_type:
+        print(str(wf_type) + " from " + str(wf_serial) + "\n" + json.dumps(wf_json.as_dict(), sort_keys=True, indent=4))
+    else:
+        print("### ERROR ###\n" + json.dumps(wf_json, sort_keys=True, indent=4))
+
 def handler(signum, frame):
     """ Handle Closing Gracefully """
     global wf_conn
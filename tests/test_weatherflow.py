@@ -3,9 +3,14 @@
 
 """Tests for `weatherflow` package."""
 
+import json
+import socket
+import sys
+import time
+
 import pytest
 
-# import weatherflow
+import weatherflow
 
 
 @pytest.fixture
@@ -26,3 +31,829 @@ def test_content(response):
 def test_command_line_interface():
     """Test the CLI."""
     # TODO
+
+
+# Sample packets from the WeatherFlow Tempest UDP Reference - v170
+PKT_OBS_ST = {"serial_number": "ST-00000512", "type": "obs_st", "hub_sn": "HB-00013030", "obs": [[1588948614, 0.18, 0.22, 0.27, 144, 6, 1017.57, 22.37, 50.26, 328, 0.03, 3, 0.000000, 0, 0, 0, 2.410, 1]], "firmware_revision": 129}
+PKT_RAPID_WIND = {"serial_number": "SK-00008453", "type": "rapid_wind", "hub_sn": "HB-00000001", "ob": [1493322445, 2.3, 128]}
+PKT_EVT_STRIKE = {"serial_number": "AR-00004049", "type": "evt_strike", "hub_sn": "HB-00000001", "evt": [1493322445, 27, 3848]}
+PKT_EVT_PRECIP = {"serial_number": "SK-00008453", "type": "evt_precip", "hub_sn": "HB-00000001", "evt": [1493322445]}
+PKT_DEVICE_STATUS = {"serial_number": "AR-00004049", "type": "device_status", "hub_sn": "HB-00000001", "timestamp": 1510855923, "uptime": 2189, "voltage": 3.50, "firmware_revision": 17, "rssi": -17, "hub_rssi": -87, "sensor_status": 0, "debug": 0}
+PKT_HUB_STATUS = {"serial_number": "HB-00000001", "type": "hub_status", "firmware_revision": "35", "uptime": 1670133, "rssi": -62, "timestamp": 1495724691, "reset_flags": "BOR,PIN,POR", "seq": 48, "fs": [1, 0, 15675411, 524288], "radio_stats": [2, 1, 0, 3, 2839], "mqtt_stats": [1, 0]}
+
+ALL_PACKETS = [PKT_OBS_ST, PKT_RAPID_WIND, PKT_EVT_STRIKE, PKT_EVT_PRECIP, PKT_DEVICE_STATUS, PKT_HUB_STATUS]
+
+
+def encode(pkt):
+    return bytes(json.dumps(pkt), encoding="utf8")
+
+
+@pytest.fixture
+def conn():
+    wf_conn = weatherflow.Connect(ip='127.0.0.1', port=0)
+    yield wf_conn
+    wf_conn.close()
+
+
+def send_packets(wf_conn, packets):
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for pkt in packets:
+        sender.sendto(encode(pkt), wf_conn.tempest.getsockname())
+    sender.close()
+
+
+def test_get_events_drains_batch(conn):
+    send_packets(conn, ALL_PACKETS)
+    events = conn.get_events(max_batch=64, timeout=2)
+    assert [wf_type for wf_type, wf_serial, wf_json in events] == [pkt['type'] for pkt in ALL_PACKETS]
+    assert events[0][2]['Wind Average (m/s)'] == 0.22
+    # Nothing left queued
+    assert conn.get_events(timeout=0) == []
+
+
+def test_get_events_respects_max_batch(conn):
+    send_packets(conn, [PKT_RAPID_WIND] * 5)
+    first = conn.get_events(max_batch=3, timeout=2)
+    second = conn.get_events(max_batch=3, timeout=2)
+    assert len(first) == 3 and len(second) == 2
+    assert first[0] == second[0]
+
+
+def test_decode_packet_matches_get_event(conn):
+    send_packets(conn, [PKT_DEVICE_STATUS])
+    assert conn.get_event() == weatherflow.decode_packet(encode(PKT_DEVICE_STATUS))
+
+
+def test_async_connect_iterates_events():
+    import asyncio
+
+    async def receive():
+        async with weatherflow.AsyncConnect(ip='127.0.0.1', port=0) as wf_conn:
+            sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            address = wf_conn.transport.get_extra_info('socket').getsockname()
+            for pkt in [PKT_HUB_STATUS, PKT_RAPID_WIND]:
+                sender.sendto(encode(pkt), address)
+            sender.close()
+            events = []
+            async for wf_type, wf_serial, wf_json in wf_conn:
+                events.append(wf_type)
+                if len(events) == 2:
+                    break
+            timeout_event = await wf_conn.get_event(timeout=0.01)
+        return events, timeout_event
+
+    events, timeout_event = asyncio.run(receive())
+    assert events == ['hub_status', 'rapid_wind']
+    assert timeout_event[0] is False and 'error' in timeout_event[2]
+
+
+def test_async_connect_keeps_returning_none_once_closed():
+    import asyncio
+
+    async def receive():
+        wf_conn = await weatherflow.AsyncConnect(ip='127.0.0.1', port=0).open()
+        wf_conn.close()
+        first = await wf_conn.get_event()
+        return first, await asyncio.wait_for(wf_conn.get_event(), 1), [event async for event in wf_conn]
+
+    assert asyncio.run(receive()) == (None, None, [])
+
+
+@pytest.mark.parametrize("data, category", [
+    (b'not json', 'json'),
+    (b'\xff\xfe', 'json'),
+    (b'[1, 2]', 'payload'),
+    (b'{"serial_number": "ST-00000512"}', 'payload'),
+    (b'{"type": "light_debug", "serial_number": "ST-00000512"}', 'unsupported'),
+    (b'{"type": "obs_st", "serial_number": "ST-00000512", "obs": [[1588948614]]}', 'decode'),
+])
+def test_decode_packet_structured_errors(data, category):
+    wf_type, wf_serial, wf_json = weatherflow.decode_packet(data)
+    assert wf_type is False
+    assert wf_json['category'] == category
+    assert 'error' in wf_json
+
+
+@pytest.mark.parametrize("pkt", ALL_PACKETS)
+def test_decode_packet_dispatches_each_type(pkt):
+    wf_type, wf_serial, wf_json = weatherflow.decode_packet(memoryview(encode(pkt)))
+    assert wf_type == pkt['type'] == wf_json['type']
+    assert wf_serial == pkt['serial_number']
+
+
+def test_is_json():
+    assert weatherflow.is_json('{"type": "obs_st"}') is True
+    assert weatherflow.is_json(b'{"type": "obs_st"}') is True
+    assert weatherflow.is_json('{"type": ') is False
+
+
+@pytest.mark.parametrize("pkt", ALL_PACKETS)
+def test_records_as_dict_matches_msg_decoders(pkt):
+    wf_type, wf_serial, record = weatherflow.decode_packet(encode(pkt), records=True)
+    assert isinstance(record, weatherflow.Record)
+    assert not hasattr(record, '__dict__')
+    assert record.type == wf_type == pkt['type']
+    assert record.as_dict() == weatherflow.decode_packet(encode(pkt))[2]
+
+
+def test_records_privacy_and_errors():
+    record = weatherflow.decode_packet(encode(PKT_RAPID_WIND), privacy=True, records=True)[2]
+    assert record.serial == 'SK-00008xxx' and record.hub_sn == 'HB-00000xxx'
+    wf_type, wf_serial, wf_json = weatherflow.decode_packet(b'{"type": "rapid_wind", "serial_number": "SK-1", "hub_sn": "HB-1"}', records=True)
+    assert wf_type is False and wf_json['category'] == 'decode'
+
+
+@pytest.mark.parametrize("records", [False, True])
+def test_bad_values_are_decode_errors(records):
+    bad_status = dict(PKT_DEVICE_STATUS, rssi=None, sensor_status="x")
+    bad_obs = json.loads(json.dumps(PKT_OBS_ST))
+    bad_obs['obs'][0][7] = "warm"
+    for pkt in (bad_status, bad_obs, dict(PKT_HUB_STATUS, uptime="long")):
+        wf_type, wf_serial, wf_json = weatherflow.decode_packet(encode(pkt), records=records)
+        assert wf_type is False and wf_json['category'] == 'decode'
+    if records:  # Records convert the values they hold
+        quoted = json.loads(json.dumps(PKT_RAPID_WIND))
+        quoted['ob'][1] = "2.3"
+        assert weatherflow.decode_packet(encode(quoted), records=True)[2]['Wind Speed (m/s)'] == 2.3
+
+
+def test_status_accepts_records():
+    wf_notify = weatherflow.Notifications()
+    wf_notify.open('/nonexistent/status.json')
+    record = weatherflow.decode_packet(encode(PKT_DEVICE_STATUS), records=True)[2]
+    assert wf_notify.get_status(record)[:3] == ('station', 'AR-00004049', 'new_ok')
+    rebooted = weatherflow.decode_packet(encode(dict(PKT_DEVICE_STATUS, uptime=10)), records=True)[2]
+    st_type, st_device, st_event, st_json = wf_notify.get_status(rebooted)
+    assert st_event == 'reboot' and st_json['old_uptime'] == 2189 and 'old_uptime' not in rebooted
+
+
+def test_records_compute_fields_lazily(monkeypatch):
+    record = weatherflow.decode_packet(encode(PKT_DEVICE_STATUS), records=True)[2]
+    calls = []
+    monkeypatch.setitem(weatherflow.DeviceStatus.KEYS, 'Uptime (text)', lambda r: calls.append(r) or "0d 0h 36m")
+    assert record['Battery Voltage'] == 3.5 and calls == []
+    assert record['Uptime (text)'] == record.get('Uptime (text)') == "0d 0h 36m" and len(calls) == 1
+    assert 'Sensor Status' in record and 'Interface' not in record and record.get('Missing') is None
+    assert list(record) == list(weatherflow.msg_device_status(PKT_DEVICE_STATUS)[1]) and len(record) == len(record.as_dict())
+
+
+def test_records_cache_only_derived_fields():
+    record = weatherflow.decode_packet(encode(PKT_OBS_ST), records=True)[2]
+    record.as_dict()
+    assert record['Air Temperature (C)'] == 22.37 and record['Station Firmware'] == 129 and record._cache is None
+    assert record['DateTime'] == record.as_dict()['DateTime'] and list(record._cache) == ['DateTime']
+
+
+def test_ring_buffer_wraps_with_zero_copy_views():
+    numpy = pytest.importorskip("numpy")
+    ring = weatherflow.RingBuffer(4, 2)
+    for epoch in range(10):
+        ring.append([epoch, epoch * 2])
+    assert len(ring) == 4
+    assert ring.view()[:, 0].tolist() == [6, 7, 8, 9]
+    window = ring.window(7, 8)
+    assert window[:, 1].tolist() == [14, 16]
+    assert numpy.shares_memory(window, ring.data)
+
+
+def test_station_history_keys_by_serial():
+    pytest.importorskip("numpy")
+    history = weatherflow.StationHistory(obs_capacity=10, wind_capacity=10)
+    for offset in range(3):
+        pkt = json.loads(json.dumps(PKT_RAPID_WIND))
+        pkt['ob'][0] += offset * 3
+        history.add(weatherflow.msg_rapid_wind(pkt)[1])
+    history.add(weatherflow.decode_packet(encode(PKT_OBS_ST), records=True)[2])
+    assert history.add(weatherflow.msg_hub_status(PKT_HUB_STATUS)[1]) is False
+    assert history.serials() == ['SK-00008453', 'ST-00000512']
+    assert history.rapid_wind('SK-00008453', start=1493322448).shape == (2, 3)
+    obs = history.obs_st('ST-00000512')
+    assert obs[0, history.column('Wind Average (m/s)')] == 0.22
+    assert history.obs_st('unknown').shape == (0, len(weatherflow.MAP_OBS_ST))
+
+
+def test_wind_window_rolling_statistics():
+    window = weatherflow.WindWindow(10)
+    window.add(0, 5.0, 350)
+    window.add(3, 1.0, 10)
+    window.add(6, 3.0, 0)
+    assert window.gust() == 5.0 and window.lull() == 1.0
+    assert window.average() == pytest.approx(3.0)
+    assert window.direction() == pytest.approx(355.54, abs=0.01)
+    window.add(12, 2.0, 90)  # Expires the samples at 0 seconds
+    assert len(window) == 3
+    assert window.gust() == 3.0 and window.lull() == 1.0
+    window.add(13, 8.0, None)  # No direction - counted in the speeds, but not as a north wind
+    assert window.gust() == 8.0 and window.average() == pytest.approx(13.0 / 3)
+    assert window.direction() == pytest.approx(33.69, abs=0.01)
+
+
+def test_wind_stats_from_rapid_wind():
+    stats = weatherflow.WindStats()
+    for offset, speed in enumerate([2.0, 4.0, 6.0]):
+        pkt = json.loads(json.dumps(PKT_RAPID_WIND))
+        pkt['ob'] = [1493322445 + offset * 3, speed, 180]
+        stats.add(weatherflow.decode_packet(encode(pkt), records=bool(offset % 2))[2])
+    two_minute = stats.get('SK-00008453', 120)
+    assert two_minute['Wind Average (m/s)'] == pytest.approx(4.0)
+    assert two_minute['Wind Direction (text)'] == 'S'
+    assert two_minute['Wind Gust (m/s)'] == 6.0 and two_minute['Wind Lull (m/s)'] == 2.0
+    assert stats.get('SK-00008453', 600, now=1493322445 + 700)['Samples'] == 0
+    assert stats.get('unknown') is None
+
+
+def test_packet_archive_time_range_replay(tmp_path):
+    archive = weatherflow.PacketArchive(str(tmp_path), segment_bytes=2048, index_every=4)
+    for second in range(100):
+        archive.write(1000.0 + second, ('10.0.0.2', 50222), encode(PKT_RAPID_WIND))
+    archive.close()
+    reader = weatherflow.ArchiveReader(str(tmp_path))
+    assert len(reader.segments()) > 1
+    records = list(reader.read(1042.0, 1057.5))
+    assert [epoch for epoch, sender, data in records] == [1000.0 + second for second in range(42, 58)]
+    assert records[0][1] == '10.0.0.2:50222'
+    assert json.loads(records[0][2]) == PKT_RAPID_WIND
+    assert len(list(reader.read())) == 100
+
+
+def test_packet_archive_ignores_partial_record(tmp_path):
+    archive = weatherflow.PacketArchive(str(tmp_path))
+    archive.write(1000.0, None, encode(PKT_EVT_PRECIP))
+    archive.write(1001.0, None, encode(PKT_EVT_PRECIP))
+    archive.close()
+    path = weatherflow.ArchiveReader(str(tmp_path)).segments()[0][1]
+    with open(path, "r+b") as segment:
+        segment.truncate(segment.seek(0, 2) - 5)
+    assert [epoch for epoch, sender, data in weatherflow.ArchiveReader(str(tmp_path)).read()] == [1000.0]
+
+
+def test_connect_archives_received_packets(tmp_path):
+    archive = weatherflow.PacketArchive(str(tmp_path))
+    wf_conn = weatherflow.Connect(ip='127.0.0.1', port=0, archive=archive)
+    send_packets(wf_conn, [PKT_OBS_ST, PKT_HUB_STATUS, PKT_RAPID_WIND])
+    wf_conn.get_event()
+    wf_conn.get_events(timeout=2)
+    wf_conn.close()
+    archive.close()
+    packets = [json.loads(data) for epoch, sender, data in weatherflow.ArchiveReader(str(tmp_path)).read()]
+    assert packets == [PKT_OBS_ST, PKT_HUB_STATUS, PKT_RAPID_WIND]
+
+
+def write_capture(path, packets):
+    with open(path, "w") as capture:
+        for epoch, pkt in packets:
+            capture.write(json.dumps({"time": epoch, "addr": "10.0.0.2:50222", "packet": pkt}) + "\n")
+
+
+def device_status_at(epoch, **changes):
+    pkt = dict(PKT_DEVICE_STATUS, timestamp=epoch)
+    pkt.update(changes)
+    return epoch, pkt
+
+
+def test_replay_connect_drives_notifications_on_replay_time(tmp_path):
+    capture = str(tmp_path / "capture.jsonl")
+    # Station reports every minute, then disappears for 10 minutes and reboots
+    packets = [device_status_at(1000000 + minute * 60, uptime=2189 + minute * 60) for minute in range(5)]
+    packets.append(device_status_at(1000000 + 900, uptime=10))
+    packets.append((1000000 + 960, PKT_HUB_STATUS))
+    write_capture(capture, packets)
+    wf_conn = weatherflow.ReplayConnect(capture, speed=0)
+    wf_notify = weatherflow.Notifications()
+    wf_notify.open(str(tmp_path / "status.json"), clock=wf_conn.clock)
+    seen = []
+    try:
+        for wf_type, wf_serial, wf_json in wf_conn:
+            offline = wf_notify.offline()
+            if offline[0]:
+                seen.append(offline[2])
+            st_type, st_device, st_event, st_json = wf_notify.get_status(wf_json)
+            if st_type:
+                seen.append(st_event)
+    finally:
+        weatherflow.set_clock(None)
+    assert seen == ['new_ok', 'offline', 'online', 'new_ok']
+    assert wf_conn.eof and wf_conn.count == 7
+    assert wf_conn.get_event()[2]['category'] == 'eof'
+
+
+def test_replay_connect_speed_and_archive_source(tmp_path):
+    archive = weatherflow.PacketArchive(str(tmp_path / "archive"))
+    for second in range(3):
+        archive.write(5000.0 + second * 0.05, None, encode(PKT_RAPID_WIND))
+    archive.close()
+    wf_conn = weatherflow.ReplayConnect(str(tmp_path / "archive"), speed=1)
+    start = time.monotonic()
+    assert [wf_type for wf_type, wf_serial, wf_json in wf_conn] == ['rapid_wind'] * 3
+    assert time.monotonic() - start >= 0.09
+    assert wf_conn.clock() == 5000.1
+
+
+def test_read_capture_raw_packets(tmp_path):
+    capture = tmp_path / "raw.jsonl"
+    capture.write_text(json.dumps(PKT_OBS_ST) + "\nnot json\n")
+    packets = list(weatherflow.read_capture(str(capture)))
+    assert packets[0][0] == 1588948614 and packets[1] == (1588948614, "", b"not json")
+
+
+def test_connect_multiple_binds_tags_interface():
+    wf_conn = weatherflow.Connect(binds=[('127.0.0.1', 0), '127.0.0.1:0'], records=False)
+    try:
+        first, second = wf_conn.interfaces()
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sender.sendto(encode(PKT_HUB_STATUS), wf_conn.sockets[0].getsockname())
+        sender.sendto(encode(PKT_DEVICE_STATUS), wf_conn.sockets[1].getsockname())
+        sender.sendto(encode(PKT_RAPID_WIND), wf_conn.sockets[1].getsockname())
+        sender.close()
+        time.sleep(0.05)
+        events = wf_conn.get_events(timeout=2)
+        tags = sorted((wf_type, wf_json['Interface']) for wf_type, wf_serial, wf_json in events)
+        assert tags == sorted([('hub_status', first), ('device_status', second), ('rapid_wind', second)])
+    finally:
+        wf_conn.close()
+
+
+def test_connect_single_bind_is_untagged_and_records_tag(conn):
+    send_packets(conn, [PKT_RAPID_WIND])
+    assert 'Interface' not in conn.get_event()[2]
+    record = weatherflow.decode_packet(encode(PKT_RAPID_WIND), records=True)[2]
+    record.interface = 'eth0.20'
+    assert record.as_dict()['Interface'] == 'eth0.20'
+    assert weatherflow.parse_bind(('0.0.0.0', '50222', 'eth0.20')) == ('0.0.0.0', 50222, 'eth0.20')
+
+
+def test_peek_field_and_shared_ring():
+    data = bytearray(encode(PKT_OBS_ST))
+    assert weatherflow.peek_field(data, b'"serial_number"') == b"ST-00000512"
+    assert weatherflow.peek_field(data, b'"hub_sn"', 20) is None
+    assert weatherflow.peek_field(data, b'"firmware_revision"') is None
+    ring = weatherflow.SharedRing(slots=2, slotsize=16)
+    assert ring.put(b"first") and ring.put(b"second")
+    assert not ring.put(b"dropped")
+    assert ring.get() == b"first" and ring.put(b"third")
+    assert ring.get() == b"second" and ring.get() == b"third"
+    assert ring.get(timeout=0.01) is False
+
+
+def test_parallel_connect_keeps_per_serial_order():
+    wf_conn = weatherflow.ParallelConnect(ip='127.0.0.1', port=0, workers=2)
+    try:
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for second in range(20):
+            for serial in ("SK-00000001", "SK-00000002", "SK-00000003"):
+                sender.sendto(encode(dict(PKT_RAPID_WIND, serial_number=serial, ob=[1600000000 + second, 2.3, 128])),
+                              wf_conn.tempest.getsockname())
+        sender.close()
+        seen = {}
+        while sum(len(times) for times in seen.values()) < 60:
+            wf_type, wf_serial, record = wf_conn.get_event()
+            assert wf_type == 'rapid_wind' and isinstance(record, weatherflow.RapidWind)
+            seen.setdefault(wf_serial, []).append(record.time)
+        assert all(times == sorted(times) for times in seen.values()) and len(seen) == 3
+        assert wf_conn.dropped == 0
+    finally:
+        wf_conn.close()
+
+
+def test_parallel_connect_closes_with_a_dead_worker_and_full_ring():
+    wf_conn = weatherflow.ParallelConnect(ip='127.0.0.1', port=0, workers=1, slots=4)
+    wf_conn.workers[0].terminate()
+    wf_conn.workers[0].join()
+    while wf_conn.rings[0].put(encode(PKT_RAPID_WIND)):
+        pass
+    started = time.monotonic()
+    wf_conn.close()
+    assert time.monotonic() - started < 5
+
+
+def test_array_helpers_match_scalar_helpers():
+    pytest.importorskip("numpy")
+    volts = [2.6, 2.455, 2.42, 2.415, 2.4, 2.39, 2.36, 2.355, 2.37, 2.375, 2.38, float('nan'), 2.5, 2.0, 3.0]
+    assert weatherflow.get_batthealth_array(volts[:11] + volts[12:]).tolist() == [weatherflow.get_batthealth(v) for v in volts[:11] + volts[12:]]
+    for bm in (255, 0, 1, 2, 3):
+        modes = []
+        for v in volts:
+            bm_next = weatherflow.get_battmode(v, modes[-1] if modes else bm)
+            modes.append(bm_next)
+        assert weatherflow.get_battmode_array(volts, bm, block=4).tolist() == modes
+    degrees = [0, 11.24, 11.25, 128, 348.75, 359.9, 360]
+    assert weatherflow.degrees2text_array(degrees).tolist() == [weatherflow.degrees2text(d) for d in degrees]
+    rssi = [-17, -50, -51, -87, -100, -101]
+    assert weatherflow.get_rssi_text_array(rssi).tolist() == [weatherflow.get_rssi_text(r) for r in rssi]
+    sensors = [0, 4, 0, 65, 32768, 65]
+    assert weatherflow.get_device_status_sensortext_array(sensors).tolist() == [weatherflow.get_device_status_sensortext(s) for s in sensors]
+    seconds = [0, 1, 61, 3600, 1670133, 604800 * 2 + 7]
+    assert weatherflow.get_secondstext_array(seconds).tolist() == [weatherflow.get_secondstext(s) for s in seconds]
+    assert weatherflow.get_secondstext_array(seconds, 1).tolist() == [weatherflow.get_secondstext(s, 1) for s in seconds]
+
+
+def test_journal_store_survives_kill_and_compacts(tmp_path):
+    statefile = str(tmp_path / "status.json")
+    wf_notify = weatherflow.Notifications()
+    assert wf_notify.open(statefile, journal=True) == 0
+    wf_notify.get_status(weatherflow.msg_device_status(PKT_DEVICE_STATUS)[1])
+    wf_notify.get_status(weatherflow.msg_hub_status(PKT_HUB_STATUS)[1])
+    wf_notify.get_status(weatherflow.msg_hub_status(dict(PKT_HUB_STATUS, uptime=5))[1])
+    journal = (tmp_path / "status.json.journal").read_text().splitlines()
+    assert len(journal) == 3 and json.loads(journal[-1])['set']['uptime'] == 5
+    # Killed without close() - and part way through writing another entry
+    with open(statefile + ".journal", "a") as partial:
+        partial.write('{"serial": "HB-00000001", "se')
+    expected = json.loads(json.dumps(weatherflow.notify.alert_json))
+    assert weatherflow.Notifications().open(statefile, journal=True) == 2
+    assert weatherflow.notify.alert_json == expected
+    assert json.load(open(statefile)) == expected and (tmp_path / "status.json.journal").read_text() == ""
+
+
+def test_sqlite_store_keeps_status_and_notifications(tmp_path):
+    store = weatherflow.SQLiteStore(str(tmp_path / "status.db"), batch=2)
+    wf_notify = weatherflow.Notifications()
+    wf_notify.open(None, store=store)
+    wf_notify.get_status(weatherflow.msg_hub_status(PKT_HUB_STATUS)[1])
+    wf_notify.get_status(weatherflow.msg_hub_status(dict(PKT_HUB_STATUS, uptime=5))[1])
+    wf_notify.get_status(weatherflow.msg_device_status(PKT_DEVICE_STATUS)[1])
+    reboots = store.notifications('HB-00000001', 'reboot', since=time.time() - 30 * 86400)
+    assert [(notify_type, event, payload['old_uptime']) for epoch, notify_type, device, event, payload in reboots] == [('hub', 'reboot', 1670133)]
+    assert [value for epoch, field, value in store.device_history('HB-00000001', 'uptime')] == [1670133, 5]
+    expected = json.loads(json.dumps(weatherflow.notify.alert_json))
+    wf_notify.close()
+    assert weatherflow.Notifications().open(None, store=weatherflow.SQLiteStore(str(tmp_path / "status.db"))) == 2
+    assert weatherflow.notify.alert_json == expected
+    assert weatherflow.notify.alert_json['devices'] == ['HB-00000001', 'AR-00004049']
+
+
+def test_offline_deadline_tracks_online_devices():
+    wf_notify = weatherflow.Notifications()
+    wf_notify.open('/nonexistent/status.json')
+    assert wf_notify.offline_deadline() is None
+    wf_notify.get_status(weatherflow.msg_hub_status(PKT_HUB_STATUS)[1])
+    deadline = wf_notify.offline_deadline(timeout=1000)
+    assert deadline == weatherflow.notify.alert_json['HB-00000001']['last_seen'] + 1001
+
+
+def test_offline_all_reports_every_expired_device():
+    epoch = [1600000000]
+    wf_notify = weatherflow.Notifications()
+    wf_notify.open('/nonexistent/status.json', clock=lambda: epoch[0])
+    try:
+        for serial in ("AR-00000001", "AR-00000002", "AR-00000003"):
+            wf_notify.get_status(weatherflow.msg_device_status(dict(PKT_DEVICE_STATUS, serial_number=serial))[1])
+            epoch[0] += 10
+        wf_notify.get_status(weatherflow.msg_device_status(dict(PKT_DEVICE_STATUS, serial_number="AR-00000001"))[1])
+        epoch[0] += 330
+        assert wf_notify.offline_all() == []
+        assert wf_notify.offline_deadline() == 1600000010 + 361
+        epoch[0] += 30
+        events = wf_notify.offline_all()
+        assert [(notify_device, notify_event) for notify_type, notify_device, notify_event, notify_json in events] == [
+            ("AR-00000002", 'offline'), ("AR-00000003", 'offline')]
+        assert wf_notify.offline_all() == [] and wf_notify.offline_deadline() == 1600000030 + 361
+        epoch[0] += 400
+        assert wf_notify.offline()[1] == "AR-00000001" and wf_notify.offline()[0] is False
+        wf_notify.get_status(weatherflow.msg_device_status(dict(PKT_DEVICE_STATUS, serial_number="AR-00000002"))[1])
+        assert wf_notify.offline_deadline() == epoch[0] + 361
+    finally:
+        weatherflow.set_clock()
+
+
+def test_dispatcher_batches_and_keeps_connection_alive():
+    import http.server
+    import threading
+    posts = []
+
+    class Webhook(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            posts.append((self.client_address, body))
+            self.send_response(500 if body['attachments'][-1]['title'] == "Last" else 200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"ok")
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.HTTPServer(('127.0.0.1', 0), Webhook)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:" + str(server.server_address[1]) + "/hook"
+    errors = []
+    dispatcher = weatherflow.Dispatcher({'slack': weatherflow.SlackChannel(url, '#technical', rate=20, burst=1)},
+                                        on_error=lambda channel, messages, error: errors.append((channel, len(messages), error)))
+    try:
+        for number in range(6):
+            assert dispatcher.send("Title " + str(number), "Text", 'ok' if number % 2 else 'error')
+        time.sleep(0.3)
+        assert dispatcher.send("Last", "Text", 'warning', channel='slack')
+    finally:
+        dispatcher.close(5)
+        server.shutdown()
+    titles = [attachment['title'] for client, body in posts for attachment in body['attachments']]
+    assert titles == ["Title " + str(number) for number in range(6)] + ["Last"]
+    assert len(posts) < 7 and len(set(client for client, body in posts)) == 1
+    assert posts[0][1]['attachments'][0]['color'] == 'danger' and posts[0][1]['channel'] == '#technical'
+    assert errors == [('slack', 1, "HTTP 500: ok")] and dispatcher.failed == 1 and dispatcher.sent == 6
+
+
+def test_webhook_retries_only_closed_connections():
+    import http.server
+    import threading
+    posts = []
+
+    class Webhook(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            posts.append(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+            if len(posts) == 3:
+                time.sleep(1)  # Past the client timeout, after the post has arrived
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            self.close_connection = len(posts) == 1  # Closed without telling the client
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Webhook)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    channel = weatherflow.WebhookChannel("http://127.0.0.1:" + str(server.server_address[1]) + "/hook", rate=None, timeout=0.5)
+    try:
+        assert channel.post([("One", "Text", 'ok')]) is None
+        time.sleep(0.1)
+        assert channel.post([("Two", "Text", 'ok')]) is None
+        assert channel.post([("Three", "Text", 'ok')]) is not None
+    finally:
+        channel.close()
+        server.shutdown()
+    assert [body[0]['title'] for body in posts] == ["One", "Two", "Three"]
+
+
+def test_dispatcher_bounds_pending_and_closes_when_full():
+    posts = []
+
+    class Channel(weatherflow.WebhookChannel):
+        def post(self, messages):
+            time.sleep(0.2)
+            posts.append([msgtitle for msgtitle, msgtext, msgstatus in messages])
+
+    limited = weatherflow.Dispatcher({'hook': Channel("http://127.0.0.1/", rate=0.001, burst=1)}, batch=1, pending_size=3)
+    for number in range(10):
+        limited.send(str(number), "Text", 'ok')
+    time.sleep(0.5)
+    assert posts == [['0']] and limited.dropped >= 6
+    limited.close(0.1)  # Rate limited for a long time - the worker is left behind
+    posts[:] = []
+    full = weatherflow.Dispatcher({'hook': Channel("http://127.0.0.1/", rate=None)}, queue_size=1)
+    assert full.send("One", "Text", 'ok')
+    time.sleep(0.1)  # Posting One
+    assert full.send("Two", "Text", 'ok') and not full.send("Three", "Text", 'ok')
+    started = time.monotonic()
+    full.close(5)
+    assert time.monotonic() - started < 1 and posts == [['One'], ['Two']] and full.dropped == 1
+
+
+def test_event_coalescer_summarises_storms():
+    epoch = [1600000000]
+    weatherflow.set_clock(lambda: epoch[0])
+    try:
+        coalescer = weatherflow.EventCoalescer(window=600, stations=2)
+        assert coalescer.add(*weatherflow.status(weatherflow.msg_evt_precip(PKT_EVT_PRECIP)[1])) == []
+        for distance, energy in ((27, 3848), (5, 100), (12, 9000)):
+            strike = dict(PKT_EVT_STRIKE, evt=[epoch[0], distance, energy])
+            assert coalescer.add(*weatherflow.status(weatherflow.msg_evt_strike(strike)[1])) == []
+            epoch[0] += 60
+        assert coalescer.add('station', 'AR-1', 'offline', {}) == [('station', 'AR-1', 'offline', {})]
+        assert coalescer.deadline() == 1600000600
+        # A third station closes the oldest window early
+        closed = coalescer.add('station', 'ST-3', 'precip', {})
+        assert closed == [('station', 'SK-00008453', 'precip', {})]
+        epoch[0] = 1600000600
+        [(notify_type, notify_device, notify_event, notify_json)] = coalescer.expire()
+        assert (notify_device, notify_event) == ('AR-00004049', 'strike_summary')
+        assert notify_json == {'count': 3, 'first': 1600000000, 'last': 1600000120, 'strike_distance_min': 5,
+                               'strike_distance_mean': 14.7, 'strike_energy_max': 9000}
+        assert "3 times" in weatherflow.notification(notify_type, notify_device, notify_event, notify_json)[0]
+        assert coalescer.flush() == [('station', 'ST-3', 'precip', {})] and coalescer.deadline() is None
+    finally:
+        weatherflow.set_clock()
+
+
+def test_rule_engine_thresholds_and_changes():
+    epoch = [1600000000]
+    weatherflow.set_clock(lambda: epoch[0])
+    try:
+        rules = weatherflow.RuleEngine([
+            {"name": "hub_rssi", "type": "hub_status", "field": "WiFi RSSI (dBm)", "op": "<", "value": -90, "for": 300},
+            {"type": "device_status", "field": "Battery Mode", "op": "change", "status": "error"}
+        ])
+        assert list(rules.table) == ['hub_status', 'device_status']
+        assert rules.check(weatherflow.decode_packet(encode(PKT_OBS_ST), records=True)[2]) == []
+        weak = dict(PKT_HUB_STATUS, rssi=-95)
+        assert rules.check(weatherflow.decode_packet(encode(weak), records=True)[2]) == []
+        epoch[0] += 300
+        [(notify_type, notify_device, notify_event, notify_json)] = rules.check(weatherflow.decode_packet(encode(weak), records=True)[2])
+        assert (notify_type, notify_device, notify_event) == ('hub', 'HB-00000001', 'rule')
+        assert notify_json['value'] == -95 and notify_json['since'] == 1600000000
+        assert weatherflow.notification(notify_type, notify_device, notify_event, notify_json)[2] == 'warning'
+        # Fires once while the signal stays weak, then clears
+        assert rules.check(weatherflow.decode_packet(encode(weak), records=True)[2]) == []
+        [cleared] = rules.check(weatherflow.decode_packet(encode(PKT_HUB_STATUS), records=True)[2])
+        assert cleared[2] == 'rule_ok' and weatherflow.notification(*cleared)[2] == 'ok'
+        # Battery mode follows get_battmode() hysteresis
+        for volts, expected in ((2.50, []), (2.42, []), (2.40, ['1 was 0']), (2.40, []), (2.38, ['2 was 1'])):
+            events = rules.check(weatherflow.decode_packet(encode(dict(PKT_DEVICE_STATUS, voltage=volts)), records=True)[2])
+            assert [str(e[3]['value']) + " was " + str(e[3]['old_value']) for e in events] == expected
+        with pytest.raises(ValueError):
+            weatherflow.RuleEngine([{"type": "hub_status", "field": "WiFi RSSI (dBm)", "op": "~"}])
+    finally:
+        weatherflow.set_clock()
+
+
+def test_metrics_exporter_serves_latest_readings():
+    import urllib.request
+    exporter = weatherflow.MetricsExporter(port=0, address='127.0.0.1')
+    try:
+        for pkt in ALL_PACKETS:
+            exporter.update(*weatherflow.decode_packet(encode(pkt), records=True))
+        exporter.update(*weatherflow.decode_packet(b'not json'))
+        exporter.count('notifications_total', {'event': 'offline'})
+        with urllib.request.urlopen("http://127.0.0.1:" + str(exporter.port) + "/metrics") as response:
+            assert response.headers['Content-Type'].startswith("text/plain")
+            lines = response.read().decode().splitlines()
+        assert 'weatherflow_obs_air_temperature_celsius{serial="ST-00000512"} 22.37' in lines
+        assert 'weatherflow_device_rssi_dbm{serial="AR-00004049"} -17' in lines
+        assert 'weatherflow_device_battery_mode{serial="AR-00004049"} 0' in lines
+        assert 'weatherflow_hub_wifi_rssi_dbm{serial="HB-00000001"} -62' in lines
+        assert 'weatherflow_packets_total{type="obs_st"} 1' in lines
+        assert '# TYPE weatherflow_decode_errors_total counter' in lines
+        assert 'weatherflow_notifications_total{event="offline"} 1' in lines
+        # Scrapes reuse the page until a value changes
+        page = exporter.exposition()
+        assert exporter.exposition() is page
+        exporter.set('queue_depth', 0)
+        assert exporter.exposition() is not page and b'weatherflow_queue_depth 0\n' in exporter.exposition()
+    finally:
+        exporter.close()
+
+
+def test_instrumentation_snapshot(tmp_path, caplog):
+    caplog.set_level("INFO")
+    instruments = weatherflow.instrument.enable(log_seconds=0)
+    try:
+        notify = weatherflow.Notifications()
+        notify.open(str(tmp_path / "status.json"))
+        for pkt in ALL_PACKETS:
+            notify.get_status(weatherflow.decode_packet(encode(pkt))[2])
+        weatherflow.decode_packet(b'not json')
+        snapshot = instruments.snapshot()
+    finally:
+        weatherflow.instrument.disable()
+    assert snapshot['stages']['parse']['count'] == len(ALL_PACKETS) + 1
+    assert snapshot['stages']['decode']['count'] == len(ALL_PACKETS) + 1
+    assert snapshot['stages']['status']['count'] == len(ALL_PACKETS)
+    assert sum(snapshot['stages']['decode']['histogram'].values()) == len(ALL_PACKETS) + 1
+    assert snapshot['packets']['hub_status'] == {'HB-00000001': 1}
+    assert snapshot['errors'] == {'json': 1}
+    assert any("WeatherFlow timings: " in record.message for record in caplog.records)
+    # Nothing is collected once disabled
+    weatherflow.decode_packet(encode(PKT_OBS_ST))
+    assert instruments.snapshot()['stages']['decode']['count'] == len(ALL_PACKETS) + 1
+
+
+def test_connect_reports_hub_sequence_gaps(conn):
+    send_packets(conn, [dict(PKT_HUB_STATUS, seq=seq) for seq in (48, 49, 52, 1, 2)])
+    assert len(conn.get_events(timeout=2)) == 5
+    assert conn.loss()['hubs'] == {'HB-00000001': 2}
+    assert conn.loss()['hub_status'] == 2
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="SO_RXQ_OVFL is Linux only")
+def test_connect_reports_kernel_drops():
+    wf_conn = weatherflow.Connect(ip='127.0.0.1', port=0, rcvbuf=4096)
+    try:
+        assert wf_conn.overflow
+        send_packets(wf_conn, [PKT_OBS_ST] * 500)  # Far more than the receive buffer holds
+        received = len(wf_conn.get_events(max_batch=500, timeout=2))
+        # The count arrives with the first datagram queued after the drops
+        send_packets(wf_conn, [PKT_OBS_ST])
+        wf_conn.get_event()
+        assert wf_conn.loss()['kernel'] == 500 - received
+    finally:
+        wf_conn.close()
+
+
+def test_event_bus_decodes_once_for_matching_subscribers():
+    wf_conn = weatherflow.Connect(ip='127.0.0.1', port=0, records=True)
+    bus = weatherflow.EventBus(connection=wf_conn)
+    status = bus.subscribe(types=['device_status', 'hub_status'])
+    hub = bus.subscribe(types=['hub_status'], serials=['HB-00000001'])
+    seen = []
+    bus.subscribe(serials=['AR-00004049'], callback=lambda *event: seen.append(event))
+    try:
+        send_packets(wf_conn, ALL_PACKETS)
+        received = 0
+        while received < len(ALL_PACKETS):
+            received += bus.pump(timeout=2)
+        # obs_st, rapid_wind and evt_precip are from serials nobody subscribed to, so were never parsed
+        assert (bus.published, bus.skipped) == (3, 3)
+        assert [event[0] for event in status.get_events(timeout=0)] == ['device_status', 'hub_status']
+        hub_event = hub.get_event(timeout=0)
+        assert hub_event[0] == 'hub_status' and isinstance(hub_event[2], weatherflow.Record)
+        assert [event[0] for event in seen] == ['evt_strike', 'device_status']
+        assert hub.get_event(timeout=0)[0] is False
+        # The same event object goes to every subscriber
+        send_packets(wf_conn, [PKT_HUB_STATUS])
+        bus.start()
+        assert status.get_event(timeout=2) is hub.get_event(timeout=2)
+    finally:
+        bus.close()
+
+
+def test_event_bus_shares_read_only_records():
+    wf_conn = weatherflow.Connect(ip='127.0.0.1', port=0)
+    try:
+        with pytest.raises(ValueError):
+            weatherflow.EventBus(connection=wf_conn)
+    finally:
+        wf_conn.close()
+    record = weatherflow.decode_packet(encode(PKT_DEVICE_STATUS), records=True)[2]
+    for name in ('rssi', '_cache'):
+        with pytest.raises(AttributeError):
+            setattr(record, name, 0)
+    with pytest.raises(AttributeError):
+        del record.serial
+    record.interface = 'eth0'
+    assert record['Station RSSI (dBm)'] == -17 and record['Interface'] == 'eth0'
+
+
+def test_connect_filters_types_and_serials_before_parsing(monkeypatch):
+    wf_conn = weatherflow.Connect(ip='127.0.0.1', port=0, types=['device_status', 'hub_status'])
+    try:
+        parsed = []
+        monkeypatch.setattr(weatherflow.core, 'decode_datagram', lambda data, *args: parsed.append(bytes(data)) or (False, None, {}))
+        send_packets(wf_conn, ALL_PACKETS)
+        assert len(wf_conn.get_events(timeout=2)) == 2
+        assert [json.loads(data)['type'] for data in parsed] == ['device_status', 'hub_status']
+        assert wf_conn.filtered == 4
+    finally:
+        monkeypatch.undo()
+        wf_conn.close()
+    wf_conn = weatherflow.Connect(ip='127.0.0.1', port=0, serials=['HB-00000001'])
+    try:
+        send_packets(wf_conn, ALL_PACKETS)
+        assert wf_conn.get_event()[0] == 'hub_status'
+        assert wf_conn.filtered == 5
+    finally:
+        wf_conn.close()
+
+
+def wait_until(condition, timeout = 2):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_relay_fans_out_to_unix_socket_clients(tmp_path):
+    wf_conn = weatherflow.Connect(ip='127.0.0.1', port=0)
+    relay = weatherflow.Relay(str(tmp_path / "relay.sock"), connection=wf_conn).start()
+    everything = weatherflow.RelayClient(relay.path, timeout=2)
+    hubs = weatherflow.RelayClient(relay.path, types=['hub_status'], timeout=2)
+    try:
+        assert wait_until(lambda: any(sub.types for sub in list(relay.subscribers.values())))
+        send_packets(wf_conn, ALL_PACKETS)
+        events = [everything.get_event() for pkt in ALL_PACKETS]
+        assert [wf_type for wf_type, wf_serial, wf_json in events] == [pkt['type'] for pkt in ALL_PACKETS]
+        assert events[0][2] == weatherflow.decode_packet(encode(PKT_OBS_ST))[2]
+        wf_type, wf_serial, wf_json = hubs.get_event()
+        assert (wf_type, wf_serial, wf_json['WiFi RSSI (dBm)']) == ('hub_status', 'HB-00000001', -62)
+        assert relay.published == len(ALL_PACKETS)
+        everything.close()
+        assert wait_until(lambda: len(relay.subscribers) == 1)
+    finally:
+        relay.close()
+    assert hubs.get_event() is None
+
+
+def test_relay_slow_subscriber_policy(tmp_path):
+    relay = weatherflow.Relay(str(tmp_path / "relay.sock"), connection=weatherflow.Connect(ip='127.0.0.1', port=0), queue=4)
+    slow = [weatherflow.RelayClient(relay.path) for _ in range(2)]
+    try:
+        while len(relay.subscribers) < 2:
+            relay.pump(1)
+        oldest, disconnect = relay.subscribers.values()
+        frame = b'x' * 65536 + b'\n'
+        for _ in range(100):  # Far more than the socket buffer, and the queue, hold
+            relay.send(oldest, frame)
+        assert len(oldest.frames) == 4 and oldest.dropped > 0
+        relay.policy = 'disconnect'
+        for _ in range(100):
+            relay.send(disconnect, frame)
+        assert relay.disconnected == 1 and list(relay.subscribers.values()) == [oldest]
+    finally:
+        for client in slow:
+            client.close()
+        relay.close()
@@ -1,2 +1,17 @@
 from .core import *
 from .notify import *
+from .aio import *
+from .history import *
+from .wind import *
+from .archive import *
+from .replay import *
+from .parallel import *
+from .arrays import *
+from .store import *
+from .dispatch import *
+from .coalesce import *
+from .rules import *
+from .exporter import *
+from .bus import *
+from .relay import *
+from . import instrument
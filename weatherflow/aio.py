@@ -0,0 +1,103 @@
+""" Receive Tempest Packets on an asyncio Event Loop """
+import asyncio
+from .core import *
+from . import instrument
+
+
+class WeatherFlowProtocol(asyncio.DatagramProtocol):
+    """ Decode each datagram as it arrives and queue the event for AsyncConnect """
+
+    def __init__(self, queue, privacy = False, records = False):
+        self.queue = queue
+        self.privacy = privacy
+        self.records = records
+        self.dropped = 0
+
+    def datagram_received(self, data, addr):
+        event = decode_packet(data, self.privacy, self.records)
+        if self.queue.full():
+            # Consumer is behind - discard the oldest event so we keep current data
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+        if instrument.active is not None:
+            instrument.active.queue('async', self.queue.qsize())
+
+    def error_received(self, exc):
+        if __debug__: print("WeatherFlow UDP Error: " + str(exc))
+
+    def connection_lost(self, exc):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)  # Wake any waiting reader so iteration can end
+
+
+class AsyncConnect:
+    """ asyncio version of Connect - use 'async for wf_type, wf_serial, wf_json in conn' """
+
+    def __init__(self, ip = '255.255.255.255', port = 50222, privacy = False, queue = 1024, records = False):
+        """ Initilise - the socket is opened on the running loop by open() or first use """
+        self.ip = ip
+        self.port = port
+        self.privacy = privacy
+        self.records = records
+        self.queuesize = queue
+        self.transport = None
+        self.protocol = None
+        self.queue = None
+        self.closed = False  # Set once the connection lost marker has been read
+
+    async def open(self):
+        """ Bind the socket and start receiving on the running event loop """
+        if self.transport is None:
+            loop = asyncio.get_running_loop()
+            self.queue = asyncio.Queue(self.queuesize)
+            self.transport, self.protocol = await loop.create_datagram_endpoint(
+                lambda: WeatherFlowProtocol(self.queue, self.privacy, self.records),
+                sock=opensocket(self.ip, self.port))
+        return self
+
+    def close(self):
+        """ Closing Resources """
+        if self.transport:
+            self.transport.close()
+        if __debug__: print("Closing WeatherFlow Routines")
+
+    def dropped(self):
+        """ Number of events discarded because the consumer fell behind """
+        return self.protocol.dropped if self.protocol else 0
+
+    async def get_event(self, timeout = None):
+        """ Wait for the next decoded (type, serial, json) event, returns None once closed """
+        if self.closed:
+            return None
+        await self.open()
+        try:
+            if timeout is None:
+                event = await self.queue.get()
+            else:
+                event = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            wf_json = {
+                "error": "UDP Packet Timeout of " + str(timeout) + " seconds exceeded",
+                "value": "This could be because no weather stations are online"
+            }
+            return False, None, wf_json
+        if event is None:
+            self.closed = True
+        return event
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self.get_event()
+        if event is None:
+            raise StopAsyncIteration
+        return event
@@ -0,0 +1,157 @@
+""" Append-only Raw Packet Archive with Memory Mapped, Indexed Replay """
+import bisect
+import mmap
+import os
+import struct
+
+# Segment files start with a magic string, then hold records of
+#   receive time (float64 epoch), sender length (uint16), packet length (uint16), sender, packet
+# Each segment has a sparse index file of (receive time, record offset) entries
+ARCHIVE_MAGIC = b'WFA1'
+ARCHIVE_SUFFIX = '.wfa'
+ARCHIVE_INDEX_SUFFIX = '.idx'
+RECORD_HEADER = struct.Struct('<dHH')
+INDEX_ENTRY = struct.Struct('<dQ')
+
+
+def segment_name(start):
+    """ Segment file name - the start time in milliseconds, so names sort in time order """
+    return "wf-" + str(int(start * 1000)).zfill(15) + ARCHIVE_SUFFIX
+
+
+def format_addr(addr):
+    """ Sender address as ip:port text """
+    if isinstance(addr, tuple):
+        return str(addr[0]) + ":" + str(addr[1])
+    return str(addr or "")
+
+
+class PacketArchive:
+    """ Write every received datagram to size limited, append-only segment files """
+
+    def __init__(self, directory, segment_bytes = 64 * 1024 * 1024, index_every = 64):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_every = index_every  # Records between index entries
+        self.segment = None
+        self.index = None
+        self.size = 0
+        self.records = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, epoch, addr, data):
+        """ Append one datagram received at epoch from addr """
+        sender = format_addr(addr).encode("utf-8")
+        length = RECORD_HEADER.size + len(sender) + len(data)
+        if self.segment is None or self.size + length > self.segment_bytes:
+            self.rotate(epoch)
+        if self.records % self.index_every == 0:
+            self.index.write(INDEX_ENTRY.pack(epoch, self.size))
+        self.segment.write(RECORD_HEADER.pack(epoch, len(sender), len(data)))
+        self.segment.write(sender)
+        self.segment.write(data)
+        self.size += length
+        self.records += 1
+
+    def rotate(self, epoch):
+        """ Close the current segment and start a new one """
+        self.close()
+        path = os.path.join(self.directory, segment_name(epoch))
+        self.segment = open(path, "ab")
+        self.index = open(path[:-len(ARCHIVE_SUFFIX)] + ARCHIVE_INDEX_SUFFIX, "ab")
+        if self.segment.tell() == 0:
+            self.segment.write(ARCHIVE_MAGIC)
+        self.size = self.segment.tell()
+        self.records = 0
+
+    def flush(self):
+        """ Push buffered records to the operating system """
+        if self.segment:
+            self.segment.flush()
+            self.index.flush()
+
+    def close(self):
+        """ Closing Resources """
+        if self.segment:
+            self.segment.close()
+            self.index.close()
+        self.segment = None
+        self.index = None
+
+
+class IndexTimes:
+    """ Sequence of the times in a memory mapped index, so bisect can search it in place """
+
+    def __init__(self, index, entries):
+        self.index = index
+        self.entries = entries
+
+    def __len__(self):
+        return self.entries
+
+    def __getitem__(self, position):
+        return INDEX_ENTRY.unpack_from(self.index, position * INDEX_ENTRY.size)[0]
+
+
+class ArchiveReader:
+    """ Read datagrams back from a PacketArchive directory by time range """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def segments(self):
+        """ (start time, path) of every segment, oldest first """
+        found = []
+        for name in os.listdir(self.directory):
+            if name.startswith("wf-") and name.endswith(ARCHIVE_SUFFIX):
+                found.append((int(name[3:-len(ARCHIVE_SUFFIX)]) / 1000, os.path.join(self.directory, name)))
+        return sorted(found)
+
+    def read(self, start = None, end = None):
+        """ Yield (epoch, sender, packet bytes) for records with start <= epoch <= end """
+        segments = self.segments()
+        first = 0
+        if start is not None:
+            # The segment that started last at or before start may hold the first record
+            first = max(0, bisect.bisect_right([begin for begin, path in segments], start) - 1)
+        for begin, path in segments[first:]:
+            if end is not None and begin > end:
+                break
+            for record in self.read_segment(path, start, end):
+                yield record
+
+    def read_segment(self, path, start = None, end = None):
+        """ Yield records from one segment, seeking to start with the sparse index """
+        if os.path.getsize(path) <= len(ARCHIVE_MAGIC):
+            return
+        with open(path, "rb") as segment, mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:len(ARCHIVE_MAGIC)] != ARCHIVE_MAGIC:
+                raise ValueError("Not a WeatherFlow packet archive segment: " + path)
+            offset = len(ARCHIVE_MAGIC)
+            if start is not None:
+                offset = self.seek(path, start, offset, len(data))
+            while offset + RECORD_HEADER.size <= len(data):
+                epoch, sender_len, data_len = RECORD_HEADER.unpack_from(data, offset)
+                record_end = offset + RECORD_HEADER.size + sender_len + data_len
+                if record_end > len(data):
+                    break  # Partly written record at the end of the segment
+                if end is not None and epoch > end:
+                    return
+                if start is None or epoch >= start:
+                    sender = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + sender_len].decode("utf-8")
+                    yield epoch, sender, data[record_end - data_len:record_end]
+                offset = record_end
+
+    def seek(self, path, start, offset, size):
+        """ Offset of the last indexed record before start """
+        index_path = path[:-len(ARCHIVE_SUFFIX)] + ARCHIVE_INDEX_SUFFIX
+        if not os.path.exists(index_path) or os.path.getsize(index_path) < INDEX_ENTRY.size:
+            return offset
+        with open(index_path, "rb") as index_file, mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ) as index:
+            times = IndexTimes(index, len(index) // INDEX_ENTRY.size)
+            position = bisect.bisect_left(times, start) - 1
+            if position >= 0:
+                indexed = INDEX_ENTRY.unpack_from(index, position * INDEX_ENTRY.size)[1]
+                if indexed < size:
+                    offset = indexed
+        return offset
@@ -0,0 +1,135 @@
+""" NumPy versions of the derived field helpers - whole columns in, whole columns out """
+from .core import *
+from .notify import get_battmode
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DIRECTIONS = ("N", "NNE", "NE", "ENE", "E", "ESE", "SE", "SSE", "S", "SSW", "SW", "WSW", "W", "WNW", "NW", "NNW")
+RSSI_LEVELS = ((-50, "Excellent"), (-60, "Very Good"), (-70, "Good"), (-80, "Low"), (-90, "Very Low"), (-100, "Poor"))
+# get_battmode() states in scan order - 5 (invalid) and 255 (unknown) both start again from the voltage alone
+BATTMODE_STATES = (0, 1, 2, 3, 5, 255)
+# Every voltage get_battmode() compares against
+BATTMODE_VOLTS = (2.355, 2.375, 2.39, 2.41, 2.415, 2.455)
+
+
+def as_array(values, dtype = float):
+    """ NumPy array of values, raising ImportError if numpy is not installed """
+    if numpy is None:
+        raise ImportError("numpy is required for weatherflow arrays")
+    return numpy.asarray(values, dtype=dtype)
+
+
+def degrees2text_array(degrees):
+    """ degrees2text() for an array of wind directions """
+    val = numpy.trunc(as_array(degrees) / 22.5 + .5).astype(numpy.int64)
+    return numpy.array(DIRECTIONS)[val % 16]
+
+
+def get_batthealth_array(volts):
+    """ get_batthealth() for an array of battery voltages """
+    volts = as_array(volts)
+    with numpy.errstate(invalid='ignore'):
+        charging = (volts >= 2.35) & (volts <= 2.9)
+        health = numpy.minimum((volts - 2.35) * 256, 100)
+        return numpy.select([charging, volts > 2.1], [health, 0], 255).astype(numpy.int64)
+
+
+def get_rssi_text_array(rssi):
+    """ get_rssi_text() for an array of RSSI (dBm) readings """
+    rssi = as_array(rssi)
+    with numpy.errstate(invalid='ignore'):
+        return numpy.select([rssi >= level for level, text in RSSI_LEVELS], [text for level, text in RSSI_LEVELS], "Bad")
+
+
+def battmode_maps(bm_volts = BATTMODE_VOLTS):
+    """ get_battmode() as a state map for each class of voltage reading.
+        Readings between (or equal to) the same thresholds move every mode the same way, so each
+        class is worked out once from a representative voltage. Returns maps[c][s], the index of
+        the mode after a reading of class c (numbered as battmode_class() does) when the mode was
+        BATTMODE_STATES[s] """
+    samples = [bm_volts[0] - 1]
+    for index, volts in enumerate(bm_volts):
+        samples.append(volts)
+        samples.append((volts + bm_volts[index + 1]) / 2 if index + 1 < len(bm_volts) else volts + 1)
+    samples.append(float('nan'))
+    return [tuple(BATTMODE_STATES.index(get_battmode(volts, mode)) for mode in BATTMODE_STATES) for volts in samples]
+
+
+def battmode_class(volts, bm_volts = BATTMODE_VOLTS):
+    """ Class of each voltage reading - even between thresholds, odd on a threshold, last for NaN """
+    thresholds = numpy.array(bm_volts)
+    classes = numpy.searchsorted(thresholds, volts, 'left') + numpy.searchsorted(thresholds, volts, 'right')
+    classes[numpy.isnan(volts)] = 2 * len(bm_volts) + 1
+    return classes
+
+
+def get_battmode_array(volts, bm = 255, block = 256):
+    """ Battery mode after each reading of a voltage series, as if get_battmode() was called on each in turn
+        starting from mode bm. The mode maps of the readings are composed (with a small lookup table of
+        every composition) into running maps within blocks of readings, then each block is started from
+        the mode the previous block ended in, so the hysteresis needs a Python step per block, not per reading """
+    volts = as_array(volts).reshape(-1)
+    count = len(volts)
+    if not count:
+        return numpy.zeros(0, dtype=numpy.int64)
+    maps = battmode_maps()
+    index = {mode_map: number for number, mode_map in enumerate(maps)}
+    identity = tuple(range(len(BATTMODE_STATES)))
+    if identity not in index:
+        index[identity] = len(maps)
+        maps.append(identity)
+    # Close the maps under composition - table[a][b] is map a applied after map b
+    table = {}
+    while len(table) < len(maps) ** 2:
+        for a in range(len(maps)):
+            for b in range(len(maps)):
+                if (a, b) not in table:
+                    mode_map = tuple(maps[a][state] for state in maps[b])
+                    if mode_map not in index:
+                        index[mode_map] = len(maps)
+                        maps.append(mode_map)
+                    table[(a, b)] = index[mode_map]
+    compose = numpy.zeros((len(maps), len(maps)), dtype=numpy.intp)
+    for (a, b), mode_map in table.items():
+        compose[a, b] = mode_map
+    steps = numpy.concatenate([battmode_class(volts), numpy.full(-count % block, index[identity])]).reshape(-1, block)
+    span = 1
+    while span < block:
+        steps[:, span:] = compose[steps[:, span:], steps[:, :-span]]
+        span *= 2
+    maps = numpy.array(maps)
+    state = BATTMODE_STATES.index(bm if bm in BATTMODE_STATES else 255)
+    starts = []
+    for mode_map in maps[steps[:, -1]].tolist():
+        starts.append(state)
+        state = mode_map[state]
+    return numpy.array(BATTMODE_STATES)[maps[steps, numpy.array(starts)[:, None]]].reshape(-1)[:count]
+
+
+def get_device_status_sensortext_array(sensor_status):
+    """ get_device_status_sensortext() for an array of sensor_status values - each distinct value is decoded once """
+    values, inverse = numpy.unique(as_array(sensor_status, numpy.int64), return_inverse=True)
+    texts = numpy.array([get_device_status_sensortext(value) for value in values.tolist()] or [""])
+    return texts[inverse.reshape(-1)]
+
+
+def get_secondstext_array(seconds, granularity = 3):
+    """ get_secondstext() for an array of durations in seconds - the text for each distinct count of
+        each unit is made once, and joined for every duration with numpy.char """
+    remaining = as_array(seconds, numpy.int64).reshape(-1)
+    text = numpy.zeros(remaining.shape, dtype=str)
+    used = numpy.zeros(remaining.shape, dtype=numpy.int64)
+    for name, count in INTERVALS:
+        value = remaining // count
+        remaining = remaining - value * count
+        shown = (value != 0) & (used < granularity)
+        if not shown.any():
+            continue
+        values, inverse = numpy.unique(value, return_inverse=True)
+        words = [str(number) + " " + (name.rstrip('s') if number == 1 else name) for number in values.tolist()]
+        part = numpy.where(used > 0, numpy.array([", " + word for word in words])[inverse], numpy.array(words)[inverse])
+        text = numpy.char.add(text, numpy.where(shown, part, ""))
+        used += shown
+    return text
@@ -0,0 +1,141 @@
+""" Share the Events from one Connection with many Subscribers - each packet is decoded once, only if it is wanted """
+import threading
+from collections import deque
+from .core import *
+
+
+class Subscription:
+    """ Events for one subscriber, by type and serial number (None for all) - passed to callback(wf_type,
+        wf_serial, wf_json) on the bus thread, or queued for get_event(). At most maxlen events are queued,
+        the oldest is dropped (and counted in .dropped) when a subscriber falls behind """
+
+    def __init__(self, bus, types = None, serials = None, callback = None, maxlen = 1024):
+        self.bus = bus
+        self.types = None if types is None else frozenset(types)
+        self.serials = None if serials is None else frozenset(serials)
+        self.callback = callback
+        self.maxlen = maxlen
+        self.events = deque()
+        self.ready = threading.Condition()
+        self.dropped = 0
+
+    def matches(self, wf_type, wf_serial):
+        return (self.types is None or wf_type in self.types) and (self.serials is None or wf_serial in self.serials)
+
+    def deliver(self, event):
+        if self.callback is not None:
+            self.callback(*event)
+            return
+        with self.ready:
+            if len(self.events) >= self.maxlen:
+                self.events.popleft()
+                self.dropped += 1
+            self.events.append(event)
+            self.ready.notify()
+
+    def get_event(self, timeout = WEATHERFLOW_UDP_TIMEOUT):
+        """ Wait for the next (type, serial, json) event - the bus must be running (see EventBus.start()) """
+        with self.ready:
+            if self.ready.wait_for(lambda: self.events, timeout):
+                return self.events.popleft()
+        wf_json = {
+            "error": "UDP Packet Timeout of " + str(timeout) + " seconds exceeded",
+            "value": "This could be because no weather stations are online"
+        }
+        return False, None, wf_json
+
+    def get_events(self, max_batch = 64, timeout = WEATHERFLOW_UDP_TIMEOUT):
+        """ Wait up to timeout seconds for an event, then return it with any others queued """
+        with self.ready:
+            if not self.ready.wait_for(lambda: self.events, timeout):
+                return []
+            return [self.events.popleft() for _ in range(min(max_batch, len(self.events)))]
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    """ One Connect for every consumer in a process. The type and serial number of each datagram are
+        found with a byte scan, and packets no subscriber wants are never parsed. Others are decoded
+        once, as read only Records, and the same event is delivered to every subscriber """
+
+    def __init__(self, ip = '255.255.255.255', port = 50222, privacy = False, connection = None):
+        """ connection - an open Connect to use in place of ip and port, opened with records = True """
+        if connection is not None and not connection.records:
+            raise ValueError("EventBus shares each event between subscribers, so needs a Connect with records = True")
+        self.connection = connection or Connect(ip, port, privacy, records = True)
+        self.subscriptions = ()
+        self.routes = {}  # (type, serial) bytes from the packet - subscriptions wanting it
+        self.lock = threading.Lock()
+        self.published = 0
+        self.skipped = 0  # Datagrams no subscriber wanted
+        self.stopping = False
+        self.thread = None
+
+    def subscribe(self, types = None, serials = None, callback = None, maxlen = 1024):
+        """ Subscription to events of the given types from the given serial numbers (None for all),
+            e.g. subscribe(types = ['device_status', 'hub_status']) """
+        subscription = Subscription(self, types, serials, callback, maxlen)
+        with self.lock:
+            self.subscriptions += (subscription,)
+            self.routes = {}  # Replaced after the subscriptions, so a route is never cached from the old list
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions = tuple(sub for sub in self.subscriptions if sub is not subscription)
+            self.routes = {}
+
+    def route(self, type_bytes, serial_bytes):
+        """ Subscriptions matching a packet's type and serial number """
+        routes = self.routes
+        key = (type_bytes, serial_bytes)
+        subscriptions = routes.get(key)
+        if subscriptions is None:
+            wf_type = None if type_bytes is None else type_bytes.decode("utf-8", "replace")
+            wf_serial = None if serial_bytes is None else serial_bytes.decode("utf-8", "replace")
+            subscriptions = routes[key] = tuple(sub for sub in self.subscriptions if sub.matches(wf_type, wf_serial))
+        return subscriptions
+
+    def publish(self, data, nbytes = None, interface = None):
+        """ Decode a datagram and deliver it to every matching subscriber, returns how many there were.
+            data can be bytes, a bytearray, or a pool buffer from Connect.get_datagrams() """
+        if nbytes is None:
+            nbytes = len(data)
+        raw = data.obj if isinstance(data, memoryview) else data  # Pool buffers view a whole bytearray
+        subscriptions = self.route(peek_field(raw, b'"type"', nbytes), peek_field(raw, b'"serial_number"', nbytes))
+        if not subscriptions:
+            self.skipped += 1
+            return 0
+        event = self.connection.decode(data[:nbytes], interface)
+        self.published += 1
+        for subscription in subscriptions:
+            subscription.deliver(event)
+        return len(subscriptions)
+
+    def pump(self, timeout = WEATHERFLOW_UDP_TIMEOUT, max_batch = 64):
+        """ Receive and publish one batch of datagrams, returns how many were received """
+        datagrams = self.connection.get_datagrams(max_batch, timeout)
+        for buffer, nbytes, addr, interface in datagrams:
+            self.publish(buffer, nbytes, interface)
+        return len(datagrams)
+
+    def run(self):
+        """ Publish until close() """
+        while not self.stopping:
+            self.pump(0.5)
+
+    def start(self):
+        """ Publish from a background thread, so subscribers can use get_event() """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="weatherflow-bus", daemon=True)
+            self.thread.start()
+        return self
+
+    def close(self):
+        """ Stop publishing and close the connection """
+        self.stopping = True
+        if self.thread is not None:
+            self.thread.join()
+        self.connection.close()
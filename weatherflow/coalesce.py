@@ -0,0 +1,79 @@
+""" Combine Lightning and Rain Notifications from each Station into Summaries """
+from collections import OrderedDict
+from .core import *
+from .notify import now
+
+# Notification events held back and summarised
+COALESCE_EVENTS = ('strike', 'precip')
+
+
+class EventCoalescer:
+    """ Hold back strike and precip notifications and send one summary per station and event for each
+        window seconds, starting from the first event. Each open window keeps only running totals, and
+        at most stations windows are open - the oldest is closed early to make room """
+
+    def __init__(self, window = 600, stations = 1000, events = COALESCE_EVENTS):
+        self.window = window
+        self.stations = stations
+        self.events = events
+        self.windows = OrderedDict()  # (device, event) - running totals, in the order they close
+
+    def add(self, notify_type, notify_device, notify_event, notify_json):
+        """ Notifications to send now for a status() result - summaries of windows that have closed,
+            and the result itself unless it is held back """
+        summaries = self.expire()
+        if notify_event not in self.events:
+            if notify_type:
+                summaries.append((notify_type, notify_device, notify_event, notify_json))
+            return summaries
+        key = (notify_device, notify_event)
+        window = self.windows.get(key)
+        if window is None:
+            if len(self.windows) >= self.stations:
+                summaries.append(self.close(next(iter(self.windows))))
+            window = self.windows[key] = {'type': notify_type, 'closes': now() + self.window, 'count': 0, 'json': notify_json}
+        epoch = notify_json.get('strike_time', now())
+        window['count'] += 1
+        window['first'] = min(window.get('first', epoch), epoch)
+        window['last'] = max(window.get('last', epoch), epoch)
+        if 'strike_distance' in notify_json:
+            window['distance_min'] = min(window.get('distance_min', notify_json['strike_distance']), notify_json['strike_distance'])
+            window['distance_total'] = window.get('distance_total', 0) + notify_json['strike_distance']
+            window['distances'] = window.get('distances', 0) + 1
+            window['energy_max'] = max(window.get('energy_max', notify_json['strike_energy']), notify_json['strike_energy'])
+        return summaries
+
+    def close(self, key):
+        """ Notification for a window - the event itself if there was only one """
+        window = self.windows.pop(key)
+        notify_device, notify_event = key
+        if window['count'] == 1:
+            return window['type'], notify_device, notify_event, window['json']
+        notify_json = {
+            'count': window['count'],
+            'first': window['first'],
+            'last': window['last']
+        }
+        if 'distances' in window:
+            notify_json['strike_distance_min'] = window['distance_min']
+            notify_json['strike_distance_mean'] = round(window['distance_total'] / window['distances'], 1)
+            notify_json['strike_energy_max'] = window['energy_max']
+        return window['type'], notify_device, notify_event + '_summary', notify_json
+
+    def expire(self):
+        """ Notifications for every window that has closed """
+        summaries = []
+        wf_now = now()
+        while self.windows and next(iter(self.windows.values()))['closes'] <= wf_now:
+            summaries.append(self.close(next(iter(self.windows))))
+        return summaries
+
+    def deadline(self):
+        """ Epoch time the next window closes, None if none are open """
+        if not self.windows:
+            return None
+        return next(iter(self.windows.values()))['closes']
+
+    def flush(self):
+        """ Notifications for every open window - on shutdown """
+        return [self.close(key) for key in list(self.windows)]
@@ -4,11 +4,22 @@ import logging
 import datetime
 import sys
 import socket
+import selectors
+import struct
+import time
+from collections import deque
+from collections.abc import Mapping
+from operator import attrgetter
+from . import instrument
 
 # Timeout in seconds - recommend 10 seconds and should be < 60 seconds
 # This ensures we don't block our main loop for too long waiting to Rx
 WEATHERFLOW_UDP_TIMEOUT = 10
 
+# Linux socket option adding the count of datagrams the kernel dropped to received messages
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40)
+OVERFLOW_ANCBUFSIZE = socket.CMSG_SPACE(4) if hasattr(socket, 'CMSG_SPACE') else 0
+
 # This code is based off the WeatherFlow Tempest UDP Reference - v170
 # https://weatherflow.github.io/Tempest/api/udp/v170/
 
@@ -58,123 +69,319 @@ MAP_EVT_STRIKE = [
 ]
 
 class Connect:
-    def __init__(self, ip = '255.255.255.255', port = 50222, privacy = False, buffer = 4096):
-        """ Initilise """
-        self.tempest = opensocket(ip, port)
+    def __init__(self, ip = '255.255.255.255', port = 50222, privacy = False, buffer = 4096, records = False, archive = None, binds = None, rcvbuf = None, types = None, serials = None):
+        """ Initilise - records = True returns compact Record objects (see as_dict()) instead of dicts,
+            and every datagram received is written to archive (a PacketArchive) if one is given.
+            binds is a list of (ip, port), (ip, port, interface) or 'ip:port' addresses to listen on together
+            in place of ip and port - events are then tagged with the 'Interface' they arrived on.
+            rcvbuf asks for a larger kernel receive buffer (bytes) so bursts aren't dropped - see loss().
+            types and serials (e.g. types = ['device_status', 'hub_status']) keep only packets of those types
+            from those serial numbers - the rest are dropped after a byte scan, before they are parsed """
         self.privacy = privacy
+        self.types = None if types is None else frozenset(wf_type.encode() for wf_type in types)
+        self.serials = None if serials is None else frozenset(serial.encode() for serial in serials)
+        self.filtering = types is not None or serials is not None
+        self.filtered = 0  # Packets dropped by types and serials
+        self.records = records
+        self.archive = archive
         self.buffersize = buffer
+        self.pool = []  # Preallocated receive buffers (memoryviews) reused by get_events
+        self.tagged = binds is not None
+        if binds is None:
+            binds = [(ip, port)]
+        # All sockets are non-blocking and waited on together, one thread handles every interface
+        self.selector = selectors.DefaultSelector()
+        self.sockets = []
+        self.ready = deque()  # Sockets the last select() reported as readable
+        for bind in binds:
+            wf_ip, wf_port, wf_device = parse_bind(bind)
+            sock = opensocket(wf_ip, wf_port, wf_device, rcvbuf)
+            sock.setblocking(False)
+            self.sockets.append(sock)
+            self.selector.register(sock, selectors.EVENT_READ, wf_device or format_bind(sock.getsockname()))
+        self.tempest = self.sockets[0]
+        self.rcvbuf = self.tempest.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        self.overflow = overflow_enabled(self.tempest)  # Kernel drop counts arrive with each datagram
+        self.kernel_drops = {}  # interface - datagrams dropped by the kernel as the receive buffer was full
+        self.sequence = SequenceGaps()
 
     def close(self):
         """ Closing Resources """
-        if self.tempest:
-            self.tempest.close()
+        self.selector.close()
+        for sock in self.sockets:
+            sock.close()
+        if self.archive:
+            self.archive.flush()
         if __debug__: print("Closing WeatherFlow Routines")
 
+    def interfaces(self):
+        """ Names used to tag events from each bind address """
+        return [key.data for key in self.selector.get_map().values()]
+
     def get_event(self):
-        wf_type = False
-        wf_serial = None
-        wf_json = {
-            "error": "Failure in Receiving/Decoding Packet",
-            "value": ""
-        }
-        data = "{}".encode()
-        try:
-            data, addr = self.tempest.recvfrom(self.buffersize)
-            if is_json(data.decode("utf-8")):
-                wf_pkt = json.loads(data.decode("utf-8"))
-                if 'type' in wf_pkt:
-                    wf_type_pkt = str(wf_pkt['type'])
-                    if 'serial_number' in wf_pkt:
-                        wf_serial = get_serial(wf_pkt)
-                    else:
-                        wf_serial = None
-                    if wf_type_pkt == 'obs_st':
-                        wf_type, wf_json = msg_obs_st(wf_pkt, self.privacy)
-                    elif wf_type_pkt == 'device_status':
-                        wf_type, wf_json = msg_device_status(wf_pkt, self.privacy)
-                    elif wf_type_pkt == 'rapid_wind':
-                        wf_type, wf_json = msg_rapid_wind(wf_pkt, self.privacy)
-                    elif wf_type_pkt == 'evt_strike':
-                        wf_type, wf_json = msg_evt_strike(wf_pkt, self.privacy)
-                    elif wf_type_pkt == 'evt_precip':
-                        wf_type, wf_json = msg_evt_precip(wf_pkt, self.privacy)
-                    elif wf_type_pkt == 'hub_status':
-                        wf_type, wf_json = msg_hub_status(wf_pkt, self.privacy)
-                else:
+        """ Wait for a single packet and return the decoded (type, serial, json) event """
+        deadline = time.monotonic() + WEATHERFLOW_UDP_TIMEOUT
+        while True:
+            if not self.ready:
+                self.ready.extend(self.selector.select(max(0, deadline - time.monotonic())))
+                if not self.ready:
                     wf_json = {
-                        "error": "Unknown Json Payload type",
-                        "value": str(wf_pkt)
+                        "error": "UDP Packet Timeout of " + str(WEATHERFLOW_UDP_TIMEOUT) + " seconds exceeded",
+                        "value": "This could be because no weather stations are online"
                     }
+                    return False, None, wf_json
+            key, mask = self.ready.popleft()
+            try:
+                if instrument.active is None:
+                    data, addr = self.recvfrom(key)
+                else:
+                    data, addr = instrument.active.time('recv', self.recvfrom, key)
+            except BlockingIOError:
+                continue  # Already drained by get_events
+            if self.archive:
+                self.archive.write(time.time(), addr, data)
+            if self.filtering and not packet_wanted(data, self.types, self.serials):
+                self.filtered += 1
+                continue
+            return self.decode(data, key.data)
+
+    def get_events(self, max_batch = 64, timeout = WEATHERFLOW_UDP_TIMEOUT):
+        """ Wait up to timeout seconds for packets, then drain everything queued (up to max_batch) on every
+            socket into the reusable buffer pool and return a list of decoded (type, serial, json) events.
+            An empty list is returned if the timeout expires with nothing received """
+        return [self.decode(view[:nbytes], interface) for view, nbytes, addr, interface in self.get_datagrams(max_batch, timeout)]
+
+    def get_datagrams(self, max_batch = 64, timeout = WEATHERFLOW_UDP_TIMEOUT):
+        """ get_events() without decoding - a list of (buffer, nbytes, addr, interface) for each datagram.
+            buffer is a memoryview of a bytearray from the pool, and is reused by the next call """
+        views = self.get_buffers(max_batch)
+        received = []
+        active = [key for key, mask in self.selector.select(timeout)]
+        self.ready.clear()
+        # Take a packet from each readable socket in turn so one busy interface can't starve the others
+        while active and len(received) < max_batch:
+            for key in list(active):
+                if len(received) >= max_batch:
+                    break
+                try:
+                    if instrument.active is None:
+                        nbytes, addr = self.recvfrom_into(key, views[len(received)])
+                    else:
+                        nbytes, addr = instrument.active.time('recv', self.recvfrom_into, key, views[len(received)])
+                    received.append((nbytes, addr, key.data))
+                except BlockingIOError:
+                    active.remove(key)
+        if self.archive:
+            now = time.time()
+            for index, (nbytes, addr, interface) in enumerate(received):
+                self.archive.write(now, addr, views[index][:nbytes])
+        datagrams = [(views[index], nbytes, addr, interface) for index, (nbytes, addr, interface) in enumerate(received)]
+        if self.filtering:
+            datagrams = [datagram for datagram in datagrams if packet_wanted(datagram[0].obj, self.types, self.serials, datagram[1])]
+            self.filtered += len(received) - len(datagrams)
+        return datagrams
+
+    def recvfrom(self, key):
+        """ recvfrom() a selected socket, noting the kernel drop count when it is sent """
+        if not self.overflow:
+            return key.fileobj.recvfrom(self.buffersize)
+        data, ancdata, flags, addr = key.fileobj.recvmsg(self.buffersize, OVERFLOW_ANCBUFSIZE)
+        if ancdata:
+            self.note_overflow(key.data, ancdata)
+        return data, addr
+
+    def recvfrom_into(self, key, view):
+        """ recvfrom_into() a selected socket, noting the kernel drop count when it is sent """
+        if not self.overflow:
+            return key.fileobj.recvfrom_into(view)
+        nbytes, ancdata, flags, addr = key.fileobj.recvmsg_into([view], OVERFLOW_ANCBUFSIZE)
+        if ancdata:
+            self.note_overflow(key.data, ancdata)
+        return nbytes, addr
+
+    def note_overflow(self, interface, ancdata):
+        for level, kind, value in ancdata:
+            if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL and len(value) >= 4:
+                self.kernel_drops[interface] = struct.unpack('=I', value[:4])[0]
+
+    def loss(self):
+        """ Datagrams known to be lost - dropped by the kernel because the receive buffer was full (only
+            seen on Linux, and only once a datagram is received after the drops), and hub_status packets
+            missing from each hub's sequence numbers, which also counts drops on the network """
+        return {
+            'kernel': sum(self.kernel_drops.values()),
+            'kernel_interfaces': dict(self.kernel_drops),
+            'hub_status': sum(self.sequence.missing.values()),
+            'hubs': dict(self.sequence.missing)
+        }
+
+    def decode(self, data, interface = None):
+        """ Decode a datagram, tagging the event with the interface it arrived on when listening on several """
+        wf_type, wf_serial, wf_json = decode_packet(data, self.privacy, self.records)
+        if wf_type == 'hub_status':
+            self.sequence.update(wf_serial, wf_json.get('Sequence'))
+        if self.tagged:
+            if isinstance(wf_json, Record):
+                wf_json.interface = interface
             else:
-                wf_json = {
-                    "error": "Non Json or invalid packet received",
-                    "value": None
-                }
-        except socket.timeout:
-            wf_json = {
-                "error": "UDP Packet Timeout of " + str(WEATHERFLOW_UDP_TIMEOUT) + " seconds exceeded",
-                "value": "This could be because no weather stations are online"
-            }
-            pass
-        except ValueError as e:
-            wf_json = {
-                "error": "Exception Value Error",
-                "value": str(e),
-                "line": except_line()
-            }
-        except TypeError as e:
-            wf_json = {
-                "error": "Exception Type Error",
-                "value": str(e),
-                "line": except_line()
-            }
-        except KeyboardInterrupt as e:
-            wf_type = False
-            wf_json = {
-                "error": "Interupt",
-                "value": None
-            }
-            wf_serial = None
-            raise
-        except:
-            wf_json = {
-                "error": "Exception Error",
-                "value": "unknown error",
-                "line": except_line()
-            }
-            raise
+                wf_json['Interface'] = interface
         return wf_type, wf_serial, wf_json
 
+    def get_buffers(self, count):
+        """ Return count receive buffers from the pool, growing it the first time a larger batch is requested """
+        while len(self.pool) < count:
+            self.pool.append(memoryview(bytearray(self.buffersize)))
+        return self.pool
+
+def decode_packet(data, privacy = False, records = False):
+    """ Decode a raw UDP datagram (str, bytes, bytearray or memoryview) into a (type, serial, json) event.
+        The payload is parsed once and dispatched on its type through DECODERS, or RECORDS when records
+        is True. On bad input the json is an error dict with a 'category' of json, payload, unsupported or decode """
+    instruments = instrument.active
+    if instruments is None:
+        return decode_datagram(data, privacy, records)
+    started = time.perf_counter()
+    event = decode_datagram(data, privacy, records)
+    instruments.decoded(event, time.perf_counter() - started)
+    return event
+
+def decode_datagram(data, privacy = False, records = False):
+    """ decode_packet() without instrumentation """
+    try:
+        if not isinstance(data, (str, bytes, bytearray)):
+            data = str(data, "utf-8")
+        if instrument.active is None:
+            wf_pkt = json.loads(data)
+        else:
+            wf_pkt = instrument.active.time('parse', json.loads, data)
+    except ValueError as e:
+        return False, None, decode_error('json', "Non Json or invalid packet received", str(e))
+    if not isinstance(wf_pkt, dict) or 'type' not in wf_pkt:
+        return False, None, decode_error('payload', "Unknown Json Payload type", str(wf_pkt))
+    wf_serial = None
+    if 'serial_number' in wf_pkt:
+        wf_serial = get_serial(wf_pkt)
+    decoder = DECODERS.get(str(wf_pkt['type']))
+    if decoder is None:
+        return False, wf_serial, decode_error('unsupported', "Unsupported packet type", str(wf_pkt['type']))
+    if records:
+        try:
+            return wf_pkt['type'], wf_serial, RECORDS[wf_pkt['type']].from_packet(wf_pkt, privacy)
+        except Exception as e:
+            return False, wf_serial, decode_error('decode', "Failure decoding " + str(wf_pkt['type']) + " packet", str(e))
+    wf_type, wf_json = decoder(wf_pkt, privacy)
+    if not wf_type:
+        value = wf_json.get('value') if 'error' in wf_json else None
+        wf_json = decode_error('decode', "Failure decoding " + str(wf_pkt['type']) + " packet", value)
+    return wf_type, wf_serial, wf_json
+
+def decode_error(category, error, value):
+    """ Structured error returned in place of an event when a packet cannot be decoded """
+    return {
+        "error": error,
+        "value": value,
+        "category": category
+    }
+
+def peek_field(data, key, end = None):
+    """ Value of a top level string field such as b'"serial_number"' found with a byte scan of the raw
+        packet (bytes or bytearray) without parsing it, or None if the field isn't there """
+    if end is None:
+        end = len(data)
+    start = data.find(key, 0, end)
+    if start < 0:
+        return None
+    colon = data.find(b':', start + len(key), end)
+    quote = data.find(b'"', colon + 1, end)
+    if colon < 0 or quote < 0 or data[colon + 1:quote].strip():
+        return None  # Not a string value
+    close = data.find(b'"', quote + 1, end)
+    if close < 0:
+        return None
+    return bytes(data[quote + 1:close])
+
+def packet_wanted(data, types = None, serials = None, end = None):
+    """ True if a raw packet's type is in types and its serial_number in serials (sets of bytes, None for any) """
+    if types is not None and peek_field(data, b'"type"', end) not in types:
+        return False
+    return serials is None or peek_field(data, b'"serial_number"', end) in serials
+
 def except_line():
     """ When an exception occurs retrieve the line number """
     exception_type, exception_object, exception_traceback = sys.exc_info()
     line_number = exception_traceback.tb_lineno
     return str(line_number)
 
-def opensocket(wf_ip, wf_port):
+class SequenceGaps:
+    """ hub_status packets missing from each hub's seq numbers """
+
+    def __init__(self):
+        self.last = {}  # hub serial - last seq received
+        self.missing = {}  # hub serial - packets missed
+
+    def update(self, serial, seq):
+        """ Note the seq of a hub_status packet, returning how many are missing before it """
+        if seq is None:
+            return 0
+        seq = int(seq)
+        last = self.last.get(serial)
+        self.last[serial] = seq
+        if last is None or seq <= last:
+            return 0  # First packet, or the hub restarted its count
+        gap = seq - last - 1
+        if gap:
+            self.missing[serial] = self.missing.get(serial, 0) + gap
+        return gap
+
+
+def opensocket(wf_ip, wf_port, wf_device = None, rcvbuf = None):
     # Open WeatherFlow RX Socket - Normally on port 50222
     tempest = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) # UDP
     tempest.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if rcvbuf:
+        # Linux doubles this, and caps it at net.core.rmem_max
+        tempest.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    if sys.platform.startswith('linux') and OVERFLOW_ANCBUFSIZE:
+        try:
+            tempest.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+        except OSError:
+            pass
+    if wf_device:
+        # Receive broadcasts from one interface (e.g. a VLAN) only - Linux, needs CAP_NET_RAW
+        tempest.setsockopt(socket.SOL_SOCKET, getattr(socket, 'SO_BINDTODEVICE', 25), wf_device.encode())
     tempest.bind((wf_ip, wf_port))
     tempest.settimeout(WEATHERFLOW_UDP_TIMEOUT)  # Timeout in seconds - ensure main loop cycles every now and then for offline device check
     return tempest
 
-def is_json(myjson):
-    """ Return True if source string is valid json """
-    jsontype = 0
+def overflow_enabled(sock):
+    """ True if the kernel adds its drop count to datagrams received on sock """
+    if not sys.platform.startswith('linux') or not OVERFLOW_ANCBUFSIZE:
+        return False
     try:
-        json_object = json.loads(myjson)
-        del json_object
-        jsontype = 1  # Return Type of JSON
-    except:
-        pass
+        return sock.getsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL) != 0
+    except OSError:
+        return False
+
+def parse_bind(bind):
+    """ (ip, port, interface) from a (ip, port), (ip, port, interface) or 'ip:port' bind address """
+    if isinstance(bind, str):
+        wf_ip, wf_port = bind.rsplit(':', 1)
+        return wf_ip, int(wf_port), None
+    if len(bind) == 3:
+        return bind[0], int(bind[1]), bind[2]
+    return bind[0], int(bind[1]), None
+
+def format_bind(addr):
+    """ ip:port text for a socket address """
+    return str(addr[0]) + ":" + str(addr[1])
+
+def is_json(myjson):
+    """ Return True if source string (or bytes) is valid json """
     try:
-        json_object = json.loads(myjson.decode("utf-8"))
-        del json_object
-        jsontype = 2  # Return Type of JSON
-    except:
-        pass
-    return json
+        json.loads(myjson)
+    except (ValueError, TypeError):
+        return False
+    return True
 
 # #########################################################################
 # ######    WEATHERFLOW COMMON MESSAGE HANDLING DETAIL ROUTINES     #######
@@ -183,9 +390,15 @@ def is_json(myjson):
 def get_uptime(myjson):
     """ Get uptime in Seconds and return human readable day, hours, min, seconds based on granularity """
     text = "Uptime Not Available"
+    if 'uptime' in myjson:
+        text = get_uptimetext(myjson['uptime'])
+    return text
+
+def get_uptimetext(uptime):
+    """ Human readable uptime from seconds, or 'Uptime Not Available' if it isn't a number """
+    text = "Uptime Not Available"
     try:
-        if 'uptime' in myjson:
-            text = get_secondstext(int(myjson['uptime']),3)
+        text = get_secondstext(int(uptime),3)
     except:
         pass
     return text
@@ -291,12 +504,12 @@ def msg_hub_status(myjson, privacy = False, raw = False):
             try:
                 text['Hub Serial'] = get_serial(myjson, privacy)
                 text['Hub Firmware'] = myjson['firmware_revision']
-                text['Uptime (seconds)'] = myjson['uptime']
+                text['Uptime (seconds)'] = int(myjson['uptime'])
                 text['Uptime (text)'] = get_uptime(myjson)
-                text['WiFi RSSI (dBm)'] = myjson['rssi']
+                text['WiFi RSSI (dBm)'] = int(myjson['rssi'])
                 text['WiFi RSSI Quality'] = get_rssi_text(myjson['rssi'])
                 text['Reset Reasons'] = get_hub_reset_flags(myjson['reset_flags'])
-                text['Sequence'] = myjson['seq']
+                text['Sequence'] = int(myjson['seq'])
                 if 'radio_stats' in myjson:
                     radstat = myjson['radio_stats']
                     text['Radio Stats'] = json.dumps(radstat)
@@ -313,28 +526,25 @@ def msg_hub_status(myjson, privacy = False, raw = False):
                 if raw: text['raw'] = myjson
                 wf_type = myjson['type']
             except ValueError as e:
-                wf_json = {
+                text = {
                     "error": "Exception ValueError processing hub_status",
                     "value": str(e),
                     "line": except_line()
                 }
             except TypeError as e:
-                wf_json = {
+                text = {
                     "error": "Exception TypeError processing hub_status",
                     "value": str(e),
                     "line": except_line()
                 }
             except:
-                wf_json = {
+                text = {
                     "error": "Exception Error processing hub_status",
                     "value": None,
                     "line": except_line()
                 }
     return wf_type, text
 
-
-
-
 # #########################################################################
 # ############    STATION MESSAGE HANDLING DETAIL ROUTINES     ############
 # #########################################################################
@@ -440,19 +650,19 @@ def msg_rapid_wind(myjson, privacy = False, raw = False):
                     if raw: text['raw'] = myjson
                     wf_type = myjson['type']
                 except ValueError as e:
-                    wf_json = {
+                    text = {
                         "error": "Exception ValueError processing rapid_wind",
                         "value": str(e),
                         "line": except_line()
                     }
                 except TypeError as e:
-                    wf_json = {
+                    text = {
                         "error": "Exception TypeError processing rapid_wind",
                         "value": str(e),
                         "line": except_line()
                     }
                 except:
-                    wf_json = {
+                    text = {
                         "error": "Exception Error processing rapid_wind",
                         "value": None,
                         "line": except_line()
@@ -475,19 +685,19 @@ def msg_evt_strike(myjson, privacy = False, raw = False):
                     if raw: text['raw'] = myjson
                     wf_type = myjson['type']
                 except ValueError as e:
-                    wf_json = {
+                    text = {
                         "error": "Exception ValueError processing evt_strike",
                         "value": str(e),
                         "line": except_line()
                     }
                 except TypeError as e:
-                    wf_json = {
+                    text = {
                         "error": "Exception TypeError processing evt_strike",
                         "value": str(e),
                         "line": except_line()
                     }
                 except:
-                    wf_json = {
+                    text = {
                         "error": "Exception Error processing evt_strike",
                         "value": None,
                         "line": except_line()
@@ -509,19 +719,19 @@ def msg_evt_precip(myjson, privacy = False, raw = False):
                     if raw: text['raw'] = myjson
                     wf_type = myjson['type']
                 except ValueError as e:
-                    wf_json = {
+                    text = {
                         "error": "Exception ValueError processing evt_precip",
                         "value": str(e),
                         "line": except_line()
                     }
                 except TypeError as e:
-                    wf_json = {
+                    text = {
                         "error": "Exception TypeError processing evt_precip",
                         "value": str(e),
                         "line": except_line()
                     }
                 except:
-                    wf_json = {
+                    text = {
                         "error": "Exception Error processing evt_precip",
                         "value": None,
                         "line": except_line()
@@ -554,19 +764,19 @@ def msg_obs_st(myjson, privacy = False, raw = False):
                     if raw: text['raw'] = myjson
                     wf_type = myjson['type']
                 except ValueError as e:
-                    wf_json = {
+                    text = {
                         "error": "Exception ValueError processing obs_st",
                         "value": str(e),
                         "line": except_line()
                     }
                 except TypeError as e:
-                    wf_json = {
+                    text = {
                         "error": "Exception TypeError processing obs_st",
                         "value": str(e),
                         "line": except_line()
                     }
                 except:
-                    wf_json = {
+                    text = {
                         "error": "Exception Error processing obs_st",
                         "value": None,
                         "line": except_line()
@@ -582,14 +792,14 @@ def msg_device_status(myjson, privacy = False, raw = False):
             try:
                 text['Device Serial'] = get_serial(myjson, privacy)
                 text['Hub Serial'] = get_hub_sn(myjson, privacy)
-                text['Uptime (seconds)'] = myjson['uptime']
+                text['Uptime (seconds)'] = int(myjson['uptime'])
                 text['Uptime (text)'] = get_uptime(myjson)
                 text['Battery Voltage'] = float(myjson['voltage'])
                 text['Battery Health (%)'] = get_batthealth(float(myjson['voltage']))
                 text['Station Firmware'] = myjson['firmware_revision']
-                text['Station RSSI (dBm)'] = myjson['rssi']
+                text['Station RSSI (dBm)'] = int(myjson['rssi'])
                 text['Station RSSI Quality'] = get_rssi_text(myjson['rssi'])
-                text['Hub RSSI (dBm)'] = myjson['hub_rssi']
+                text['Hub RSSI (dBm)'] = int(myjson['hub_rssi'])
                 text['Hub RSSI Quality'] = get_rssi_text(myjson['hub_rssi'])
                 text['Sensor Status'] = get_device_status_sensortext(myjson['sensor_status'])
                 text['Sensor Binary'] = get_device_status_sensorbinary(myjson['sensor_status'])
@@ -598,21 +808,328 @@ def msg_device_status(myjson, privacy = False, raw = False):
                 if raw: text['raw'] = myjson
                 wf_type = myjson['type']
             except ValueError as e:
-                wf_json = {
+                text = {
                     "error": "Exception ValueError processing device_status",
                     "value": str(e),
                     "line": except_line()
                 }
             except TypeError as e:
-                wf_json = {
+                text = {
                     "error": "Exception TypeError processing device_status",
                     "value": str(e),
                     "line": except_line()
                 }
             except:
-                wf_json = {
+                text = {
                     "error": "Exception Error processing device_status",
                     "value": None,
                     "line": except_line()
                 }
     return wf_type, text
+
+# #########################################################################
+# ###############    COMPACT EVENT RECORDS (__slots__)     ###############
+# #########################################################################
+
+# Record attribute names for the MAP_OBS_ST columns
+OBS_ST_FIELDS = (
+    'time', 'wind_lull', 'wind_avg', 'wind_gust', 'wind_direction', 'wind_interval',
+    'pressure', 'air_temperature', 'humidity', 'illuminance', 'uv', 'solar_radiation',
+    'rain', 'precip_type', 'strike_distance', 'strike_count', 'battery', 'report_interval'
+)
+
+_OMIT = object()  # Field value meaning 'leave this key out of as_dict()'
+
+def _optional(name):
+    """ Field function for a slot the packet may not have, left out of as_dict() when it is None """
+    def field(record):
+        value = getattr(record, name)
+        return _OMIT if value is None else value
+    field.cached = False
+    return field
+
+def _number(value):
+    """ A numeric packet value, None where the device had no reading - raises ValueError or TypeError for anything else """
+    if value is None or value.__class__ is int or value.__class__ is float:
+        return value
+    return float(value)
+
+def _radio_stat(index, convert):
+    """ Field function for an optional entry of the hub_status radio_stats list """
+    def field(record):
+        if record.radio_stats is None or len(record.radio_stats) <= index:
+            return _OMIT
+        return convert(record.radio_stats[index])
+    return field
+
+def _air_temperature(record):
+    if record.air_temperature is not None and float(record.air_temperature) == float(-44.99):
+        return None  # Failed TEMP Sensor
+    return record.air_temperature
+_air_temperature.cached = False
+
+class Record(Mapping):
+    """ Compact decoded event holding only the raw packet values in __slots__.
+        Reads like the msg_* dict - slot fields are read straight from the slots, and the text, health and
+        DateTime fields are worked out on first access and cached (as_dict() works out everything, uncached) """
+    __slots__ = ('interface', '_cache')  # interface is set by Connect when listening on several interfaces
+    type = None
+    # (human readable key, slot name or function of the record) in msg_* dict order
+    FIELDS = ()
+    KEYS = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.KEYS = {key: attrgetter(field) if isinstance(field, str) else field for key, field in cls.FIELDS}
+        # as_dict() copies the slot fields in one go (every record has at least serial and type), then works out the others
+        slots = [(key, field) for key, field in cls.FIELDS if isinstance(field, str)]
+        cls.TEMPLATE = dict.fromkeys(key for key, field in cls.FIELDS)
+        cls.SLOT_KEYS = tuple(key for key, field in slots)
+        cls.SLOT_VALUES = attrgetter(*(field for key, field in slots))
+        cls.DERIVED = tuple((key, field) for key, field in cls.FIELDS if not isinstance(field, str))
+        cls.CACHED = frozenset(key for key, field in cls.DERIVED if getattr(field, 'cached', True))
+        # Slot descriptor setters, as __setattr__ refuses once a record is built
+        cls.SETTERS = tuple(getattr(cls, name).__set__ for name in cls.__slots__)
+
+    def __init__(self, *values):
+        _set_interface(self, None)
+        _set_cache(self, None)
+        for setter, value in zip(self.SETTERS, values):
+            setter(self, value)
+
+    def __setattr__(self, name, value):
+        """ Records are shared between subscribers (see EventBus), so only the interface can be set """
+        if name != 'interface':
+            raise AttributeError(type(self).__name__ + " is read only, can't set " + name)
+        _set_interface(self, value)
+
+    def __delattr__(self, name):
+        raise AttributeError(type(self).__name__ + " is read only, can't delete " + name)
+
+    def __setstate__(self, state):
+        """ Unpickle (ParallelConnect sends records between processes) - state is (None, slot values) """
+        for name, value in state[1].items():
+            object.__setattr__(self, name, value)
+
+    def field(self, key):
+        """ Value of a human readable field (_OMIT if this record doesn't have it), derived fields are cached after the first call """
+        if key == 'Interface':
+            return _OMIT if self.interface is None else self.interface
+        if key not in self.CACHED:
+            return self.KEYS[key](self)
+        if self._cache is None:
+            _set_cache(self, {})
+        try:
+            return self._cache[key]
+        except KeyError:
+            value = self._cache[key] = self.KEYS[key](self)
+            return value
+
+    def __getitem__(self, key):
+        value = self.field(key)
+        if value is _OMIT:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return (key in self.KEYS or key == 'Interface') and self.field(key) is not _OMIT
+
+    def __iter__(self):
+        for key, _ in self.FIELDS:
+            if self.field(key) is not _OMIT:
+                yield key
+        if self.interface is not None:
+            yield 'Interface'
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def as_dict(self):
+        """ Human readable dict - the same as produced by the msg_* decoders, built in one pass with no caching """
+        text = self.TEMPLATE.copy()
+        text.update(zip(self.SLOT_KEYS, self.SLOT_VALUES(self)))
+        for key, function in self.DERIVED:
+            value = function(self)
+            if value is _OMIT:
+                del text[key]
+            else:
+                text[key] = value
+        if self.interface is not None:
+            text['Interface'] = self.interface
+        return text
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self):
+        values = ", ".join(name + "=" + repr(getattr(self, name)) for name in self.__slots__)
+        return type(self).__name__ + "(" + values + ")"
+
+# Setters for the Record slots it changes itself, past its read only __setattr__
+_set_interface = Record.interface.__set__
+_set_cache = Record._cache.__set__
+
+class ObsSt(Record):
+    """ obs_st - Tempest Observation """
+    __slots__ = ('serial', 'hub_sn', 'firmware') + OBS_ST_FIELDS
+    type = 'obs_st'
+    FIELDS = list(zip(MAP_OBS_ST, OBS_ST_FIELDS))
+    FIELDS[OBS_ST_FIELDS.index('air_temperature')] = ('Air Temperature (C)', _air_temperature)
+    FIELDS += [
+        ('Station Firmware', _optional('firmware')),
+        ('Hub Serial', _optional('hub_sn')),
+        ('Wind Direction (text)', lambda r: _OMIT if r.wind_direction is None else degrees2text(int(r.wind_direction))),
+        ('Battery Charge State (%)', lambda r: _OMIT if r.battery is None else get_batthealth(float(r.battery))),
+        ('Station Serial', 'serial'),
+        ('DateTime', lambda r: epoch_text(r.time)),
+        ('type', 'type')
+    ]
+
+    @classmethod
+    def from_packet(cls, myjson, privacy = False):
+        obs_list = list(myjson['obs'][0][:len(OBS_ST_FIELDS)])
+        if len(obs_list) < len(OBS_ST_FIELDS) - 1:  # Report Interval may be missing
+            raise ValueError("obs_st observation has " + str(len(obs_list)) + " values")
+        try:
+            sum(obs_list)  # Checks they are all numbers in one call
+        except TypeError:  # A missing reading, or something to convert with _number()
+            obs_list = [_number(value) for value in obs_list]
+        obs_list += [None] * (len(OBS_ST_FIELDS) - len(obs_list))
+        hub_sn = get_hub_sn(myjson, privacy) if 'hub_sn' in myjson else None
+        firmware = int(myjson['firmware_revision']) if 'firmware_revision' in myjson else None
+        return cls(get_serial(myjson, privacy), hub_sn, firmware, *obs_list)
+
+class RapidWind(Record):
+    """ rapid_wind - Rapid Wind (every 3 seconds) """
+    __slots__ = ('serial', 'hub_sn', 'time', 'wind_speed', 'wind_direction')
+    type = 'rapid_wind'
+    FIELDS = [
+        ('Time Epoch', 'time'),
+        ('Wind Speed (m/s)', 'wind_speed'),
+        ('Wind Direction (degrees)', 'wind_direction'),
+        ('DateTime', lambda r: epoch_text(r.time)),
+        ('Station Serial', 'serial'),
+        ('Hub Serial', 'hub_sn'),
+        ('type', 'type')
+    ]
+
+    @classmethod
+    def from_packet(cls, myjson, privacy = False):
+        time_epoch, speed, direction = myjson['ob'][:3]
+        return cls(get_serial(myjson, privacy), get_hub_sn(myjson, privacy), int(time_epoch), _number(speed), _number(direction))
+
+class EvtStrike(Record):
+    """ evt_strike - Lightning Strike Event """
+    __slots__ = ('serial', 'hub_sn', 'time', 'distance', 'energy')
+    type = 'evt_strike'
+    FIELDS = [
+        ('Time Epoch', 'time'),
+        ('Distance (km)', 'distance'),
+        ('Energy', 'energy'),
+        ('DateTime', lambda r: epoch_text(r.time)),
+        ('Station Serial', 'serial'),
+        ('Hub Serial', 'hub_sn'),
+        ('type', 'type')
+    ]
+
+    @classmethod
+    def from_packet(cls, myjson, privacy = False):
+        time_epoch, distance, energy = myjson['evt'][:3]
+        return cls(get_serial(myjson, privacy), get_hub_sn(myjson, privacy), int(time_epoch), _number(distance), _number(energy))
+
+class EvtPrecip(Record):
+    """ evt_precip - Rain Start Event """
+    __slots__ = ('serial', 'hub_sn', 'time')
+    type = 'evt_precip'
+    FIELDS = [
+        ('DateTime', lambda r: epoch_text(r.time)),
+        ('Station Serial', 'serial'),
+        ('Hub Serial', 'hub_sn'),
+        ('type', 'type')
+    ]
+
+    @classmethod
+    def from_packet(cls, myjson, privacy = False):
+        return cls(get_serial(myjson, privacy), get_hub_sn(myjson, privacy), int(myjson['evt'][0]))
+
+class DeviceStatus(Record):
+    """ device_status - Station Status """
+    __slots__ = ('serial', 'hub_sn', 'timestamp', 'uptime', 'voltage', 'firmware', 'rssi', 'hub_rssi', 'sensor_status')
+    type = 'device_status'
+    FIELDS = [
+        ('Device Serial', 'serial'),
+        ('Hub Serial', 'hub_sn'),
+        ('Uptime (seconds)', 'uptime'),
+        ('Uptime (text)', lambda r: get_uptimetext(r.uptime)),
+        ('Battery Voltage', 'voltage'),
+        ('Battery Health (%)', lambda r: get_batthealth(r.voltage)),
+        ('Station Firmware', 'firmware'),
+        ('Station RSSI (dBm)', 'rssi'),
+        ('Station RSSI Quality', lambda r: get_rssi_text(r.rssi)),
+        ('Hub RSSI (dBm)', 'hub_rssi'),
+        ('Hub RSSI Quality', lambda r: get_rssi_text(r.hub_rssi)),
+        ('Sensor Status', lambda r: get_device_status_sensortext(r.sensor_status)),
+        ('Sensor Binary', lambda r: get_device_status_sensorbinary(r.sensor_status)),
+        ('DateTime', lambda r: epoch_text(r.timestamp)),
+        ('type', 'type')
+    ]
+
+    @classmethod
+    def from_packet(cls, myjson, privacy = False):
+        return cls(get_serial(myjson, privacy), get_hub_sn(myjson, privacy), int(myjson['timestamp']), int(myjson['uptime']),
+                   float(myjson['voltage']), myjson['firmware_revision'], int(myjson['rssi']), int(myjson['hub_rssi']),
+                   int(myjson['sensor_status']))
+
+class HubStatus(Record):
+    """ hub_status - Hub Status """
+    __slots__ = ('serial', 'timestamp', 'firmware', 'uptime', 'rssi', 'reset_flags', 'seq', 'radio_stats')
+    type = 'hub_status'
+    FIELDS = [
+        ('Hub Serial', 'serial'),
+        ('Hub Firmware', 'firmware'),
+        ('Uptime (seconds)', 'uptime'),
+        ('Uptime (text)', lambda r: get_uptimetext(r.uptime)),
+        ('WiFi RSSI (dBm)', 'rssi'),
+        ('WiFi RSSI Quality', lambda r: get_rssi_text(r.rssi)),
+        ('Reset Reasons', lambda r: get_hub_reset_flags(r.reset_flags)),
+        ('Sequence', 'seq'),
+        ('Radio Stats', lambda r: _OMIT if r.radio_stats is None else json.dumps(r.radio_stats)),
+        ('Radio Version', _radio_stat(0, int)),
+        ('Radio Reboot Count', _radio_stat(1, int)),
+        ('Radio I2C Bus Error Count', _radio_stat(2, int)),
+        ('Radio Status Text', _radio_stat(3, get_hub_radio_stats_status_text)),
+        ('Radio Status', _radio_stat(3, int)),
+        ('Radio Network ID', _radio_stat(4, int)),
+        # 'fs' and 'mqtt_stats' are for Weatherflow Internal Use
+        ('DateTime', lambda r: epoch_text(r.timestamp)),
+        ('type', 'type')
+    ]
+
+    @classmethod
+    def from_packet(cls, myjson, privacy = False):
+        return cls(get_serial(myjson, privacy), int(myjson['timestamp']), myjson['firmware_revision'], int(myjson['uptime']),
+                   int(myjson['rssi']), myjson['reset_flags'], int(myjson['seq']), myjson.get('radio_stats'))
+
+# Decoder for each packet type handled by decode_packet
+DECODERS = {
+    'obs_st': msg_obs_st,
+    'device_status': msg_device_status,
+    'rapid_wind': msg_rapid_wind,
+    'evt_strike': msg_evt_strike,
+    'evt_precip': msg_evt_precip,
+    'hub_status': msg_hub_status
+}
+
+# Record class for each packet type, used by decode_packet when records are requested
+RECORDS = {
+    'obs_st': ObsSt,
+    'device_status': DeviceStatus,
+    'rapid_wind': RapidWind,
+    'evt_strike': EvtStrike,
+    'evt_precip': EvtPrecip,
+    'hub_status': HubStatus
+}
@@ -0,0 +1,231 @@
+""" Deliver Notifications to Webhooks from a Background Thread """
+import http.client
+import logging
+import queue
+import threading
+import time
+import urllib.parse
+from .core import *
+from . import instrument
+
+# Slack attachment colour for each notification() status
+SLACK_COLOURS = {
+    'ok': 'good',
+    'warning': 'warning',
+    'error': 'danger',
+    'info': '#439FE0'
+}
+
+
+class TokenBucket:
+    """ Allow rate sends per second on average, and bursts of up to burst """
+
+    def __init__(self, rate = None, burst = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self):
+        wf_now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (wf_now - self.updated) * self.rate)
+        self.updated = wf_now
+
+    def wait(self):
+        """ Seconds until a send is allowed """
+        if not self.rate:
+            return 0
+        self.refill()
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        """ Use up a send if one is allowed now """
+        if not self.rate:
+            return True
+        self.refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class WebhookChannel:
+    """ Webhook taking a JSON POST - one HTTP connection is kept open between deliveries """
+
+    def __init__(self, url, rate = 1.0, burst = 5, timeout = 10):
+        """ rate - messages posted per second (None for no limit), burst - posts allowed at once after a quiet spell """
+        self.url = urllib.parse.urlsplit(url)
+        self.path = self.url.path or "/"
+        if self.url.query:
+            self.path += "?" + self.url.query
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate, burst)
+        self.connection = None
+
+    def connect(self):
+        if self.url.scheme == 'https':
+            return http.client.HTTPSConnection(self.url.netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(self.url.netloc, timeout=self.timeout)
+
+    def payload(self, messages):
+        """ Body posted for a batch of (title, text, status) messages """
+        return json.dumps([{"title": msgtitle, "text": msgtext, "status": msgstatus} for msgtitle, msgtext, msgstatus in messages])
+
+    @instrument.timed('send')
+    def post(self, messages):
+        """ Post a batch of messages, returns None if delivered, otherwise the error """
+        body = self.payload(messages).encode("utf-8")
+        error = None
+        for attempt in range(2):
+            response = None
+            try:
+                if self.connection is None:
+                    self.connection = self.connect()
+                self.connection.request("POST", self.path, body, {"Content-Type": "application/json"})
+                response = self.connection.getresponse()
+                text = response.read()
+                if response.status < 300:
+                    return None
+                return "HTTP " + str(response.status) + ": " + text.decode("utf-8", "replace")
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError) as e:
+                # A kept-alive connection closed by the server - posted again only if no response was read
+                error = str(e) or type(e).__name__
+                self.close()
+                if response is not None:
+                    return error
+            except (http.client.HTTPException, OSError) as e:
+                # Anything else (e.g. a timeout) may be after the server had the post, so it isn't repeated
+                self.close()
+                return str(e) or type(e).__name__
+        return error
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class SlackChannel(WebhookChannel):
+    """ Slack incoming webhook - a batch is posted as one message with an attachment per notification """
+
+    def __init__(self, url, channel = None, username = 'WeatherFlow', icon = ':mostly_sunny:', rate = 1.0, burst = 5, timeout = 10):
+        WebhookChannel.__init__(self, url, rate, burst, timeout)
+        self.channel = channel
+        self.username = username
+        self.icon = icon
+
+    def payload(self, messages):
+        slack = {
+            "username": self.username,
+            "icon_emoji": self.icon,
+            "attachments": [{
+                "color": SLACK_COLOURS.get(msgstatus, '#808080'),
+                "title": msgtitle,
+                "text": msgtext
+            } for msgtitle, msgtext, msgstatus in messages]
+        }
+        if self.channel:
+            slack['channel'] = self.channel
+        return json.dumps(slack)
+
+
+class Dispatcher:
+    """ Queue notifications for a delivery thread, so a slow webhook never holds up receiving packets.
+        Messages queued while a channel is rate limited, or that arrive together, are posted as one
+        batch of up to batch messages. on_error(channel, messages, error) is called for failed posts """
+
+    def __init__(self, channels, queue_size = 1000, batch = 10, on_error = None, pending_size = None):
+        """ channels - dict of channel name to WebhookChannel, pending_size - messages held for a rate
+            limited channel (queue_size if None), more are dropped """
+        self.channels = channels
+        self.queue = queue.Queue(queue_size)
+        self.batch = batch
+        self.pending_size = queue_size if pending_size is None else pending_size
+        self.on_error = on_error
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0  # Messages not queued because the queue, or the channel's pending messages, were full
+        self.closing = False
+        self.worker = threading.Thread(target=self.run, name="weatherflow-dispatch", daemon=True)
+        self.worker.start()
+
+    def send(self, msgtitle, msgtext, msgstatus, channel = None):
+        """ Queue a message for channel (all channels if None), returns False if the queue is full """
+        try:
+            self.queue.put_nowait((channel, (msgtitle, msgtext, msgstatus)))
+            if instrument.active is not None:
+                instrument.active.queue('dispatch', self.queue.qsize())
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self, timeout = None):
+        """ Deliver what is queued and stop the delivery thread """
+        if not self.worker.is_alive():
+            return
+        self.closing = True  # Seen by the worker once the queue is empty, if the marker doesn't fit
+        try:
+            self.queue.put_nowait((None, None))
+        except queue.Full:
+            pass
+        self.worker.join(timeout)
+        for channel in self.channels.values():
+            channel.close()
+
+    def run(self):
+        """ Delivery thread """
+        pending = {}
+        stopping = False
+        while not stopping or pending:
+            if not stopping:
+                try:
+                    stopping = self.add(pending, self.queue.get(timeout=self.next_post(pending)))
+                    while not stopping:  # Everything that arrived together
+                        stopping = self.add(pending, self.queue.get_nowait())
+                except queue.Empty:
+                    stopping = self.closing
+            elif pending:
+                time.sleep(self.next_post(pending))
+            self.deliver(pending)
+
+    def add(self, pending, item):
+        """ Add a queued message to the pending batches, returns True for the close() marker """
+        channel, message = item
+        if message is None:
+            return True
+        for name in ([channel] if channel is not None else self.channels):
+            if name not in self.channels:
+                logging.error("Notification for unknown channel " + str(name))
+                continue
+            messages = pending.setdefault(name, [])
+            if len(messages) < self.pending_size:
+                messages.append(message)
+            else:
+                self.dropped += 1
+        return False
+
+    def next_post(self, pending):
+        """ Seconds until a channel with pending messages may post, None if nothing is pending """
+        if not pending:
+            return None
+        return min(self.channels[name].bucket.wait() for name in pending)
+
+    def deliver(self, pending):
+        """ Post a batch to every channel with pending messages that isn't rate limited """
+        for name in list(pending):
+            channel = self.channels[name]
+            if not channel.bucket.take():
+                continue
+            messages = pending[name][:self.batch]
+            del pending[name][:self.batch]
+            if not pending[name]:
+                del pending[name]
+            error = channel.post(messages)
+            if error is None:
+                self.sent += len(messages)
+                continue
+            self.failed += len(messages)
+            logging.error("Error Sending Message to " + str(name) + ": " + str(error))
+            if self.on_error is not None:
+                self.on_error(name, messages, error)
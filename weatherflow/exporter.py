@@ -0,0 +1,161 @@
+""" Prometheus Metrics for the latest Station, Device and Hub Readings - served from a Background Thread """
+import http.server
+import threading
+from .core import *
+from .rules import RULE_FIELDS
+
+# Fields exported as gauges for each packet type - (field, metric name), named <prefix>_<group>_<metric name>
+EXPORT_FIELDS = {
+    'obs_st': ('obs', (
+        ('Time (epoch)', 'time_seconds'),
+        ('Wind Lull (m/s)', 'wind_lull_mps'),
+        ('Wind Average (m/s)', 'wind_avg_mps'),
+        ('Wind Gust (m/s)', 'wind_gust_mps'),
+        ('Wind Direction (degrees)', 'wind_direction_degrees'),
+        ('Station Pressure (millibars)', 'station_pressure_mb'),
+        ('Air Temperature (C)', 'air_temperature_celsius'),
+        ('Relative Humidity (%)', 'relative_humidity_percent'),
+        ('Illuminance (Lux)', 'illuminance_lux'),
+        ('UV Index', 'uv_index'),
+        ('Solar Radiation (W/m^2)', 'solar_radiation_wm2'),
+        ('Rain over passed minute (mm)', 'rain_minute_mm'),
+        ('Precipitation Type', 'precipitation_type'),
+        ('Lightning Strike Avg Distance (km)', 'lightning_distance_km'),
+        ('Lightning Strike Count', 'lightning_strikes'),
+        ('Battery Voltage', 'battery_volts')
+    )),
+    'device_status': ('device', (
+        ('Station RSSI (dBm)', 'rssi_dbm'),
+        ('Hub RSSI (dBm)', 'hub_rssi_dbm'),
+        ('Battery Voltage', 'battery_volts'),
+        ('Battery Mode', 'battery_mode'),
+        ('Uptime (seconds)', 'uptime_seconds')
+    )),
+    'hub_status': ('hub', (
+        ('WiFi RSSI (dBm)', 'wifi_rssi_dbm'),
+        ('Uptime (seconds)', 'uptime_seconds'),
+        ('Sequence', 'sequence'),
+        ('Radio Reboot Count', 'radio_reboots'),
+        ('Radio I2C Bus Error Count', 'radio_i2c_errors'),
+        ('Radio Status', 'radio_status')
+    ))
+}
+
+EXPORT_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsExporter:
+    """ Serve the latest readings of every station and hub, and counters such as packets received, on
+        http://address:port/metrics in the Prometheus text format. Each sample line is formatted when its
+        value changes, and a metric's block of lines only when one of them has - a scrape just joins the
+        cached blocks. port = 0 picks a free port (see .port). There is no authentication, so only local
+        clients can connect unless address is set, e.g. '' for every interface """
+
+    def __init__(self, port = 9110, address = '127.0.0.1', prefix = 'weatherflow'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.families = {}  # metric name - type, samples (labels text - line) and the cached block
+        self.values = {}  # (metric name, labels text) - value
+        self.text = None  # Cached exposition, None once something has changed
+        self.scrapes = 0
+        exporter = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = exporter.exposition()
+                self.send_response(200)
+                self.send_header("Content-Type", EXPORT_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((address, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name="weatherflow-metrics", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def update(self, wf_type, wf_serial, wf_json):
+        """ Export the readings of a decoded (type, serial, json) event and count it """
+        if not wf_type:
+            if 'category' in wf_json:  # Not a receive timeout
+                self.count('decode_errors_total', {'category': wf_json['category']})
+            return
+        self.count('packets_total', {'type': wf_type})
+        if wf_type not in EXPORT_FIELDS:
+            return
+        group, fields = EXPORT_FIELDS[wf_type]
+        labels = {'serial': wf_serial}
+        with self.lock:
+            for field, metric in fields:
+                name = self.prefix + "_" + group + "_" + metric
+                if field in RULE_FIELDS:
+                    source, derive = RULE_FIELDS[field]
+                    value = wf_json.get(source)
+                    if value is not None:
+                        value = derive(value, self.values.get((name, label_text(labels)), 255))
+                else:
+                    value = wf_json.get(field)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self.sample(name, 'gauge', labels, value)
+
+    def set(self, name, value, labels = None, kind = 'gauge'):
+        """ Set a gauge, e.g. set('queue_depth', 3), or a counter kept elsewhere (kind = 'counter') """
+        with self.lock:
+            self.sample(self.prefix + "_" + name, kind, labels or {}, value)
+
+    def count(self, name, labels = None, amount = 1):
+        """ Add to a counter, e.g. count('notifications_total', {'event': 'offline'}) """
+        name = self.prefix + "_" + name
+        labels = labels or {}
+        with self.lock:
+            self.sample(name, 'counter', labels, self.values.get((name, label_text(labels)), 0) + amount)
+
+    def sample(self, name, kind, labels, value):
+        """ Store a value, reformatting its line only if it changed - call with the lock held """
+        labels = label_text(labels)
+        if self.values.get((name, labels)) == value:
+            return
+        self.values[(name, labels)] = value
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = {'type': kind, 'samples': {}, 'text': None}
+        family['samples'][labels] = name + labels + " " + metric_value(value) + "\n"
+        family['text'] = None
+        self.text = None
+
+    def exposition(self):
+        """ The metrics page as bytes, rebuilding only the metrics that changed since the last scrape """
+        with self.lock:
+            self.scrapes += 1
+            if self.text is None:
+                blocks = []
+                for name, family in self.families.items():
+                    if family['text'] is None:
+                        family['text'] = "# TYPE " + name + " " + family['type'] + "\n" + "".join(family['samples'].values())
+                    blocks.append(family['text'])
+                self.text = "".join(blocks).encode("utf-8")
+            return self.text
+
+
+def label_text(labels):
+    """ {key="value",...} for a dict of labels """
+    if not labels:
+        return ""
+    return "{" + ",".join(key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+                          for key, value in sorted(labels.items())) + "}"
+
+def metric_value(value):
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
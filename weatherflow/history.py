@@ -0,0 +1,123 @@
+""" Per-station obs_st and rapid_wind History in NumPy Ring Buffers """
+import time
+from .core import *
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# 24 hours of history - obs_st is sent every minute, rapid_wind every 3 seconds
+HISTORY_OBS_ST = 1440
+HISTORY_RAPID_WIND = 28800
+
+
+class RingBuffer:
+    """ Fixed capacity ring of float64 rows with O(1) append.
+        Every row is written twice (at i and i + capacity) so the rows held are always one
+        contiguous slice of the array - views are returned without copying, at the cost of
+        twice the memory of a plain ring """
+
+    def __init__(self, capacity, columns):
+        if numpy is None:
+            raise ImportError("numpy is required for weatherflow history")
+        self.capacity = int(capacity)
+        self.data = numpy.full((2 * self.capacity, columns), numpy.nan)
+        self.head = 0  # Next row written
+        self.count = 0  # Rows held, up to capacity
+
+    def __len__(self):
+        return self.count
+
+    def append(self, row):
+        """ Add a row, overwriting the oldest once the buffer is full """
+        self.data[self.head] = row
+        self.data[self.head + self.capacity] = row
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def view(self):
+        """ Zero-copy view of the rows held, oldest first """
+        if self.count < self.capacity:
+            return self.data[:self.count]
+        return self.data[self.head:self.head + self.capacity]
+
+    def window(self, start = None, end = None, column = 0):
+        """ Zero-copy view of the rows with start <= row[column] <= end, found by bisection.
+            Rows must be appended in time order for the window to be exact """
+        rows = self.view()
+        times = rows[:, column]
+        first = 0 if start is None else numpy.searchsorted(times, start, 'left')
+        last = len(rows) if end is None else numpy.searchsorted(times, end, 'right')
+        return rows[first:last]
+
+
+class StationHistory:
+    """ obs_st and rapid_wind history for each station, keyed by Station Serial.
+        obs_st rows follow the MAP_OBS_ST columns and rapid_wind rows the MAP_RAPID_WIND columns,
+        with missing values (or a failed temperature sensor) stored as NaN """
+
+    def __init__(self, obs_capacity = HISTORY_OBS_ST, wind_capacity = HISTORY_RAPID_WIND):
+        if numpy is None:
+            raise ImportError("numpy is required for weatherflow history")
+        self.obs_capacity = obs_capacity
+        self.wind_capacity = wind_capacity
+        self.obs = {}
+        self.wind = {}
+
+    def add(self, wf_json):
+        """ Store a decoded obs_st or rapid_wind event (dict or Record), returns True if it was kept """
+        if isinstance(wf_json, ObsSt):
+            serial = wf_json.serial
+            row = [getattr(wf_json, name) for name in OBS_ST_FIELDS]
+        elif isinstance(wf_json, RapidWind):
+            serial = wf_json.serial
+            row = [wf_json.time, wf_json.wind_speed, wf_json.wind_direction]
+        elif isinstance(wf_json, dict) and wf_json.get('type') in ('obs_st', 'rapid_wind'):
+            serial = wf_json['Station Serial']
+            columns = MAP_OBS_ST if wf_json['type'] == 'obs_st' else MAP_RAPID_WIND
+            row = [wf_json.get(key) for key in columns]
+        else:
+            return False
+        row = [numpy.nan if value is None else value for value in row]
+        if len(row) == len(MAP_OBS_ST):
+            if row[OBS_ST_FIELDS.index('air_temperature')] == -44.99:  # Failed TEMP Sensor
+                row[OBS_ST_FIELDS.index('air_temperature')] = numpy.nan
+            self.get_buffer(self.obs, serial, self.obs_capacity, len(MAP_OBS_ST)).append(row)
+        else:
+            self.get_buffer(self.wind, serial, self.wind_capacity, len(MAP_RAPID_WIND)).append(row)
+        return True
+
+    def get_buffer(self, buffers, serial, capacity, columns):
+        """ Ring buffer for a station, created on its first packet """
+        if serial not in buffers:
+            buffers[serial] = RingBuffer(capacity, columns)
+        return buffers[serial]
+
+    def serials(self):
+        """ Stations with any history """
+        return sorted(set(self.obs) | set(self.wind))
+
+    def obs_st(self, serial, start = None, end = None):
+        """ obs_st rows (MAP_OBS_ST columns) for a station between start and end epoch, oldest first """
+        if serial not in self.obs:
+            return numpy.empty((0, len(MAP_OBS_ST)))
+        return self.obs[serial].window(start, end)
+
+    def rapid_wind(self, serial, start = None, end = None):
+        """ rapid_wind rows (MAP_RAPID_WIND columns) for a station between start and end epoch, oldest first """
+        if serial not in self.wind:
+            return numpy.empty((0, len(MAP_RAPID_WIND)))
+        return self.wind[serial].window(start, end)
+
+    def last(self, serial, seconds, now = None):
+        """ obs_st and rapid_wind rows for the last number of seconds (e.g. 86400 for 24 hours) """
+        if now is None:
+            now = time.time()
+        return self.obs_st(serial, now - seconds, now), self.rapid_wind(serial, now - seconds, now)
+
+    def column(self, name, wf_type = 'obs_st'):
+        """ Column index of a MAP_OBS_ST (or MAP_RAPID_WIND for rapid_wind) name, e.g. 'Wind Gust (m/s)' """
+        if wf_type == 'rapid_wind':
+            return MAP_RAPID_WIND.index(name)
+        return MAP_OBS_ST.index(name)
@@ -0,0 +1,140 @@
+""" Optional Timing of each Stage of Packet Handling - enable() to start, otherwise each stage only checks active """
+import functools
+import logging
+import time
+
+# Instruments collecting timings, None when instrumentation is off
+active = None
+
+# Histogram buckets are powers of two microseconds - bucket n holds timings below 2 ** n us
+HISTOGRAM_BUCKETS = 32
+
+
+class Instruments:
+    """ Latency histograms for each stage (recv, parse, decode, status, offline, send - decode includes
+        parse), packets counted by type and serial, decode errors by category and queue depths.
+        A summary is logged every log_seconds (None to only use snapshot()) """
+
+    def __init__(self, log_seconds = 60):
+        self.log_seconds = log_seconds
+        self.started = time.perf_counter()
+        self.logged = self.started
+        self.stages = {}  # stage - [count, total seconds, max seconds, histogram]
+        self.packets = {}  # (type, serial) - count
+        self.errors = {}  # category - count
+        self.queues = {}  # name - [depth, max depth]
+
+    def timing(self, stage, seconds):
+        """ Add one timing of a stage """
+        entry = self.stages.get(stage)
+        if entry is None:
+            entry = self.stages[stage] = [0, 0.0, 0.0, [0] * HISTOGRAM_BUCKETS]
+        entry[0] += 1
+        entry[1] += seconds
+        if seconds > entry[2]:
+            entry[2] = seconds
+        entry[3][min(int(seconds * 1000000).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+
+    def time(self, stage, function, *args):
+        """ Call function(*args), timing it as stage """
+        started = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self.timing(stage, time.perf_counter() - started)
+
+    def decoded(self, event, seconds):
+        """ Count a decoded (type, serial, json) event and time its decode """
+        wf_type, wf_serial, wf_json = event
+        if wf_type:
+            key = (wf_type, wf_serial)
+            self.packets[key] = self.packets.get(key, 0) + 1
+        else:
+            category = wf_json.get('category', 'other')
+            self.errors[category] = self.errors.get(category, 0) + 1
+        self.timing('decode', seconds)
+        if self.log_seconds is not None and time.perf_counter() - self.logged >= self.log_seconds:
+            self.logged = time.perf_counter()
+            logging.info(self.log_line())
+
+    def queue(self, name, depth):
+        """ Current depth of a queue """
+        entry = self.queues.get(name)
+        if entry is None:
+            entry = self.queues[name] = [0, 0]
+        entry[0] = depth
+        if depth > entry[1]:
+            entry[1] = depth
+
+    def snapshot(self, reset = False):
+        """ Everything collected, as a dict - reset = True starts collecting again """
+        stages = {}
+        for stage, (count, total, longest, histogram) in self.stages.items():
+            stages[stage] = {
+                'count': count,
+                'mean_us': round(total / count * 1000000, 1),
+                'max_us': round(longest * 1000000, 1),
+                'p50_us': histogram_percentile(histogram, count, 0.5),
+                'p99_us': histogram_percentile(histogram, count, 0.99),
+                'histogram': {2 ** bucket: number for bucket, number in enumerate(histogram) if number}
+            }
+        packets = {}
+        for (wf_type, wf_serial), count in self.packets.items():
+            packets.setdefault(wf_type, {})[wf_serial] = count
+        snapshot = {
+            'seconds': round(time.perf_counter() - self.started, 3),
+            'stages': stages,
+            'packets': packets,
+            'errors': dict(self.errors),
+            'queues': {name: {'depth': depth, 'max': deepest} for name, (depth, deepest) in self.queues.items()}
+        }
+        if reset:
+            self.__init__(self.log_seconds)
+        return snapshot
+
+    def log_line(self):
+        """ One line summary of the snapshot """
+        snapshot = self.snapshot()
+        parts = [stage + " n=" + str(stats['count']) + " p50<" + str(stats['p50_us']) + "us p99<" + str(stats['p99_us']) +
+                 "us max=" + str(stats['max_us']) + "us" for stage, stats in snapshot['stages'].items()]
+        parts.append("packets=" + str(sum(sum(serials.values()) for serials in snapshot['packets'].values())))
+        parts.append("errors=" + str(sum(snapshot['errors'].values())))
+        parts += [name + " queue=" + str(queue['depth']) + "/" + str(queue['max']) for name, queue in snapshot['queues'].items()]
+        return "WeatherFlow timings: " + ", ".join(parts)
+
+
+def histogram_percentile(histogram, count, fraction):
+    """ Upper bound (us) of the bucket holding the fraction'th timing """
+    wanted = fraction * count
+    seen = 0
+    for bucket, number in enumerate(histogram):
+        seen += number
+        if seen >= wanted:
+            return 2 ** bucket
+    return 2 ** (len(histogram) - 1)
+
+def enable(log_seconds = 60):
+    """ Start collecting timings - returns the Instruments, see snapshot() """
+    global active
+    active = Instruments(log_seconds)
+    return active
+
+def disable():
+    global active
+    active = None
+
+def timed(stage):
+    """ Decorator timing each call as stage while instrumentation is enabled """
+    def wrap(function):
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            instruments = active
+            if instruments is None:
+                return function(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                instruments.timing(stage, time.perf_counter() - started)
+        return timed_function
+    return wrap
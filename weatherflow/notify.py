@@ -1,21 +1,45 @@
 from .core import *
+from .store import JournalStore
+from . import instrument
+from collections import deque
+import heapq
 import time
 
 alert_json = {
     "devices": []
 }
 
-class Notifications():
+# (last_seen, serial) for every online device, earliest first - entries left behind when a device
+# is seen again are skipped as they reach the top
+offline_heap = []
+# Offline events found by check_offline() and not returned yet
+offline_pending = deque()
+
+# Source of the current time for status tracking - replaced when replaying captured traffic
+clock = time.time
 
-    def open(self, savestatefile):
-        self.starttime = int(time.time())
+class Notifications():
+    store = None
+
+    def open(self, savestatefile, clock = None, journal = False, store = None):
+        """ Load saved status - clock (e.g. ReplayConnect.clock) replaces time.time for status tracking.
+            journal = True journals each change beside savestatefile (see JournalStore) instead of
+            only saving the whole status on save_status() and close(). store (e.g. an SQLiteStore)
+            saves the status, and every notification, in place of savestatefile """
+        set_clock(clock)
+        self.starttime = now()
         self.savestatefile = savestatefile
-        devices = alert_fileread(self.savestatefile)
-        return devices
+        self.store = store
+        if store is None and journal:
+            self.store = JournalStore(savestatefile)
+        if self.store is None:
+            return alert_fileread(self.savestatefile)
+        return alert_storeread(self.store)
 
     def monitor(self):
         pass
 
+    @instrument.timed('offline')
     def offline(self,timeout = 360):
         """ Offline Device Status Check """
         notify_type = False
@@ -23,24 +47,85 @@ class Notifications():
         notify_event = ''
         notify_json = {}
         # Do not call for at least 2 minutes after startup to prevent false offline messages
-        if int(time.time()) > ( self.starttime + 120):
+        if now() > ( self.starttime + 120):
             notify_type, notify_device, notify_event, notify_json = check_offline(timeout)
+            if notify_type and self.store is not None:
+                self.save_offline(notify_type, notify_device, notify_event, notify_json)
         return notify_type, notify_device, notify_event, notify_json
 
+    @instrument.timed('offline')
+    def offline_all(self, timeout = 360):
+        """ Offline Device Status Check - an event for every device that has gone offline """
+        events = []
+        if now() > ( self.starttime + 120):
+            events = list(offline_pending) + check_offline_all(timeout)
+            offline_pending.clear()
+            if self.store is not None:
+                for event in events:
+                    self.save_offline(*event)
+        return events
+
+    def save_offline(self, notify_type, notify_device, notify_event, notify_json):
+        self.save_change(notify_device, dict(alert_json[notify_device], status='online'))
+        self.store.notification(notify_type, notify_device, notify_event, notify_json, now())
+
+    def offline_deadline(self, timeout = 360):
+        """ Epoch time the next online device would be considered offline, None if none are online """
+        deadline = offline_deadline(timeout)
+        if deadline is not None:
+            deadline = max(deadline, self.starttime + 120)
+        return deadline
+
+    @instrument.timed('status')
     def get_status(self, evt_json):
-        return status(evt_json)
+        if self.store is None:
+            return status(evt_json)
+        serial = status_serial(evt_json)
+        before = dict(alert_json.get(serial, {}))
+        result = status(evt_json)
+        self.save_change(serial, before)
+        if result[0]:
+            self.store.notification(*result, epoch=now())
+        return result
+
+    def save_change(self, serial, before):
+        """ Save the fields of a device that differ from before in the store """
+        if serial not in alert_json:
+            return
+        device = alert_json[serial]
+        fields = {key: value for key, value in device.items() if key not in before or before[key] != value}
+        removed = [key for key in before if key not in device]
+        if fields or removed:
+            self.store.update(serial, fields, removed, now())
+            if self.store.due():
+                self.store.compact(alert_json)
 
     def save_status(self):
-        alert_filewrite(self.savestatefile)
+        if self.store is None:
+            alert_filewrite(self.savestatefile)
+        else:
+            self.store.flush()
 
     def close(self):
         if __debug__: print(json.dumps(alert_json, sort_keys=True, indent=4))
-        alert_filewrite(self.savestatefile)
+        if self.store is None:
+            alert_filewrite(self.savestatefile)
+        else:
+            self.store.close(alert_json)
 
     def readconfig(self, filename):
         return alert_configread(filename)
 
 
+def set_clock(source = None):
+    """ Use source() as the current epoch time for status tracking, or time.time if None """
+    global clock
+    clock = source if source is not None else time.time
+
+def now():
+    """ Current epoch time in whole seconds """
+    return int(clock())
+
 def alert_configread(filename):
     saved_devices = 0
     config = {}
@@ -64,8 +149,15 @@ def alert_fileread(filename):
             saved_devices = len(alert_json['devices'])
     except:
         pass
+    reset_offline()
     return saved_devices
 
+def alert_storeread(store):
+    global alert_json
+    alert_json = store.load()
+    reset_offline()
+    return len(alert_json['devices'])
+
 def alert_filewrite(filename):
     global alert_json
     with open(filename, "w") as jsonfile:
@@ -73,22 +165,13 @@ def alert_filewrite(filename):
     return False
 
 
-def is_json(myjson):
-    """ Return True if source string is valid json """
-    jsontype = 0
-    try:
-        json_object = json.loads(myjson)
-        del json_object
-        jsontype = 1  # Return Type of JSON
-    except:
-        pass
-    try:
-        json_object = json.loads(myjson.decode("utf-8"))
-        del json_object
-        jsontype = 2  # Return Type of JSON
-    except:
-        pass
-    return json
+def status_serial(evt_json):
+    """ Serial number of the device whose status an event updates, None for other events """
+    if evt_json.get('type') == 'device_status':
+        return evt_json.get('Device Serial')
+    if evt_json.get('type') == 'hub_status':
+        return evt_json.get('Hub Serial')
+    return None
 
 def status(evt_json):
     notify_type = False
@@ -192,6 +275,7 @@ def strike_alerts(status_json):
     try:
         notify_json['strike_distance'] = status_json['Distance (km)']
         notify_json['strike_energy'] = status_json['Energy']
+        notify_json['strike_time'] = status_json['Time Epoch']
     except:
         pass
     return notify_type, notify_device, notify_event, notify_json
@@ -227,9 +311,9 @@ def station_alerts(status_json):
             notify_event = 'new_error'
             alert_json[serial]['station_sensors'] = "Unknown"
         if 'Battery Voltage' in status_json:
-            pass
+            alert_json[serial]['battvolts'] = float(status_json['Battery Voltage'])
         alert_json[serial]['type'] = 'station'
-        alert_json[serial]['last_seen'] = int(time.time())
+        device_seen(serial)
         alert_json[serial]['status'] = 'online'
         notify_type = 'hub'
         notify_type = 'station'
@@ -238,7 +322,7 @@ def station_alerts(status_json):
         return notify_type, notify_device, notify_event, notify_json
 
     # Update last seen value - time in epoch
-    alert_json[serial]['last_seen'] = int(time.time())
+    device_seen(serial)
 
     # Check if device was offline
     if alert_json[serial]['status'] != 'online':
@@ -258,7 +342,7 @@ def station_alerts(status_json):
             if station_log > station_now:
                 notify_type = 'station'
                 notify_event = 'reboot'
-                notify_json = status_json
+                notify_json = dict(status_json)
                 notify_json['old_uptime'] = station_log
                 return notify_type, notify_device, notify_event, notify_json
 
@@ -271,7 +355,7 @@ def station_alerts(status_json):
                 alert_json[serial]['firmware'] = station_now
                 notify_type = 'station'
                 notify_event = 'firmware'
-                notify_json = status_json
+                notify_json = dict(status_json)
                 notify_json['old_firmware'] = station_log
                 return notify_type, notify_device, notify_event, notify_json
 
@@ -340,7 +424,7 @@ def hub_alerts(status_json):
         else:
             alert_json[serial]['uptime'] = 0
         alert_json[serial]['type'] = 'hub'
-        alert_json[serial]['last_seen'] = int(time.time())
+        device_seen(serial)
         alert_json[serial]['status'] = 'online'
         notify_type = 'hub'
         notify_event = 'new_ok'
@@ -348,7 +432,7 @@ def hub_alerts(status_json):
         return notify_type, notify_device, notify_event, notify_json
 
     # Update last seen value - time in epoch
-    alert_json[serial]['last_seen'] = int(time.time())
+    device_seen(serial)
 
     # Check if device was offline
     if alert_json[serial]['status'] != 'online':
@@ -368,7 +452,7 @@ def hub_alerts(status_json):
             if station_log > station_now:
                 notify_type = 'hub'
                 notify_event = 'reboot'
-                notify_json = status_json
+                notify_json = dict(status_json)
                 notify_json['old_uptime'] = station_log
                 return notify_type, notify_device, notify_event, notify_json
 
@@ -381,37 +465,67 @@ def hub_alerts(status_json):
                 alert_json[serial]['firmware'] = station_now
                 notify_type = 'hub'
                 notify_event = 'firmware'
-                notify_json = status_json
+                notify_json = dict(status_json)
                 notify_json['old_uptime'] = station_log
                 return notify_type, notify_device, notify_event, notify_json
 
-    # TODO Hub Wifi RSSI Monitoring
-    # "WiFi RSSI (dBm)": -41,
-    # "WiFi RSSI Quality": "Excellent",
+    # Hub Wifi RSSI Monitoring is a config rule (see RuleEngine and samples/weatherflowmon.config)
 
     return notify_type, notify_device, notify_event, notify_json
 
 # device_status scheduled monitor
-def check_offline(timeout):
-    """ Check if something has gone offline by checking the last_seen agains current time """
+def device_seen(serial):
+    """ Update last_seen for a device and queue when it would go offline """
+    seen = now()
+    if alert_json[serial].get('last_seen') != seen or alert_json[serial].get('status') != 'online':
+        heapq.heappush(offline_heap, (seen, serial))
+    alert_json[serial]['last_seen'] = seen
+
+def offline_entry_current(last_seen, device):
+    """ True if an offline_heap entry is for an online device not seen since """
+    return device in alert_json and alert_json[device].get('status') == 'online' and alert_json[device].get('last_seen') == last_seen
+
+def reset_offline():
+    """ Rebuild offline_heap from alert_json after it has been loaded """
+    global offline_heap
+    offline_heap = [(alert_json[device]['last_seen'], device) for device in alert_json.get('devices', [])
+                    if device in alert_json and alert_json[device].get('status') == 'online' and 'last_seen' in alert_json[device]]
+    heapq.heapify(offline_heap)
+    offline_pending.clear()
+
+def check_offline_all(timeout):
+    """ Mark every device not seen for timeout seconds offline, returning an offline event for each.
+        Only the earliest deadline is looked at when none have passed """
     global alert_json
-    notify_type = False
-    notify_device = ''
-    notify_event = ''
-    notify_json = {}
-    for device in alert_json['devices']:
-        wf_now = int(time.time())
-        wf_device = alert_json[device]['last_seen']
-        wf_status = alert_json[device]['status']
-        if wf_status == 'online' and (wf_device + timeout) < wf_now:
+    wf_now = now()
+    events = []
+    while offline_heap and offline_heap[0][0] + timeout < wf_now:
+        last_seen, device = heapq.heappop(offline_heap)
+        if offline_entry_current(last_seen, device):
             print("Device is Offline: " + str(device))
             alert_json[device]['status'] = 'offline'
-            notify_type = alert_json[device]['type']
-            notify_device = device
-            notify_event = 'offline'
-            notify_json = alert_json[device]
-            break
-    return notify_type, notify_device, notify_event, notify_json
+            events.append((alert_json[device]['type'], device, 'offline', alert_json[device]))
+    return events
+
+def check_offline(timeout):
+    """ Check if something has gone offline by checking the last_seen agains current time - one device per call """
+    if not offline_pending:
+        offline_pending.extend(check_offline_all(timeout))
+    if offline_pending:
+        return offline_pending.popleft()
+    return False, '', '', {}
+
+def offline_deadline(timeout):
+    """ Earliest time at which check_offline() could report an online device as offline """
+    if offline_pending:
+        return now()
+    while offline_heap:
+        last_seen, device = offline_heap[0]
+        if offline_entry_current(last_seen, device):
+            # check_offline() needs last_seen + timeout to be strictly less than now
+            return last_seen + timeout + 1
+        heapq.heappop(offline_heap)
+    return None
 
 def notification(alert_type, alert_device, alert_event, alert_json):
     """ Turn the Raw data into a human readable notification with Status Types """
@@ -424,8 +538,12 @@ def notification(alert_type, alert_device, alert_event, alert_json):
         msgstatus = 'warning'
     elif alert_event in ['new_error', 'offline', 'battery_critical', 'sensors_error']:
         msgstatus = 'error'
-    elif alert_event in ['strike', 'precip']:
+    elif alert_event in ['strike', 'precip', 'strike_summary', 'precip_summary']:
         msgstatus = 'info'
+    elif alert_event == 'rule':
+        msgstatus = alert_json['status']
+    elif alert_event == 'rule_ok':
+        msgstatus = 'ok'
     else:
         msgstatus = 'error'
     # Process Messages for each Alert
@@ -461,6 +579,25 @@ def notification(alert_type, alert_device, alert_event, alert_json):
     elif alert_event == 'precip':
         msgtitle += "Rain has Been Detected"
         msgtext = "It is Raining"
+    elif alert_event == 'strike_summary':
+        msgtitle += "Lightning has Been Detected " + str(alert_json['count']) + " times"
+        msgtext = "From " + epoch_text(alert_json['first']) + " to " + epoch_text(alert_json['last'])
+        if 'strike_distance_min' in alert_json:
+            msgtext += "\nClosest Lightning @ " + str(alert_json['strike_distance_min']) + " km, Average " + \
+                       str(alert_json['strike_distance_mean']) + " km\nHighest Energy Level is " + str(alert_json['strike_energy_max'])
+    elif alert_event == 'precip_summary':
+        msgtitle += "Rain has Been Detected " + str(alert_json['count']) + " times"
+        msgtext = "It is Raining\nFrom " + epoch_text(alert_json['first']) + " to " + epoch_text(alert_json['last'])
+    elif alert_event == 'rule':
+        msgtitle += alert_json['title']
+        msgtext = str(alert_json['field']) + " is " + str(alert_json['value'])
+        if 'old_value' in alert_json:
+            msgtext += " (was " + str(alert_json['old_value']) + ")"
+        else:
+            msgtext += " since " + epoch_text(alert_json['since'])
+    elif alert_event == 'rule_ok':
+        msgtitle += alert_json['title'] + " has Cleared"
+        msgtext = str(alert_json['field']) + " is " + str(alert_json['value'])
     elif alert_event == 'sensors_ok':
         msgtitle += "Sensor Status is now OK"
         msgtext = "Was: " + str(alert_json['old_station_sensors'])
@@ -0,0 +1,153 @@
+""" Receive on one Thread and Decode in a Pool of Worker Processes """
+import multiprocessing
+import queue
+import signal
+import struct
+import threading
+import zlib
+from .core import *
+
+SLOT_HEADER = struct.Struct('<I')
+SLOT_STOP = 0xFFFFFFFF  # Slot length telling a worker to exit
+
+
+class SharedRing:
+    """ Single producer, single consumer ring of datagrams in shared memory.
+        Semaphores count the free and filled slots; each side keeps its own position """
+
+    def __init__(self, slots = 1024, slotsize = 4096):
+        self.slots = slots
+        self.slotsize = slotsize + SLOT_HEADER.size
+        self.memory = multiprocessing.RawArray('B', slots * self.slotsize)
+        self.free = multiprocessing.Semaphore(slots)
+        self.filled = multiprocessing.Semaphore(0)
+        self.head = 0  # Next slot written (producer)
+        self.tail = 0  # Next slot read (consumer)
+        self.view = None
+
+    def buffer(self):
+        if self.view is None:
+            self.view = memoryview(self.memory).cast('B')
+        return self.view
+
+    def put(self, data, block = False, timeout = None):
+        """ Copy a datagram into the ring, returns False (dropped) if the ring is full and block is False,
+            or stays full for timeout seconds """
+        if not self.free.acquire(block, timeout):
+            return False
+        offset = self.head * self.slotsize
+        view = self.buffer()
+        if data is None:
+            SLOT_HEADER.pack_into(view, offset, SLOT_STOP)
+        else:
+            length = min(len(data), self.slotsize - SLOT_HEADER.size)
+            SLOT_HEADER.pack_into(view, offset, length)
+            view[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + length] = data[:length]
+        self.head = (self.head + 1) % self.slots
+        self.filled.release()
+        return True
+
+    def get(self, timeout = None):
+        """ Next datagram as bytes, None for the stop marker, or False if nothing arrived within timeout """
+        if not self.filled.acquire(True, timeout):
+            return False
+        offset = self.tail * self.slotsize
+        view = self.buffer()
+        length = SLOT_HEADER.unpack_from(view, offset)[0]
+        data = None if length == SLOT_STOP else bytes(view[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + length])
+        self.tail = (self.tail + 1) % self.slots
+        self.free.release()
+        return data
+
+
+def parallel_worker(ring, results, privacy = False, records = True):
+    """ Worker process - decode datagrams from the ring and return the events """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Shutdown is driven by ParallelConnect.close()
+    while True:
+        data = ring.get()
+        if data is None:
+            break
+        results.put(decode_packet(data, privacy, records))
+    results.close()
+    results.join_thread()
+
+
+class ParallelConnect:
+    """ Connect for large fleets - a receiver thread only calls recv and hands each datagram to a
+        pool of worker processes through shared memory rings, so the kernel socket buffer is drained
+        while decoding happens elsewhere. Packets are sharded by serial number, so events from each
+        device are returned in the order they were received """
+
+    def __init__(self, ip = '255.255.255.255', port = 50222, privacy = False, buffer = 4096, records = True, workers = None, slots = 1024):
+        """ Initilise - records defaults to True so compact Record objects cross the process boundary """
+        self.tempest = opensocket(ip, port)
+        self.tempest.settimeout(0.5)  # Lets the receiver thread notice close()
+        self.buffersize = buffer
+        self.dropped = 0  # Datagrams discarded because a worker's ring was full
+        self.received = 0
+        self.results = multiprocessing.Queue()
+        self.rings = []
+        self.workers = []
+        for _ in range(workers or multiprocessing.cpu_count()):
+            ring = SharedRing(slots, buffer)
+            worker = multiprocessing.Process(target=parallel_worker, args=(ring, self.results, privacy, records), daemon=True)
+            worker.start()
+            self.rings.append(ring)
+            self.workers.append(worker)
+        self.stopping = False
+        self.receiver = threading.Thread(target=self.receive, name="weatherflow-receiver", daemon=True)
+        self.receiver.start()
+
+    def receive(self):
+        """ Receiver thread - recv, find the serial number and pass the datagram to its worker """
+        packet = bytearray(self.buffersize)
+        view = memoryview(packet)
+        while not self.stopping:
+            try:
+                nbytes, addr = self.tempest.recvfrom_into(view)
+            except socket.timeout:
+                continue
+            except OSError:
+                break  # Socket closed
+            self.received += 1
+            serial = peek_field(packet, b'"serial_number"', nbytes) or b''
+            if not self.rings[zlib.crc32(serial) % len(self.rings)].put(view[:nbytes]):
+                self.dropped += 1
+
+    def get_event(self):
+        """ Wait for the next decoded (type, serial, json) event """
+        try:
+            return self.results.get(timeout=WEATHERFLOW_UDP_TIMEOUT)
+        except queue.Empty:
+            wf_json = {
+                "error": "UDP Packet Timeout of " + str(WEATHERFLOW_UDP_TIMEOUT) + " seconds exceeded",
+                "value": "This could be because no weather stations are online"
+            }
+            return False, None, wf_json
+
+    def get_events(self, max_batch = 64, timeout = WEATHERFLOW_UDP_TIMEOUT):
+        """ Wait up to timeout seconds for an event, then return it with any others already decoded """
+        events = []
+        try:
+            events.append(self.results.get(timeout=timeout))
+            while len(events) < max_batch:
+                events.append(self.results.get_nowait())
+        except queue.Empty:
+            pass
+        return events
+
+    def close(self):
+        """ Stop the receiver thread and workers - Closing Resources """
+        self.stopping = True
+        self.receiver.join()
+        self.tempest.close()
+        for ring, worker in zip(self.rings, self.workers):
+            if worker.is_alive():
+                ring.put(None, block=True, timeout=1)  # Not waited for if the worker is stuck and its ring full
+        for worker in self.workers:
+            worker.join(5)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join(1)
+        self.results.close()
+        if __debug__: print("Closing WeatherFlow Routines")
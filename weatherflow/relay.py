@@ -0,0 +1,240 @@
+""" Relay Decoded Events from one Connect to Local Processes over a Unix Socket """
+import os
+import selectors
+import stat
+import threading
+from collections import deque
+from .core import *
+
+# What Relay does when a subscriber's queue is full - drop its oldest frame, or disconnect it
+RELAY_POLICIES = ('oldest', 'disconnect')
+
+
+class RelaySubscriber:
+    """ A connected RelayClient - frames waiting to be sent, and the types and serials it asked for """
+
+    def __init__(self, sock, maxlen):
+        self.sock = sock
+        self.maxlen = maxlen
+        self.frames = deque()
+        self.pending = None  # Rest of a frame the socket only took part of
+        self.received = b''
+        self.types = None
+        self.serials = None
+        self.dropped = 0
+
+    def wants(self, type_bytes, serial_bytes):
+        return (self.types is None or type_bytes in self.types) and (self.serials is None or serial_bytes in self.serials)
+
+    def request(self, line):
+        """ Apply a {"types": [...], "serials": [...]} line sent by the client """
+        try:
+            wanted = json.loads(line)
+        except ValueError:
+            return
+        if wanted.get('types') is not None:
+            self.types = frozenset(wf_type.encode() for wf_type in wanted['types'])
+        if wanted.get('serials') is not None:
+            self.serials = frozenset(serial.encode() for serial in wanted['serials'])
+
+
+class Relay:
+    """ Receive and decode packets once, and send each event as a line of JSON, [type, serial, json], to every
+        RelayClient connected to a Unix stream socket at path. A subscriber that doesn't keep up has up to
+        queue frames held for it, then policy 'oldest' drops its oldest frame, or 'disconnect' closes it.
+        Packets no subscriber wants are dropped before they are parsed """
+
+    def __init__(self, path, ip = '255.255.255.255', port = 50222, privacy = False, connection = None, queue = 1024, policy = 'oldest'):
+        """ connection - an open Connect to use in place of ip and port """
+        if policy not in RELAY_POLICIES:
+            raise ValueError("Unknown relay policy " + str(policy) + " - use one of " + ", ".join(RELAY_POLICIES))
+        self.path = path
+        self.queue = queue
+        self.policy = policy
+        self.connection = connection or Connect(ip, port, privacy)
+        try:
+            if stat.S_ISSOCK(os.stat(path).st_mode):
+                os.unlink(path)  # Left behind by an earlier relay
+        except FileNotFoundError:
+            pass
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen()
+        self.server.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.server, selectors.EVENT_READ, None)
+        for sock in self.connection.sockets:
+            self.selector.register(sock, selectors.EVENT_READ, self.connection)
+        self.subscribers = {}  # socket - RelaySubscriber
+        self.published = 0
+        self.skipped = 0  # Datagrams no subscriber wanted
+        self.disconnected = 0  # Subscribers closed by the 'disconnect' policy
+        self.stopping = False
+        self.thread = None
+
+    def pump(self, timeout = WEATHERFLOW_UDP_TIMEOUT):
+        """ Wait up to timeout seconds, then accept subscribers, relay received packets and send queued frames """
+        for key, mask in self.selector.select(timeout):
+            if key.data is None:
+                self.accept()
+            elif key.data is self.connection:
+                for buffer, nbytes, addr, interface in self.connection.get_datagrams(64, 0):
+                    self.publish(buffer, nbytes, interface)
+            else:
+                if mask & selectors.EVENT_READ:
+                    self.read(key.data)
+                if mask & selectors.EVENT_WRITE and key.data.sock in self.subscribers:
+                    self.flush(key.data)
+
+    def run(self):
+        """ Relay until close() """
+        while not self.stopping:
+            self.pump(0.5)
+
+    def start(self):
+        """ Relay from a background thread """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="weatherflow-relay", daemon=True)
+            self.thread.start()
+        return self
+
+    def close(self):
+        """ Stop relaying, disconnect every subscriber and close the connection """
+        self.stopping = True
+        if self.thread is not None:
+            self.thread.join()
+        for subscriber in list(self.subscribers.values()):
+            self.drop(subscriber)
+        self.selector.close()
+        self.server.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        self.connection.close()
+
+    def accept(self):
+        try:
+            sock, addr = self.server.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        subscriber = self.subscribers[sock] = RelaySubscriber(sock, self.queue)
+        self.selector.register(sock, selectors.EVENT_READ, subscriber)
+
+    def read(self, subscriber):
+        """ Requests from a subscriber, or its disconnection """
+        try:
+            data = subscriber.sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.drop(subscriber)
+            return
+        lines = (subscriber.received + data).split(b'\n')
+        subscriber.received = lines.pop()
+        for line in lines:
+            subscriber.request(line)
+
+    def publish(self, data, nbytes = None, interface = None):
+        """ Decode a datagram and queue it for every subscriber that wants it, returns how many there were """
+        if nbytes is None:
+            nbytes = len(data)
+        raw = data.obj if isinstance(data, memoryview) else data  # Pool buffers view a whole bytearray
+        type_bytes = peek_field(raw, b'"type"', nbytes)
+        serial_bytes = peek_field(raw, b'"serial_number"', nbytes)
+        subscribers = [subscriber for subscriber in self.subscribers.values() if subscriber.wants(type_bytes, serial_bytes)]
+        if not subscribers:
+            self.skipped += 1
+            return 0
+        frame = relay_frame(self.connection.decode(data[:nbytes], interface))
+        self.published += 1
+        for subscriber in subscribers:
+            self.send(subscriber, frame)
+        return len(subscribers)
+
+    def send(self, subscriber, frame):
+        """ Send a frame now if nothing is waiting, otherwise queue it under the slow subscriber policy """
+        if subscriber.pending is None and not subscriber.frames:
+            subscriber.frames.append(frame)
+            self.flush(subscriber)
+            return
+        if len(subscriber.frames) >= subscriber.maxlen:
+            if subscriber.sock not in self.subscribers:
+                return  # Already disconnected
+            if self.policy == 'disconnect':
+                self.disconnected += 1
+                self.drop(subscriber)
+                return
+            subscriber.frames.popleft()
+            subscriber.dropped += 1
+        subscriber.frames.append(frame)
+
+    def flush(self, subscriber):
+        """ Send queued frames until the socket is full, then wait for it to be writable """
+        try:
+            while subscriber.pending is not None or subscriber.frames:
+                if subscriber.pending is None:
+                    subscriber.pending = memoryview(subscriber.frames.popleft())
+                sent = subscriber.sock.send(subscriber.pending)
+                subscriber.pending = subscriber.pending[sent:] if sent < len(subscriber.pending) else None
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.drop(subscriber)
+            return
+        waiting = subscriber.pending is not None or subscriber.frames
+        self.selector.modify(subscriber.sock, selectors.EVENT_READ | (selectors.EVENT_WRITE if waiting else 0), subscriber)
+
+    def drop(self, subscriber):
+        if self.subscribers.pop(subscriber.sock, None) is None:
+            return
+        self.selector.unregister(subscriber.sock)
+        subscriber.sock.close()
+
+
+class RelayClient:
+    """ Events from a Relay, with the same get_event() as Connect - types and serials (None for all)
+        ask the relay for only those packets """
+
+    def __init__(self, path, types = None, serials = None, timeout = WEATHERFLOW_UDP_TIMEOUT):
+        self.timeout = timeout
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.received = bytearray()
+        if types is not None or serials is not None:
+            self.sock.sendall(json.dumps({"types": types, "serials": serials}).encode("utf-8") + b'\n')
+
+    def get_event(self):
+        """ Wait for the next decoded (type, serial, json) event, returns None once the relay has closed """
+        while True:
+            end = self.received.find(b'\n')
+            if end >= 0:
+                wf_type, wf_serial, wf_json = json.loads(self.received[:end])
+                del self.received[:end + 1]
+                return wf_type, wf_serial, wf_json
+            self.sock.settimeout(self.timeout)
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                wf_json = {
+                    "error": "UDP Packet Timeout of " + str(self.timeout) + " seconds exceeded",
+                    "value": "This could be because no weather stations are online"
+                }
+                return False, None, wf_json
+            if not data:
+                return None
+            self.received += data
+
+    def close(self):
+        self.sock.close()
+
+
+def relay_frame(event):
+    """ Line of JSON sent by Relay for a (type, serial, json) event """
+    wf_type, wf_serial, wf_json = event
+    if isinstance(wf_json, Record):
+        wf_json = wf_json.as_dict()
+    return json.dumps([wf_type, wf_serial, wf_json], separators=(',', ':'), default=str).encode("utf-8") + b'\n'
@@ -0,0 +1,130 @@
+""" Replay Captured Tempest Packets with the same get_event() contract as Connect """
+import os
+import time
+from .core import *
+from .archive import ArchiveReader
+
+
+def packet_time(wf_pkt):
+    """ Epoch time reported in a raw packet, None if it has none """
+    try:
+        if 'obs' in wf_pkt:
+            return float(wf_pkt['obs'][0][0])
+        if 'ob' in wf_pkt:
+            return float(wf_pkt['ob'][0])
+        if 'evt' in wf_pkt:
+            return float(wf_pkt['evt'][0])
+        if 'timestamp' in wf_pkt:
+            return float(wf_pkt['timestamp'])
+    except (IndexError, TypeError, ValueError):
+        pass
+    return None
+
+
+def read_capture(filename):
+    """ Yield (epoch, sender, packet bytes) from a JSONL capture.
+        Each line is either a raw packet, timed by its own timestamp, or an object with
+        'time', optional 'addr' and the raw 'packet' as received """
+    last = 0.0
+    with open(filename, "rb") as capture:
+        for line in capture:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                yield last, "", line  # Replay invalid packets as they are
+                continue
+            if isinstance(entry, dict) and 'packet' in entry and 'time' in entry:
+                data = entry['packet']
+                if not isinstance(data, str):
+                    data = json.dumps(data)
+                last = float(entry['time'])
+                yield last, entry.get('addr', ""), data.encode("utf-8")
+            else:
+                epoch = packet_time(entry) if isinstance(entry, dict) else None
+                if epoch is not None:
+                    last = epoch
+                yield last, "", line
+
+
+class ReplayConnect:
+    """ Replay a JSONL capture or PacketArchive directory as if the packets were being received.
+        speed = 1 keeps the original timing, speed = N replays N times faster and speed = 0
+        (or None) replays as fast as possible. clock() returns the replayed time, and can be
+        given to Notifications.open() so offline checks follow the capture rather than the wall clock """
+
+    def __init__(self, source, speed = 1.0, privacy = False, records = False, start = None, end = None):
+        """ Initilise """
+        if os.path.isdir(source):
+            self.packets = ArchiveReader(source).read(start, end)
+        else:
+            self.packets = read_capture(source)
+            if start is not None or end is not None:
+                self.packets = (packet for packet in self.packets
+                                if (start is None or packet[0] >= start) and (end is None or packet[0] <= end))
+        self.speed = speed
+        self.privacy = privacy
+        self.records = records
+        self.eof = False
+        self.count = 0
+        self.next_packet = next(self.packets, None)
+        self.replay_time = self.next_packet[0] if self.next_packet else time.time()
+        self.first_time = self.replay_time
+        self.wall_start = None
+
+    def clock(self):
+        """ Receive time of the last packet replayed (the first packet's time before any are replayed) """
+        return self.replay_time
+
+    def close(self):
+        """ Closing Resources """
+        self.packets.close()
+        if __debug__: print("Closing WeatherFlow Routines")
+
+    def wait(self, epoch):
+        """ Sleep until the packet received at epoch is due at the replay speed """
+        if not self.speed:
+            return
+        if self.wall_start is None:
+            self.wall_start = time.monotonic()
+        delay = self.wall_start + (epoch - self.first_time) / self.speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def get_event(self):
+        """ Return the next decoded (type, serial, json) event, or an 'eof' error once the capture is finished """
+        if self.next_packet is None:
+            self.eof = True
+            return False, None, decode_error('eof', "End of replay", str(self.count) + " packets replayed")
+        epoch, addr, data = self.next_packet
+        self.wait(epoch)
+        self.replay_time = epoch
+        self.count += 1
+        self.next_packet = next(self.packets, None)
+        return decode_packet(data, self.privacy, self.records)
+
+    def get_events(self, max_batch = 64, timeout = WEATHERFLOW_UDP_TIMEOUT):
+        """ Return the next packet and any others already due, up to max_batch """
+        events = []
+        if self.next_packet is None:
+            self.eof = True
+            return events
+        events.append(self.get_event())
+        while self.next_packet is not None and len(events) < max_batch and self.due(self.next_packet[0]):
+            events.append(self.get_event())
+        return events
+
+    def due(self, epoch):
+        """ True if the packet received at epoch would already have arrived """
+        if not self.speed:
+            return True
+        return self.wall_start + (epoch - self.first_time) / self.speed <= time.monotonic()
+
+    def __iter__(self):
+        while True:
+            event = self.get_event()
+            if self.eof:
+                return
+            yield event
@@ -0,0 +1,124 @@
+""" Alert Rules from the Config - compiled once into a list of rules for each message type """
+import operator
+from .core import *
+from .notify import get_battmode, now
+
+RULE_OPERATORS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '!=': operator.ne
+}
+
+# Fields worked out from a message field and the value they had last time - (message field, function)
+RULE_FIELDS = {
+    'Battery Mode': ('Battery Voltage', get_battmode)
+}
+
+# Message fields holding the serial number of the device a rule is tracked for, in order of preference
+RULE_SERIALS = ('Device Serial', 'Station Serial', 'Hub Serial')
+
+
+class Rule:
+    """ One rule from the config, e.g.
+        {"name": "hub_rssi", "type": "hub_status", "field": "WiFi RSSI (dBm)", "op": "<", "value": -90, "for": 300}
+        notifies once the field has been below -90 for 5 minutes, and again when it isn't.
+        {"type": "device_status", "field": "Battery Mode", "op": "change"} notifies each time the field changes """
+
+    def __init__(self, config):
+        try:
+            self.type = config['type']
+            self.field = config['field']
+        except KeyError as e:
+            raise ValueError("Alert rule is missing " + str(e) + ": " + json.dumps(config))
+        self.op = config.get('op', 'change')
+        if self.op != 'change' and self.op not in RULE_OPERATORS:
+            raise ValueError("Alert rule has an unknown op " + str(self.op) + ": " + json.dumps(config))
+        self.value = config.get('value')
+        self.duration = config.get('for', 0)
+        self.name = config.get('name', self.field + " " + self.op)
+        self.title = config.get('title', self.field + (" Changed" if self.op == 'change' else " " + self.op + " " + str(self.value)))
+        self.status = config.get('status', 'warning')
+        self.notify_type = 'hub' if self.type == 'hub_status' else 'station'
+        self.source, self.derive = RULE_FIELDS.get(self.field, (self.field, None))
+        self.test = None
+        if self.op != 'change':
+            compare = RULE_OPERATORS[self.op]
+            threshold = self.value
+            self.test = lambda value: compare(value, threshold)
+        self.state = {}  # serial - last value, when the test started passing and whether it has notified
+
+    def check(self, serial, evt_json, wf_now):
+        """ Notification for a message, None if the rule has nothing to say """
+        value = evt_json.get(self.source)
+        if value is None:
+            return None
+        state = self.state.setdefault(serial, {})
+        last = state.get('value')
+        if self.derive is not None:
+            value = self.derive(value, 255 if last is None else last)
+        state['value'] = value
+        if self.test is None:
+            if last is None or last == value:
+                return None
+            return self.event(serial, 'rule', value, {'old_value': last})
+        if not self.test(value):
+            since = state.pop('since', None)
+            if state.pop('fired', False):
+                return self.event(serial, 'rule_ok', value, {'since': since})
+            return None
+        since = state.setdefault('since', wf_now)
+        if state.get('fired') or wf_now - since < self.duration:
+            return None
+        state['fired'] = True
+        return self.event(serial, 'rule', value, {'since': since})
+
+    def event(self, serial, notify_event, value, extra):
+        notify_json = {
+            'rule': self.name,
+            'title': self.title,
+            'status': self.status,
+            'field': self.field,
+            'value': value
+        }
+        notify_json.update(extra)
+        return self.notify_type, serial, notify_event, notify_json
+
+
+class RuleEngine:
+    """ The config rules in a table by message type, so each message only runs the rules for its type,
+        and each rule only reads (and decodes, for records) the one field it tests """
+
+    def __init__(self, rules = ()):
+        self.table = {}
+        for config in rules:
+            self.add(config)
+
+    def add(self, config):
+        rule = Rule(config)
+        self.table.setdefault(rule.type, []).append(rule)
+        return rule
+
+    def check(self, evt_json):
+        """ Notifications from every rule for a decoded message """
+        rules = self.table.get(evt_json.get('type'))
+        if not rules:
+            return []
+        serial = rule_serial(evt_json)
+        wf_now = now()
+        events = []
+        for rule in rules:
+            event = rule.check(serial, evt_json, wf_now)
+            if event is not None:
+                events.append(event)
+        return events
+
+
+def rule_serial(evt_json):
+    """ Serial number of the device a message is about """
+    for key in RULE_SERIALS:
+        if key in evt_json:
+            return evt_json[key]
+    return None
@@ -0,0 +1,228 @@
+""" Device Status Stores - a journal beside the status file, or an SQLite database """
+import os
+import time
+from .core import *
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+# Journal entries written before the status file is rewritten and the journal emptied
+JOURNAL_COMPACT_ENTRIES = 10000
+
+
+def read_snapshot(filename):
+    """ Device status saved in a status file, or no devices if it can't be read """
+    snapshot = {
+        "devices": []
+    }
+    try:
+        with open(filename, "r") as jsonfile:
+            snapshot = json.load(jsonfile)
+    except:
+        pass
+    if 'devices' not in snapshot:
+        snapshot['devices'] = []
+    return snapshot
+
+def apply_change(status, change):
+    """ Apply one journal entry to the device status """
+    serial = change['serial']
+    if serial not in status['devices']:
+        status['devices'].append(serial)
+    device = status.setdefault(serial, {})
+    device.update(change.get('set', {}))
+    for key in change.get('unset', []):
+        device.pop(key, None)
+
+
+class JournalStore:
+    """ Device status as a snapshot (the same status file alert_filewrite writes) plus a journal of the
+        device fields changed since it was written. Each change is one JSON line, flushed as soon as it
+        is written so a killed process loses nothing; fsync = True also survives a power cut """
+
+    def __init__(self, filename, compact_entries = JOURNAL_COMPACT_ENTRIES, fsync = False):
+        self.filename = filename
+        self.journalname = filename + ".journal"
+        self.compact_entries = compact_entries
+        self.fsync = fsync
+        self.journal = None
+        self.entries = 0
+
+    def load(self):
+        """ Snapshot with the journal replayed on top - compacted straight away if there was a journal """
+        status = read_snapshot(self.filename)
+        self.entries = 0
+        try:
+            with open(self.journalname, "r") as journal:
+                for line in journal:
+                    try:
+                        apply_change(status, json.loads(line))
+                    except (ValueError, KeyError):
+                        break  # Partly written last entry
+                    self.entries += 1
+        except OSError:
+            return status
+        self.compact(status)
+        return status
+
+    def update(self, serial, fields, removed = (), epoch = None):
+        """ Journal the fields of a device that were set or removed """
+        change = {"serial": serial, "set": fields}
+        if removed:
+            change['unset'] = list(removed)
+        if epoch is not None:
+            change['time'] = epoch
+        if self.journal is None:
+            self.journal = open(self.journalname, "a")
+        self.journal.write(json.dumps(change, sort_keys=True, separators=(',', ':')) + "\n")
+        self.journal.flush()
+        if self.fsync:
+            os.fsync(self.journal.fileno())
+        self.entries += 1
+
+    def notification(self, notify_type, notify_device, notify_event, notify_json, epoch = None):
+        """ Notifications aren't kept in the journal """
+        pass
+
+    def flush(self):
+        """ Every change is already written """
+        pass
+
+    def due(self):
+        """ True once the journal is long enough to be compacted """
+        return self.entries >= self.compact_entries
+
+    def compact(self, status):
+        """ Replace the snapshot with status and empty the journal """
+        tempname = self.filename + ".tmp"
+        with open(tempname, "w") as jsonfile:
+            json.dump(status, jsonfile, indent=4, sort_keys=True)
+            jsonfile.flush()
+            os.fsync(jsonfile.fileno())
+        os.replace(tempname, self.filename)
+        # A crash before the journal is emptied only replays changes the snapshot already has
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = open(self.journalname, "w")
+        self.entries = 0
+
+    def close(self, status):
+        """ Compact and close the journal """
+        self.compact(status)
+        self.journal.close()
+        self.journal = None
+
+
+# Device fields that change on every packet - kept in device_fields but not in the device_events history
+SQLITE_UNLOGGED_FIELDS = ('last_seen',)
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (serial TEXT PRIMARY KEY, added REAL);
+CREATE TABLE IF NOT EXISTS device_fields (serial TEXT, field TEXT, value TEXT, updated REAL,
+    PRIMARY KEY (serial, field)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS device_events (time REAL, serial TEXT, field TEXT, value TEXT);
+CREATE INDEX IF NOT EXISTS device_events_serial ON device_events (serial, time);
+CREATE INDEX IF NOT EXISTS device_events_field ON device_events (field, time);
+CREATE TABLE IF NOT EXISTS notifications (time REAL, type TEXT, device TEXT, event TEXT, payload TEXT);
+CREATE INDEX IF NOT EXISTS notifications_device ON notifications (device, event, time);
+CREATE INDEX IF NOT EXISTS notifications_event ON notifications (event, time);
+"""
+
+
+class SQLiteStore:
+    """ Device status, the history of device field changes and every notification in an SQLite
+        database (WAL mode). Writes are batched into one transaction, committed once it holds batch
+        changes or on the first write batch_seconds after the last commit, and by flush() """
+
+    def __init__(self, filename, batch = 100, batch_seconds = 1.0):
+        if sqlite3 is None:
+            raise ImportError("sqlite3 is required for SQLiteStore")
+        self.filename = filename
+        self.batch = batch
+        self.batch_seconds = batch_seconds
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SQLITE_SCHEMA)
+        self.pending = 0
+        self.last_commit = time.monotonic()
+
+    def load(self):
+        """ Device status in the same layout as the status file """
+        status = {
+            "devices": []
+        }
+        for serial, in self.db.execute("SELECT serial FROM devices ORDER BY rowid"):
+            status['devices'].append(serial)
+            status[serial] = {}
+        for serial, field, value in self.db.execute("SELECT serial, field, value FROM device_fields"):
+            status.setdefault(serial, {})[field] = json.loads(value)
+        return status
+
+    def update(self, serial, fields, removed = (), epoch = None):
+        """ Save the fields of a device that were set or removed, and log them in device_events """
+        epoch = time.time() if epoch is None else epoch
+        self.db.execute("INSERT OR IGNORE INTO devices (serial, added) VALUES (?, ?)", (serial, epoch))
+        rows = [(serial, field, json.dumps(value), epoch) for field, value in fields.items()]
+        self.db.executemany("INSERT OR REPLACE INTO device_fields (serial, field, value, updated) VALUES (?, ?, ?, ?)", rows)
+        self.db.executemany("DELETE FROM device_fields WHERE serial = ? AND field = ?", [(serial, field) for field in removed])
+        events = [(epoch, serial, field, value) for serial, field, value, updated in rows if field not in SQLITE_UNLOGGED_FIELDS]
+        events += [(epoch, serial, field, None) for field in removed]
+        self.db.executemany("INSERT INTO device_events (time, serial, field, value) VALUES (?, ?, ?, ?)", events)
+        self.written()
+
+    def notification(self, notify_type, notify_device, notify_event, notify_json, epoch = None):
+        """ Log an emitted notification """
+        epoch = time.time() if epoch is None else epoch
+        self.db.execute("INSERT INTO notifications (time, type, device, event, payload) VALUES (?, ?, ?, ?, ?)",
+                        (epoch, notify_type, notify_device, notify_event, json.dumps(notify_json, default=str)))
+        self.written()
+
+    def written(self):
+        """ Commit the batch once it is big or old enough """
+        self.pending += 1
+        if self.pending >= self.batch or time.monotonic() - self.last_commit >= self.batch_seconds:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self.pending = 0
+        self.last_commit = time.monotonic()
+
+    def flush(self):
+        self.commit()
+
+    def due(self):
+        """ The database never needs compacting """
+        return False
+
+    def compact(self, status):
+        """ Commit the current batch - device fields are already up to date """
+        self.commit()
+
+    def close(self, status):
+        self.commit()
+        self.db.close()
+
+    def notifications(self, device = None, event = None, since = None, until = None):
+        """ (time, type, device, event, payload) of the notifications matching every argument given, oldest first.
+            e.g. notifications('HB-00000001', 'reboot', time.time() - 30 * 86400) - reboots of a hub in 30 days """
+        query, args = sqlite_where([('device = ?', device), ('event = ?', event), ('time >= ?', since), ('time <= ?', until)])
+        rows = self.db.execute("SELECT time, type, device, event, payload FROM notifications" + query + " ORDER BY time", args)
+        return [(epoch, notify_type, notify_device, notify_event, json.loads(payload))
+                for epoch, notify_type, notify_device, notify_event, payload in rows]
+
+    def device_history(self, serial, field = None, since = None, until = None):
+        """ (time, field, value) of the changes to a device's fields, oldest first - value is None once removed """
+        query, args = sqlite_where([('serial = ?', serial), ('field = ?', field), ('time >= ?', since), ('time <= ?', until)])
+        rows = self.db.execute("SELECT time, field, value FROM device_events" + query + " ORDER BY time", args)
+        return [(epoch, name, None if value is None else json.loads(value)) for epoch, name, value in rows]
+
+
+def sqlite_where(conditions):
+    """ WHERE clause and arguments for the (condition, value) pairs whose value is not None """
+    used = [(condition, value) for condition, value in conditions if value is not None]
+    if not used:
+        return "", []
+    return " WHERE " + " AND ".join(condition for condition, value in used), [value for condition, value in used]
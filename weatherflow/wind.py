@@ -0,0 +1,135 @@
+""" Rolling Wind Statistics from rapid_wind Packets """
+import math
+from collections import deque
+from .core import *
+
+# Rolling windows in seconds - 2 and 10 minute averages
+WIND_WINDOWS = (120, 600)
+
+
+class WindWindow:
+    """ Sliding time window of wind samples.
+        Running sums give the average speed and vector mean direction, and monotonic queues
+        give the gust (max) and lull (min), so add() and every query are O(1) amortised """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.samples = deque()  # (epoch, speed, east, north)
+        self.gusts = deque()  # (epoch, speed) with decreasing speeds
+        self.lulls = deque()  # (epoch, speed) with increasing speeds
+        self.sum_speed = 0.0
+        self.sum_east = 0.0
+        self.sum_north = 0.0
+        self.latest = None
+
+    def add(self, epoch, speed, direction):
+        """ Add a sample - samples are expected in time order. A sample with no direction (None) counts
+            towards the speeds but not the mean direction """
+        speed = float(speed)
+        if direction is None:
+            east = north = 0.0
+        else:
+            radians = math.radians(float(direction))
+            east = speed * math.sin(radians)
+            north = speed * math.cos(radians)
+        self.samples.append((epoch, speed, east, north))
+        self.sum_speed += speed
+        self.sum_east += east
+        self.sum_north += north
+        while self.gusts and self.gusts[-1][1] <= speed:
+            self.gusts.pop()
+        self.gusts.append((epoch, speed))
+        while self.lulls and self.lulls[-1][1] >= speed:
+            self.lulls.pop()
+        self.lulls.append((epoch, speed))
+        self.latest = epoch
+        self.expire(epoch)
+
+    def expire(self, now):
+        """ Drop samples older than the window ending at now """
+        cutoff = now - self.seconds
+        while self.samples and self.samples[0][0] <= cutoff:
+            epoch, speed, east, north = self.samples.popleft()
+            self.sum_speed -= speed
+            self.sum_east -= east
+            self.sum_north -= north
+        if not self.samples:
+            # Reset the running sums so rounding errors can't accumulate
+            self.sum_speed = self.sum_east = self.sum_north = 0.0
+        while self.gusts and self.gusts[0][0] <= cutoff:
+            self.gusts.popleft()
+        while self.lulls and self.lulls[0][0] <= cutoff:
+            self.lulls.popleft()
+
+    def __len__(self):
+        return len(self.samples)
+
+    def average(self):
+        """ Average wind speed (m/s) """
+        return self.sum_speed / len(self.samples) if self.samples else None
+
+    def direction(self):
+        """ Speed weighted vector mean direction in degrees, None when calm """
+        if abs(self.sum_east) < 1e-9 and abs(self.sum_north) < 1e-9:
+            return None
+        return math.degrees(math.atan2(self.sum_east, self.sum_north)) % 360
+
+    def gust(self):
+        """ Highest sample in the window (m/s) """
+        return self.gusts[0][1] if self.gusts else None
+
+    def lull(self):
+        """ Lowest sample in the window (m/s) """
+        return self.lulls[0][1] if self.lulls else None
+
+
+class WindStats:
+    """ 2 and 10 minute rolling wind statistics for every station, fed by rapid_wind events """
+
+    def __init__(self, windows = WIND_WINDOWS):
+        self.windows = tuple(windows)
+        self.stations = {}
+
+    def add(self, wf_json):
+        """ Update from a decoded rapid_wind event (dict or Record), returns True if it was used """
+        if isinstance(wf_json, RapidWind):
+            serial, epoch, speed, direction = wf_json.serial, wf_json.time, wf_json.wind_speed, wf_json.wind_direction
+        elif isinstance(wf_json, dict) and wf_json.get('type') == 'rapid_wind':
+            serial = wf_json['Station Serial']
+            epoch = wf_json['Time Epoch']
+            speed = wf_json['Wind Speed (m/s)']
+            direction = wf_json['Wind Direction (degrees)']
+        else:
+            return False
+        if speed is None:
+            return False
+        if serial not in self.stations:
+            self.stations[serial] = {seconds: WindWindow(seconds) for seconds in self.windows}
+        for window in self.stations[serial].values():
+            window.add(epoch, speed, direction)
+        return True
+
+    def serials(self):
+        """ Stations with wind statistics """
+        return sorted(self.stations)
+
+    def get(self, serial, seconds = 120, now = None):
+        """ Wind statistics for a station over one of the windows, None if the station is unknown.
+            now (epoch) expires old samples first, otherwise the window ends at the latest sample """
+        if serial not in self.stations:
+            return None
+        window = self.stations[serial][seconds]
+        if now is not None:
+            window.expire(now)
+        direction = window.direction()
+        stats = {
+            'Station Serial': serial,
+            'Window (seconds)': seconds,
+            'Samples': len(window),
+            'Wind Average (m/s)': window.average(),
+            'Wind Gust (m/s)': window.gust(),
+            'Wind Lull (m/s)': window.lull(),
+            'Wind Direction (degrees)': direction,
+            'Wind Direction (text)': None if direction is None else degrees2text(direction)
+        }
+        return stats